@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import shutil
+import zipfile
+from pathlib import Path
+
+from benchmarks.evtx_generator import CHANNELS, write_evtx
+
+
+# CONTENT ------------------------------------------------
+# Profiles of uploads. Each entry is (kind, count, chunks per file), scaled by the scale factor of the run:
+#   evtx: EVTX files uploaded as is
+#   orc: ORC-style zip archives, holding .evtx_data files, a nested archive and non EVTX files
+PROFILES = {
+    "many_small": [("evtx", 200, 1)],
+    "few_huge": [("evtx", 2, 1024)],
+    "orc": [("orc", 4, 16)],
+    "mixed": [("evtx", 50, 2), ("evtx", 1, 512), ("orc", 2, 32)],
+}
+
+
+def _channel_file_name(host: str, channel: str, suffix: str):
+    # As named by the collection tools, the slash of the channels is encoded
+    return "{}_{}{}".format(host, channel.replace("/", "%4"), suffix)
+
+
+def _write_host_logs(directory: Path, host: str, nb_chunks: int, suffix: str, seed: int):
+    """
+    Write one log per channel for a host
+    :return: (files, records)
+    """
+    files = 0
+    records = 0
+    for index, channel in enumerate(CHANNELS):
+        records += write_evtx(directory / _channel_file_name(host, channel, suffix), channel,
+                              nb_chunks=nb_chunks, computer=host, seed=seed + index)
+        files += 1
+
+    return files, records
+
+
+def _write_orc_archive(path: Path, work_dir: Path, host: str, nb_chunks: int, seed: int):
+    """
+    Write an ORC-style archive: event logs as .evtx_data, a nested archive of more logs and some non EVTX files
+    :return: (files, records)
+    """
+    logs_dir = work_dir / host
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    files, records = _write_host_logs(logs_dir, host, nb_chunks, ".evtx_data", seed)
+
+    nested_path = work_dir / "{}_nested.zip".format(host)
+    nested_files, nested_records = _write_host_logs(logs_dir, host + "-bis", max(1, nb_chunks // 4), ".evtx",
+                                                    seed + 100)
+    with zipfile.ZipFile(nested_path, "w", zipfile.ZIP_DEFLATED) as nested:
+        for log_path in sorted(logs_dir.glob("*.evtx")):
+            nested.write(log_path, "Event/{}".format(log_path.name))
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for log_path in sorted(logs_dir.glob("*.evtx_data")):
+            archive.write(log_path, "Event/{}".format(log_path.name))
+        archive.write(nested_path, "Event/{}".format(nested_path.name))
+        archive.writestr("Registry/SYSTEM_data", b"\x00" * 4096)
+        archive.writestr("Config.xml", "<Orc/>")
+
+    shutil.rmtree(logs_dir)
+    nested_path.unlink()
+
+    return files + nested_files, records + nested_records
+
+
+def generate_corpus(profile: str, output_dir: Path, scale: float = 1.0, seed: int = 0):
+    """
+    Generate the upload of a profile
+    :param profile: Name of the profile, one of PROFILES
+    :param output_dir: Upload directory, created
+    :param scale: Factor applied to the number of files and chunks
+    :param seed: Seed of the random values
+    :return: dict describing the corpus
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    work_dir = output_dir.parent / "{}_work".format(output_dir.name)
+
+    description = {"profile": profile, "scale": scale, "uploaded_files": 0, "evtx_files": 0, "records": 0}
+    host_index = 0
+    for kind, count, nb_chunks in PROFILES[profile]:
+        count = max(1, int(count * scale))
+        nb_chunks = max(1, int(nb_chunks * scale))
+
+        for _ in range(count):
+            host = "WKS-{:04d}".format(host_index)
+            host_index += 1
+
+            if kind == "evtx":
+                # One channel per uploaded file, the channels going round
+                channel = list(CHANNELS)[host_index % len(CHANNELS)]
+                records = write_evtx(output_dir / _channel_file_name(host, channel, ".evtx"), channel,
+                                     nb_chunks=nb_chunks, computer=host, seed=seed + host_index)
+                files = 1
+            else:
+                files, records = _write_orc_archive(output_dir / "ORC_{}.zip".format(host), work_dir, host,
+                                                    nb_chunks, seed + host_index)
+
+            description["uploaded_files"] += 1
+            description["evtx_files"] += files
+            description["records"] += records
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    description["bytes"] = sum(path.stat().st_size for path in output_dir.iterdir())
+
+    return description
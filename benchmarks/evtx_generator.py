@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import random
+import struct
+import zlib
+from pathlib import Path
+
+from iris_evtx.EVTXChunks import CHUNK_HEADER_SIZE, CHUNK_MAGIC, CHUNK_SIZE, FILE_HEADER_CHECKSUM_OFFSET, \
+    FILE_HEADER_FLAGS_OFFSET, FILE_HEADER_MAGIC, FILE_HEADER_SIZE, FILE_HEADER_STRUCT, RECORD_MAGIC
+from iris_evtx.EVTXFilters import FILETIME_EPOCH_DELTA
+
+
+# CONTENT ------------------------------------------------
+# Synthetic EVTX files, parsable by evtxdump. Every record of a chunk uses one template, defined inline by the
+# first record of the chunk, as Windows does. The records carry the usual System fields and a few EventData
+RECORD_HEADER_SIZE = 24
+CHUNK_HEADER_CHECKSUM_OFFSET = 0x7C
+CHUNK_TEMPLATES_TABLE_OFFSET = 0x180
+EVENT_NAMESPACE = "http://schemas.microsoft.com/win/2004/08/events/event"
+TEMPLATE_GUID = bytes(range(16))
+
+# BinXML tokens and value types
+TOKEN_EOF = 0x00
+TOKEN_OPEN_START_ELEMENT = 0x01
+TOKEN_CLOSE_START_ELEMENT = 0x02
+TOKEN_CLOSE_EMPTY_ELEMENT = 0x03
+TOKEN_END_ELEMENT = 0x04
+TOKEN_VALUE = 0x05
+TOKEN_ATTRIBUTE = 0x06
+TOKEN_TEMPLATE_INSTANCE = 0x0C
+TOKEN_SUBSTITUTION = 0x0D
+TOKEN_FRAGMENT_HEADER = 0x0F
+TOKEN_MORE_BIT = 0x40
+
+TYPE_STRING = 0x01
+TYPE_UINT8 = 0x04
+TYPE_UINT16 = 0x06
+TYPE_UINT64 = 0x0A
+TYPE_FILETIME = 0x11
+
+# Channels of the generated files, with their provider and the event ids picked from
+CHANNELS = {
+    "Security": ("Microsoft-Windows-Security-Auditing", [4624, 4625, 4634, 4672, 4688, 4689, 4720, 4732]),
+    "System": ("Service Control Manager", [7036, 7040, 7045]),
+    "Microsoft-Windows-Sysmon/Operational": ("Microsoft-Windows-Sysmon", [1, 3, 5, 7, 10, 11, 13, 22]),
+    "Microsoft-Windows-PowerShell/Operational": ("Microsoft-Windows-PowerShell", [4103, 4104, 4105, 4106]),
+}
+
+USERS = ["Administrator", "SYSTEM", "jdoe", "asmith", "svc_backup", "LOCAL SERVICE", "-"]
+PROCESSES = ["C:\\Windows\\System32\\svchost.exe", "C:\\Windows\\System32\\lsass.exe",
+             "C:\\Windows\\explorer.exe", "C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe",
+             "C:\\Windows\\System32\\cmd.exe", "-"]
+
+
+class Substitution(object):
+    """
+    Value of the template filled by each record
+    """
+
+    def __init__(self, index: int, value_type: int):
+        self.index = index
+        self.value_type = value_type
+
+
+def _name_hash(name: str):
+    name_hash = 0
+    for char in name:
+        name_hash = (name_hash * 65599 + ord(char)) & 0xFFFFFFFF
+    return name_hash & 0xFFFF
+
+
+class _BinXmlWriter(object):
+    """
+    Writes BinXML at a known offset of a chunk, names being referenced by their offset in the chunk
+    """
+
+    def __init__(self, offset: int):
+        self.offset = offset
+        self.data = bytearray()
+
+    def pos(self):
+        return self.offset + len(self.data)
+
+    def write(self, fmt: str, *values):
+        self.data += struct.pack(fmt, *values)
+
+    def name(self, name: str):
+        # The name is written right after its offset
+        self.write("<I", self.pos() + 4)
+        self.write("<IHH", 0, _name_hash(name), len(name))
+        self.data += name.encode("utf-16-le") + b"\x00\x00"
+
+    def value(self, value):
+        if isinstance(value, Substitution):
+            self.write("<BHB", TOKEN_SUBSTITUTION, value.index, value.value_type)
+        else:
+            self.write("<BBH", TOKEN_VALUE, TYPE_STRING, len(value))
+            self.data += value.encode("utf-16-le")
+
+    def element(self, tag: str, attributes=(), content=None):
+        """
+        Write an element
+        :param tag: Name of the element
+        :param attributes: List of (name, value), value being a string or a Substitution
+        :param content: None for an empty element, a string or a Substitution, or a function writing the children
+        """
+        self.write("<BH", TOKEN_OPEN_START_ELEMENT | (TOKEN_MORE_BIT if attributes else 0), 0xFFFF)
+        size_offset = len(self.data)
+        self.write("<I", 0)
+        self.name(tag)
+
+        if attributes:
+            attributes_offset = len(self.data)
+            self.write("<I", 0)
+            for index, (attribute_name, value) in enumerate(attributes):
+                is_last = index == len(attributes) - 1
+                self.write("<B", TOKEN_ATTRIBUTE | (0 if is_last else TOKEN_MORE_BIT))
+                self.name(attribute_name)
+                self.value(value)
+            struct.pack_into("<I", self.data, attributes_offset, len(self.data) - attributes_offset - 4)
+
+        if content is None:
+            self.write("<B", TOKEN_CLOSE_EMPTY_ELEMENT)
+        else:
+            self.write("<B", TOKEN_CLOSE_START_ELEMENT)
+            if callable(content):
+                content()
+            else:
+                self.value(content)
+            self.write("<B", TOKEN_END_ELEMENT)
+
+        struct.pack_into("<I", self.data, size_offset, len(self.data) - size_offset - 4)
+
+
+# Values of the template, in order of their substitution index
+TEMPLATE_VALUES = ["provider", "event_id", "level", "time_created", "record_id", "channel", "computer",
+                   "target_user", "ip_address", "process_name"]
+TEMPLATE_TYPES = [TYPE_STRING, TYPE_UINT16, TYPE_UINT8, TYPE_FILETIME, TYPE_UINT64, TYPE_STRING, TYPE_STRING,
+                  TYPE_STRING, TYPE_STRING, TYPE_STRING]
+
+
+def _build_template(offset: int):
+    """
+    Template definition of the generated events
+    :param offset: Offset of the definition in the chunk
+    :return: bytes
+    """
+    writer = _BinXmlWriter(offset + 24)
+    sub = {name: Substitution(index, TEMPLATE_TYPES[index]) for index, name in enumerate(TEMPLATE_VALUES)}
+
+    def system():
+        writer.element("Provider", [("Name", sub["provider"])])
+        writer.element("EventID", content=sub["event_id"])
+        writer.element("Level", content=sub["level"])
+        writer.element("TimeCreated", [("SystemTime", sub["time_created"])])
+        writer.element("EventRecordID", content=sub["record_id"])
+        writer.element("Channel", content=sub["channel"])
+        writer.element("Computer", content=sub["computer"])
+
+    def event_data():
+        writer.element("Data", [("Name", "TargetUserName")], content=sub["target_user"])
+        writer.element("Data", [("Name", "IpAddress")], content=sub["ip_address"])
+        writer.element("Data", [("Name", "ProcessName")], content=sub["process_name"])
+
+    def event():
+        writer.element("System", content=system)
+        writer.element("EventData", content=event_data)
+
+    writer.write("<BBBB", TOKEN_FRAGMENT_HEADER, 1, 1, 0)
+    writer.element("Event", [("xmlns", EVENT_NAMESPACE)], content=event)
+    writer.write("<B", TOKEN_EOF)
+
+    return struct.pack("<I16sI", 0, TEMPLATE_GUID, len(writer.data)) + bytes(writer.data)
+
+
+def _pack_value(value_type: int, value):
+    if value_type == TYPE_STRING:
+        return value.encode("utf-16-le")
+    return struct.pack({TYPE_UINT8: "<B", TYPE_UINT16: "<H", TYPE_UINT64: "<Q", TYPE_FILETIME: "<Q"}[value_type],
+                       value)
+
+
+def _pack_values(values: dict):
+    packed = [_pack_value(value_type, values[name]) for name, value_type in zip(TEMPLATE_VALUES, TEMPLATE_TYPES)]
+    descriptors = b"".join(struct.pack("<HBB", len(data), value_type, 0)
+                           for data, value_type in zip(packed, TEMPLATE_TYPES))
+    return struct.pack("<I", len(packed)) + descriptors + b"".join(packed)
+
+
+# The first record of a chunk defines the template right after the template instance token
+TEMPLATE_OFFSET = CHUNK_HEADER_SIZE + RECORD_HEADER_SIZE + 4 + 6 + 4
+TEMPLATE_DEFINITION = _build_template(TEMPLATE_OFFSET)
+TEMPLATE_INSTANCE = struct.pack("<BBBBBBII", TOKEN_FRAGMENT_HEADER, 1, 1, 0, TOKEN_TEMPLATE_INSTANCE, 1,
+                                struct.unpack_from("<I", TEMPLATE_GUID)[0], TEMPLATE_OFFSET)
+
+
+def _build_record(record_id: int, timestamp: float, values: dict, is_first: bool):
+    filetime = int((timestamp + FILETIME_EPOCH_DELTA) * 10 ** 7)
+    values = dict(values, record_id=record_id, time_created=filetime)
+
+    binxml = TEMPLATE_INSTANCE + (TEMPLATE_DEFINITION if is_first else b"") + _pack_values(values)
+    size = RECORD_HEADER_SIZE + len(binxml) + 4
+    return struct.pack("<4sIQQ", RECORD_MAGIC, size, record_id, filetime) + binxml + struct.pack("<I", size)
+
+
+def _build_chunk(records: list, first_record_id: int):
+    """
+    :param records: Records of the chunk, the first one defining the template
+    :param first_record_id: Id of the first record
+    :return: bytes
+    """
+    chunk = bytearray(CHUNK_SIZE)
+    offset = CHUNK_HEADER_SIZE
+    last_offset = offset
+    for record in records:
+        chunk[offset:offset + len(record)] = record
+        last_offset = offset
+        offset += len(record)
+
+    last_record_id = first_record_id + len(records) - 1
+    struct.pack_into("<8sQQQQIIII", chunk, 0, CHUNK_MAGIC, first_record_id, last_record_id, first_record_id,
+                     last_record_id, 0x80, last_offset, offset,
+                     zlib.crc32(bytes(chunk[CHUNK_HEADER_SIZE:offset])) & 0xFFFFFFFF)
+    struct.pack_into("<I", chunk, CHUNK_TEMPLATES_TABLE_OFFSET, TEMPLATE_OFFSET)
+    struct.pack_into("<I", chunk, CHUNK_HEADER_CHECKSUM_OFFSET,
+                     zlib.crc32(bytes(chunk[:0x78] + chunk[0x80:CHUNK_HEADER_SIZE])) & 0xFFFFFFFF)
+
+    return bytes(chunk)
+
+
+def write_evtx(path: Path, channel: str, nb_chunks: int, computer: str = "WKS-0001", first_record_id: int = 1,
+               start_time: float = 1672531200, time_step: float = 1.0, seed: int = 0):
+    """
+    Write a synthetic EVTX file
+    :param path: Path of the file
+    :param channel: Channel of the events, one of CHANNELS
+    :param nb_chunks: Number of 64 KiB chunks
+    :param computer: Computer of the events
+    :param first_record_id: Id of the first record
+    :param start_time: Timestamp of the first record
+    :param time_step: Seconds between two records
+    :param seed: Seed of the random values
+    :return: Number of records written
+    """
+    provider, event_ids = CHANNELS[channel]
+    rand = random.Random(seed)
+    record_id = first_record_id
+
+    with open(path, "wb") as f:
+        header = bytearray(FILE_HEADER_SIZE)
+        f.write(header)
+
+        for _ in range(nb_chunks):
+            records = []
+            chunk_first_id = record_id
+            free = CHUNK_SIZE - CHUNK_HEADER_SIZE
+
+            while True:
+                values = {
+                    "provider": provider,
+                    "event_id": rand.choice(event_ids),
+                    "level": 4,
+                    "channel": channel,
+                    "computer": computer,
+                    "target_user": rand.choice(USERS),
+                    "ip_address": "10.{}.{}.{}".format(rand.randint(0, 255), rand.randint(0, 255),
+                                                       rand.randint(1, 254)),
+                    "process_name": rand.choice(PROCESSES)
+                }
+                record = _build_record(record_id, start_time + (record_id - first_record_id) * time_step,
+                                       values, is_first=not records)
+                if len(record) > free:
+                    break
+
+                records.append(record)
+                free -= len(record)
+                record_id += 1
+
+            f.write(_build_chunk(records, chunk_first_id))
+
+        FILE_HEADER_STRUCT.pack_into(header, 0, FILE_HEADER_MAGIC, 0, max(0, nb_chunks - 1), record_id, 0x80, 1, 3,
+                                     FILE_HEADER_SIZE, nb_chunks)
+        struct.pack_into("<I", header, FILE_HEADER_CHECKSUM_OFFSET,
+                         zlib.crc32(bytes(header[:FILE_HEADER_FLAGS_OFFSET])) & 0xFFFFFFFF)
+        f.seek(0)
+        f.write(header)
+
+    return record_id - first_record_id
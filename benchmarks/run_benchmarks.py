@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import argparse
+import json
+import logging
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.corpus import PROFILES, generate_corpus
+from benchmarks.stub_splunk import StubSplunk
+from iris_evtx.EVTXImportDispatcher import ImportDispatcher
+
+
+# CONTENT ------------------------------------------------
+# Runs ImportDispatcher.import_files end to end on synthetic uploads, against a stand-in Splunk and an
+# in-memory evidence storage, then reports the throughput of each stage and compares it to a baseline.
+# Evtx2Splunk and its evtxdump binaries are the real ones:
+#   python -m benchmarks.run_benchmarks --evtxdump-config /path/to/event_bind.json
+DEFAULT_TOLERANCE = 0.2
+BENCHMARK_INDEX = "iris_evtx_benchmark"
+
+log = logging.getLogger("iris_evtx.benchmarks")
+
+
+class InMemoryEvidenceStorage(object):
+    """
+    Evidence storage of IRIS, kept in memory, with the bulk methods
+    """
+
+    def __init__(self):
+        self.evidences = {}
+
+    def is_evidence_registered(self, sha256, case_id):
+        return (case_id, sha256) in self.evidences
+
+    def get_registered_evidences(self, sha256_list, case_id):
+        return [sha256 for sha256 in sha256_list if (case_id, sha256) in self.evidences]
+
+    def add_evidence(self, **evidence):
+        self.evidences[(evidence["case_id"], evidence["sha256"])] = evidence
+
+    def add_evidences(self, evidences):
+        for evidence in evidences:
+            self.add_evidence(**evidence)
+
+
+def get_configuration(stub: StubSplunk, scratch_dir: Path, evtxdump_config: str, extra: dict = None):
+    """
+    Module configuration pointing to the stand-in Splunk
+    """
+    configuration = {
+        "evtxdump_config_file": evtxdump_config,
+        "evtx_splunk_url": "127.0.0.1",
+        "evtx_splunk_user": "admin",
+        "evtx_splunk_pass": "benchmark",
+        "evtx_splunk_hecname": "iris_evtx_benchmark",
+        "evtx_splunk_mport": stub.management_port,
+        "evtx_splunk_use_ssl": False,
+        "evtx_splunk_verify_ssl": False,
+        "evtx_scratch_dir": str(scratch_dir),
+        "evtx_scratch_min_free": 0,
+    }
+    configuration.update(extra or {})
+    return configuration
+
+
+def run_profile(profile: str, work_dir: Path, stub: StubSplunk, evtxdump_config: str, scale: float = 1.0,
+                extra_configuration: dict = None):
+    """
+    Generate the upload of a profile and import it
+    :return: dict of the results
+    """
+    profile_dir = work_dir / profile
+    shutil.rmtree(profile_dir, ignore_errors=True)
+
+    upload_dir = profile_dir / "upload"
+    corpus = generate_corpus(profile, upload_dir, scale=scale)
+    log.info("Generated {}: {} uploaded files, {} EVTX files, {} records, {} bytes".format(
+        profile, corpus["uploaded_files"], corpus["evtx_files"], corpus["records"], corpus["bytes"]))
+
+    task_args = {
+        "pipeline_args": {"index_evtx": BENCHMARK_INDEX, "hostname_evtx": None},
+        "user": "benchmark",
+        "user_id": 1,
+        "case_name": "benchmark_{}".format(profile),
+        "path": str(upload_dir),
+        "case_id": 1,
+        "is_update": False
+    }
+    configuration = get_configuration(stub, profile_dir / "scratch", evtxdump_config, extra_configuration)
+    dispatcher = ImportDispatcher(task_self=None, task_args=task_args, evidence_storage=InMemoryEvidenceStorage(),
+                                  configuration=configuration, log=log)
+
+    events_before = stub.stats.events
+    start_time = time.time()
+    status = dispatcher.import_files()
+    wall_time = time.time() - start_time
+
+    data = status.get_data() or {}
+    metrics = data.get("metrics", {})
+    shutil.rmtree(profile_dir, ignore_errors=True)
+
+    return {
+        "corpus": corpus,
+        "success": not status.is_failure(),
+        "wall_time": round(wall_time, 3),
+        "bytes_per_second": round(corpus["bytes"] / wall_time, 1) if wall_time else 0,
+        "events_received": stub.stats.events - events_before,
+        "stages": metrics.get("stages", {}),
+        "queues": metrics.get("queues", {}),
+        "hec": stub.stats.to_dict()
+    }
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE):
+    """
+    Flag the profiles and stages slower than the baseline by more than the tolerance
+    :return: List of regressions, as strings
+    """
+    regressions = []
+    for profile, result in results.items():
+        reference = baseline.get(profile)
+        if not reference:
+            continue
+
+        if result["wall_time"] > reference["wall_time"] * (1 + tolerance):
+            regressions.append("{}: wall time {}s, baseline {}s".format(profile, result["wall_time"],
+                                                                         reference["wall_time"]))
+
+        for stage, stage_reference in reference.get("stages", {}).items():
+            reference_rate = stage_reference.get("bytes_per_second", 0)
+            rate = result["stages"].get(stage, {}).get("bytes_per_second", 0)
+            if reference_rate and rate < reference_rate * (1 - tolerance):
+                regressions.append("{}: {} at {} B/s, baseline {} B/s".format(profile, stage, rate, reference_rate))
+
+        if result["events_received"] != reference.get("events_received", result["events_received"]):
+            regressions.append("{}: {} events received, baseline {}".format(profile, result["events_received"],
+                                                                           reference["events_received"]))
+
+    return regressions
+
+
+def print_report(results: dict):
+    for profile, result in results.items():
+        corpus = result["corpus"]
+        print("{} - {} - {:.1f}s, {:.1f} MB/s, {} events received".format(
+            profile, "success" if result["success"] else "FAILED", result["wall_time"],
+            result["bytes_per_second"] / 1024 / 1024, result["events_received"]))
+        print("    {} uploaded files, {} EVTX files, {} records, {:.1f} MB".format(
+            corpus["uploaded_files"], corpus["evtx_files"], corpus["records"], corpus["bytes"] / 1024 / 1024))
+
+        for stage, metrics in result["stages"].items():
+            print("    {:<14} wall {:>8.2f}s  busy {:>8.2f}s  {:>10.1f} MB/s  {:>10.1f} records/s".format(
+                stage, metrics["wall_time"], metrics["busy_time"], metrics["bytes_per_second"] / 1024 / 1024,
+                metrics["records_per_second"]))
+
+        for queue_name, stats in result["queues"].items():
+            print("    queue {:<8} max {:>3}  mean {:>6.2f}".format(queue_name, stats["max"], stats["mean"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the EVTX import of iris_evtx")
+    parser.add_argument("--evtxdump-config", required=True, help="evtxdump configuration file of Evtx2Splunk")
+    parser.add_argument("--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument("--scale", type=float, default=1.0, help="Factor applied to the size of the corpora")
+    parser.add_argument("--work-dir", help="Directory of the corpora and scratch space, temporary by default")
+    parser.add_argument("--hec-port", type=int, default=8088, help="Port of the stand-in HEC")
+    parser.add_argument("--configuration", help="JSON file of module configuration overriding the defaults")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results to this JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results to the baseline file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Slowdown ratio flagged as a regression")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(threadName)s %(message)s")
+
+    extra_configuration = json.loads(Path(args.configuration).read_text()) if args.configuration else None
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="iris_evtx_benchmark_"))
+
+    results = {}
+    with StubSplunk(hec_port=args.hec_port) as stub:
+        for profile in args.profiles:
+            results[profile] = run_profile(profile, work_dir, stub, args.evtxdump_config, scale=args.scale,
+                                           extra_configuration=extra_configuration)
+
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(results)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=4))
+
+    regressions = []
+    if args.baseline:
+        baseline_path = Path(args.baseline)
+        if args.save_baseline:
+            baseline_path.write_text(json.dumps(results, indent=4))
+            print("Baseline saved to {}".format(baseline_path))
+
+        elif baseline_path.exists():
+            regressions = compare_to_baseline(results, json.loads(baseline_path.read_text()), args.tolerance)
+            for regression in regressions:
+                print("REGRESSION {}".format(regression))
+
+    failed = [profile for profile, result in results.items() if not result["success"]]
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
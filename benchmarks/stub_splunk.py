@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+
+# CONTENT ------------------------------------------------
+# Stand-in for Splunk: the management REST API (login, indexes, HTTP inputs) answering with Atom feeds or JSON,
+# and the HTTP Event Collector, which decodes and counts the events it receives
+STUB_TOKEN = "00000000-0000-0000-0000-000000000000"
+STUB_VERSION = "8.2.0"
+
+
+class StubStats(object):
+    """
+    What the stub received
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.management_requests = 0
+        self.hec_requests = 0
+        self.hec_gzip_requests = 0
+        self.hec_bytes = 0
+        self.hec_raw_bytes = 0
+        self.events = 0
+        self.first_event = None
+        self.last_event = None
+
+    def to_dict(self):
+        duration = (self.last_event - self.first_event) if self.first_event else 0
+        return {
+            "management_requests": self.management_requests,
+            "hec_requests": self.hec_requests,
+            "hec_gzip_requests": self.hec_gzip_requests,
+            "hec_bytes": self.hec_bytes,
+            "hec_raw_bytes": self.hec_raw_bytes,
+            "events": self.events,
+            "events_per_second": round(self.events / duration, 1) if duration else 0
+        }
+
+
+def _count_events(payload: bytes):
+    """
+    Count the events of a HEC payload, a concatenation of JSON objects
+    """
+    decoder = json.JSONDecoder()
+    text = payload.decode("utf-8", errors="replace")
+    position = 0
+    events = 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position >= len(text):
+            return events
+
+        _, position = decoder.raw_decode(text, position)
+        events += 1
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _reply(self, status: int, body, content_type: str):
+        data = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._handle(b"")
+
+    def do_POST(self):
+        self._handle(self._read_body())
+
+    def do_DELETE(self):
+        self._handle(b"")
+
+
+class _ManagementHandler(_StubHandler):
+    """
+    Answers every management call with an entry named after the requested object, holding the HEC token
+    """
+
+    def _handle(self, body: bytes):
+        stats = self.server.stats
+        with stats.lock:
+            stats.management_requests += 1
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        query.update(parse_qs(body.decode(errors="replace")))
+
+        if url.path.rstrip("/").endswith("/auth/login"):
+            self._reply(200, "<response><sessionKey>{}</sessionKey></response>".format(STUB_TOKEN),
+                        "text/xml")
+            return
+
+        name = query.get("name", [url.path.rstrip("/").split("/")[-1]])[0]
+        content = {"token": STUB_TOKEN, "index": query.get("index", [name])[0], "disabled": "0",
+                   "version": STUB_VERSION, "name": name}
+
+        if query.get("output_mode", [""])[0] == "json":
+            self._reply(200, json.dumps({"entry": [{"name": name, "content": content}]}), "application/json")
+            return
+
+        keys = "".join('<s:key name="{}">{}</s:key>'.format(key, escape(value)) for key, value in content.items())
+        self._reply(200, '<?xml version="1.0" encoding="UTF-8"?>'
+                         '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:s="http://dev.splunk.com/ns/rest">'
+                         '<title>{0}</title><id>{1}</id><updated>2023-01-01T00:00:00+00:00</updated>'
+                         '<entry><title>{0}</title><id>{1}</id><updated>2023-01-01T00:00:00+00:00</updated>'
+                         '<link href="{1}" rel="alternate"/>'
+                         '<content type="text/xml"><s:dict>{2}</s:dict></content></entry></feed>'
+                    .format(escape(name), escape(url.path), keys), "text/xml")
+
+
+class _HECHandler(_StubHandler):
+    """
+    HTTP Event Collector, with indexer acknowledgements
+    """
+
+    def _handle(self, body: bytes):
+        stats = self.server.stats
+        path = urlparse(self.path).path.rstrip("/")
+
+        if path.endswith("/health"):
+            self._reply(200, json.dumps({"text": "HEC is healthy", "code": 17}), "application/json")
+            return
+
+        if path.endswith("/ack"):
+            ack_ids = json.loads(body or b"{}").get("acks", [])
+            self._reply(200, json.dumps({"acks": {str(ack_id): True for ack_id in ack_ids}}), "application/json")
+            return
+
+        # Busy or refusing the events, as set by the tests
+        owner = self.server.owner
+        with stats.lock:
+            is_failing = owner.hec_fail_after is not None and stats.hec_requests >= owner.hec_fail_after
+        if owner.hec_status != 200 or is_failing:
+            self._reply(owner.hec_status if owner.hec_status != 200 else 500,
+                        json.dumps({"text": "Refused by the stub", "code": 9}), "application/json")
+            return
+
+        raw_size = len(body)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        try:
+            events = _count_events(body)
+        except ValueError:
+            self._reply(400, json.dumps({"text": "Invalid data format", "code": 6}), "application/json")
+            return
+
+        now = time.time()
+        with stats.lock:
+            stats.hec_requests += 1
+            stats.hec_gzip_requests += 1 if raw_size != len(body) else 0
+            stats.hec_bytes += len(body)
+            stats.hec_raw_bytes += raw_size
+            stats.events += events
+            stats.first_event = stats.first_event or now
+            stats.last_event = now
+            ack_id = stats.hec_requests
+
+        reply = {"text": "Success", "code": 0}
+        if self.headers.get("X-Splunk-Request-Channel"):
+            reply["ackId"] = ack_id
+
+        self._reply(200, json.dumps(reply), "application/json")
+
+
+class StubSplunk(object):
+    """
+    Management and HEC servers on the loopback, on ephemeral ports unless given
+    """
+
+    def __init__(self, management_port: int = 0, hec_port: int = 0):
+        self.stats = StubStats()
+        # HTTP status the HEC answers the events with
+        self.hec_status = 200
+        # Number of HEC requests accepted before failing the next ones with 500, None to accept them all
+        self.hec_fail_after = None
+        self._servers = [ThreadingHTTPServer(("127.0.0.1", management_port), _ManagementHandler),
+                         ThreadingHTTPServer(("127.0.0.1", hec_port), _HECHandler)]
+        for server in self._servers:
+            server.stats = self.stats
+            server.owner = self
+            server.daemon_threads = True
+
+    @property
+    def management_port(self):
+        return self._servers[0].server_address[1]
+
+    @property
+    def hec_port(self):
+        return self._servers[1].server_address[1]
+
+    def start(self):
+        for server in self._servers:
+            threading.Thread(target=server.serve_forever, name="stub_splunk", daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
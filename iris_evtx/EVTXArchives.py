@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import logging as logger
+import shutil
+import subprocess
+import zipfile
+from pathlib import Path, PurePosixPath
+from pyunpack import Archive
+
+
+# CONTENT ------------------------------------------------
+# EVTX are Windows event files. EVTX_DATA is found in ORC results
+EVTX_SUFFIXES = (".evtx", ".evtx_data")
+ARCHIVE_SUFFIXES = (".zip", ".7z")
+
+# Expected ratio between the extracted size and the size of an archive, when the archive does not tell
+DEFAULT_EXPANSION_RATIO = 4
+
+
+def decompress_7z(filename, output_dir, log=logger):
+    """
+    Decompress a 7z file in specified output directory
+    :param filename: Filename to decompress
+    :param output_dir: Target output dir
+    :param log: Logger receiving the extraction errors
+    :return: True if uncompress
+    """
+    try:
+        a = Archive(filename=filename)
+        a.extractall(directory=output_dir, auto_create_dir=True)
+
+    except Exception as e:
+        log.error("Unable to extract {}: {}".format(Path(filename).name, e))
+        return False
+
+    return True
+
+
+def is_archive(path: Path):
+    return path.suffix.lower() in ARCHIVE_SUFFIXES
+
+
+def is_wanted_member(name: str):
+    """
+    Tells if an archive member is worth extracting: EVTX files, and archives which may contain some
+    :param name: Name of the member within the archive
+    :return: bool
+    """
+    suffix = PurePosixPath(name.replace("\\", "/")).suffix
+    return suffix in EVTX_SUFFIXES or suffix.lower() in ARCHIVE_SUFFIXES
+
+
+def _decompress_zip_members(filename, output_dir, max_size=0, log=logger):
+    """
+    Extract only the wanted members of a zip file
+    :return: True if extracted
+    """
+    try:
+        with zipfile.ZipFile(filename) as zf:
+            members = [info for info in zf.infolist() if not info.is_dir() and is_wanted_member(info.filename)]
+
+            # The zip directory gives the uncompressed sizes, so the limit is enforced before writing anything
+            declared_size = sum(info.file_size for info in members)
+            if max_size and declared_size > max_size:
+                log.error("{} would extract {} bytes, over the limit of {}".format(Path(filename).name,
+                                                                                  declared_size, max_size))
+                return False
+
+            for info in members:
+                zf.extract(info, path=output_dir)
+
+    except Exception as e:
+        log.error("Unable to extract {}: {}".format(Path(filename).name, e))
+        return False
+
+    return True
+
+
+def _get_7z_binary():
+    return shutil.which("7z") or shutil.which("7za")
+
+
+def _list_7z_sizes(binary, filename):
+    """
+    List the uncompressed sizes of the wanted members of a 7z file, as declared by the archive
+    :param binary: Path of the 7z binary
+    :param filename: 7z file
+    :return: Dict of the member names and sizes
+    """
+    listing = subprocess.run([binary, "l", "-slt", str(filename)], check=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode(errors="replace")
+
+    sizes = {}
+    for block in listing.split("\n\n"):
+        fields = dict(line.split(" = ", 1) for line in block.splitlines() if " = " in line)
+        # The block describing the archive itself has no Size field
+        name = fields.get("Path")
+        if not name or "Size" not in fields or "D" in fields.get("Attributes", "") or not is_wanted_member(name):
+            continue
+        sizes[name] = int(fields.get("Size") or 0)
+
+    return sizes
+
+
+def _decompress_7z_members(filename, output_dir, max_size=0, log=logger):
+    """
+    Extract only the wanted members of a 7z file with the 7z binary wildcards.
+    Falls back to a full extraction if no 7z binary is available
+    :return: True if extracted
+    """
+    binary = _get_7z_binary()
+    if not binary:
+        return decompress_7z(filename, output_dir, log=log)
+
+    if max_size:
+        # As for zip files, the listing gives the uncompressed sizes so nothing is written over the limit
+        try:
+            declared_size = sum(_list_7z_sizes(binary, filename).values())
+        except (subprocess.CalledProcessError, ValueError) as e:
+            log.error("Unable to list {}: {}".format(Path(filename).name, e))
+            return False
+
+        if declared_size > max_size:
+            log.error("{} would extract {} bytes, over the limit of {}".format(Path(filename).name,
+                                                                              declared_size, max_size))
+            return False
+
+    wildcards = ["*{}".format(suffix) for suffix in EVTX_SUFFIXES + ARCHIVE_SUFFIXES]
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    try:
+        subprocess.run([binary, "x", "-y", "-bd", "-o{}".format(output_dir), str(filename), "-r"] + wildcards,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    except subprocess.CalledProcessError as e:
+        log.error("Unable to extract {}: {}".format(Path(filename).name, e.stderr.decode(errors="replace")))
+        return False
+
+    return True
+
+
+def decompress_selective(filename, output_dir, max_size=0, log=logger):
+    """
+    Decompress only the EVTX files and the nested archives of an archive in specified output directory
+    :param filename: Filename to decompress
+    :param output_dir: Target output dir
+    :param max_size: Maximum number of bytes extracted, when it can be known beforehand. 0 for no limit
+    :param log: Logger receiving the extraction errors
+    :return: True if uncompress
+    """
+    if zipfile.is_zipfile(filename):
+        return _decompress_zip_members(filename, output_dir, max_size=max_size, log=log)
+
+    if Path(filename).suffix.lower() == ".7z":
+        return _decompress_7z_members(filename, output_dir, max_size=max_size, log=log)
+
+    return decompress_7z(filename, output_dir, log=log)
+
+
+def estimate_extracted_size(archive: Path):
+    """
+    Estimate the space needed to extract the wanted members of an archive
+    :param archive: Path of the archive
+    :return: Size in bytes
+    """
+    try:
+        if zipfile.is_zipfile(archive):
+            with zipfile.ZipFile(archive) as zf:
+                return sum(info.file_size for info in zf.infolist() if is_wanted_member(info.filename))
+
+        binary = _get_7z_binary()
+        if archive.suffix.lower() == ".7z" and binary:
+            return sum(_list_7z_sizes(binary, archive).values())
+    except Exception:
+        pass
+
+    return archive.stat().st_size * DEFAULT_EXPANSION_RATIO
+
+
+def get_tree_size(path: Path):
+    """
+    Size of every file below a directory
+    :param path: Directory
+    :return: Size in bytes
+    """
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def extract_archive(archive: Path, output_dir: Path, max_depth: int = 3, max_size: int = 0, log=logger):
+    """
+    Extract the EVTX files of an archive and, recursively, of the archives it contains.
+    Nested archives are extracted in a directory named after them, next to them, then deleted.
+    :param archive: Archive to extract
+    :param output_dir: Directory receiving the content of the archive
+    :param max_depth: Maximum levels of nested archives expanded. Deeper archives fail the extraction
+    :param max_size: Maximum number of bytes extracted for this archive, nested included. 0 for no limit
+    :param log: Logger receiving the extraction errors
+    :return: True if the archive was fully extracted, nested archives included
+    """
+    if not decompress_selective(archive, output_dir, max_size=max_size, log=log):
+        return False
+
+    extracted_size = get_tree_size(output_dir)
+    if max_size and extracted_size > max_size:
+        log.error("{} extracts to {} bytes, over the limit of {}".format(archive.name, extracted_size, max_size))
+        return False
+
+    pending = [(nested, 1) for nested in output_dir.rglob("*") if nested.is_file() and is_archive(nested)]
+    while pending:
+        nested, depth = pending.pop()
+
+        # The EVTX of a nested archive left aside would never be ingested, while the parent archive
+        # would be registered and skipped by the next imports. The whole archive fails instead
+        if depth > max_depth:
+            log.error("{} is nested too deep in {}".format(nested.name, archive.name))
+            return False
+
+        nested_dir = nested.with_name(nested.stem)
+        if nested_dir.exists():
+            nested_dir = nested.with_name("{}_{}".format(nested.stem, nested.suffix.lstrip('.')))
+
+        nested_size = nested.stat().st_size
+        if not decompress_selective(nested, nested_dir, max_size=max_size, log=log):
+            log.error("Unable to extract nested archive {} from {}".format(nested.name, archive.name))
+            return False
+
+        extracted_size += get_tree_size(nested_dir) - nested_size
+        nested.unlink()
+
+        if max_size and extracted_size > max_size:
+            log.error("{} extracts to more than {} bytes with its nested archives".format(archive.name, max_size))
+            return False
+
+        pending.extend((sub_nested, depth + 1) for sub_nested in nested_dir.rglob("*")
+                       if sub_nested.is_file() and is_archive(sub_nested))
+
+    return True
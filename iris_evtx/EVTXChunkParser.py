@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import io
+import json
+import logging as logger
+import mmap
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from iris_evtx.EVTXChunks import CHUNK_SIZE, FILE_HEADER_SIZE, build_file_header, list_chunks
+
+try:
+    import evtx as pyevtx
+except ImportError:
+    pyevtx = None
+
+
+# CONTENT ------------------------------------------------
+# Chunks decoded by a worker in one task. Big enough to amortize the transfer of the records, small enough to
+# spread a single file over every worker
+DEFAULT_CHUNKS_PER_TASK = 4
+
+# Tasks queued per worker, so the workers never wait for the records to be consumed
+TASKS_PER_WORKER = 2
+
+# Raised when the workers can't be started or stopped while decoding. Workers started by a daemonic process are
+# refused with an AssertionError, a failure to start their management thread gives a RuntimeError
+POOL_ERRORS = (BrokenProcessPool, AssertionError, OSError, RuntimeError)
+
+
+def is_daemon_process():
+    """
+    Tell if the current process is daemonic, such as the Celery prefork workers, and can't start worker processes
+    :return: bool
+    """
+    if multiprocessing.current_process().daemon:
+        return True
+
+    try:
+        from billiard import current_process
+    except ImportError:
+        return False
+
+    return bool(current_process().daemon)
+
+
+def _decode_chunks(path: str, chunks: list):
+    """
+    Decode some chunks of an EVTX file, in a worker process. The chunks are read from the mapped file and parsed
+    in memory, as a file holding only them
+    :param path: Path of the EVTX file
+    :param chunks: ChunkInfo of the chunks to decode
+    :return: (list of (record_id, event), list of the decoding errors)
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data = build_file_header(mapped[:FILE_HEADER_SIZE], len(chunks))
+            for chunk in chunks:
+                data += mapped[chunk.offset:chunk.offset + CHUNK_SIZE]
+
+    # The worker processes are the parallelism, the parser runs single threaded
+    records = pyevtx.PyEvtxParser(io.BytesIO(data), number_of_threads=1).records_json()
+    decoded = []
+    errors = []
+    while True:
+        try:
+            record = next(records)
+        except StopIteration:
+            break
+        except RuntimeError as e:
+            errors.append(str(e))
+            continue
+
+        try:
+            decoded.append((record["event_record_id"], json.loads(record["data"])))
+        except (KeyError, ValueError):
+            continue
+
+    return decoded, errors
+
+
+class ChunkParser(object):
+    """
+    Decodes EVTX files in process, their independent chunks spread over a pool of processes. The records are
+    streamed in the order of the chunks as soon as they are decoded, so a single huge file keeps every worker busy,
+    without going through evtxdump and its temporary files
+    """
+
+    def __init__(self, workers: int, chunks_per_task: int = DEFAULT_CHUNKS_PER_TASK, log=logger):
+        """
+        :param workers: Number of worker processes
+        :param chunks_per_task: Number of chunks decoded by a worker in one task
+        :param log: Logger
+        """
+        self.workers = max(1, workers)
+        self.chunks_per_task = max(1, chunks_per_task)
+        self.log = log
+        self._executor = None
+        self._is_broken = False
+
+    def _get_executor(self):
+        if self._executor is None and not self._is_broken and is_daemon_process():
+            self.log.info("Daemonic process, the chunks are decoded in process")
+            self._is_broken = True
+
+        if self._executor is None and not self._is_broken:
+            # Forking a process running threads is unsafe, the workers are started afresh
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+        return self._executor
+
+    def iter_records(self, evtx_path: Path):
+        """
+        Decode the records of a file
+        :param evtx_path: Path of the EVTX file
+        :return: Generator of (record_id, event)
+        :raise EVTXFormatError: If the chunks of the file can't be listed
+        """
+        chunks = list_chunks(evtx_path)
+        tasks = [chunks[start:start + self.chunks_per_task] for start in range(0, len(chunks), self.chunks_per_task)]
+
+        # Index of the first task whose records are not yielded yet
+        next_task = 0
+
+        executor = self._get_executor()
+        if executor is not None:
+            pending = deque()
+            submitted = 0
+            try:
+                while next_task < len(tasks):
+                    # The records waiting to be consumed are bounded
+                    while submitted < len(tasks) and len(pending) < self.workers * TASKS_PER_WORKER:
+                        pending.append(executor.submit(_decode_chunks, str(evtx_path), tasks[submitted]))
+                        submitted += 1
+
+                    result = pending.popleft().result()
+                    next_task += 1
+                    yield from self._iter_decoded(evtx_path, result)
+
+            except POOL_ERRORS as e:
+                # The file goes on in process from the first chunk not yielded, and so do the next files
+                self.log.warning("Unable to decode the chunks of {} in worker processes, decoding them in process "
+                                 "from chunk {}: {}".format(evtx_path.name, next_task * self.chunks_per_task,
+                                                            e or type(e).__name__))
+                for future in pending:
+                    future.cancel()
+                pending.clear()
+                self._is_broken = True
+                self.close()
+
+            finally:
+                for future in pending:
+                    future.cancel()
+
+        for task in tasks[next_task:]:
+            yield from self._iter_decoded(evtx_path, _decode_chunks(str(evtx_path), task))
+
+    def _iter_decoded(self, evtx_path: Path, result: tuple):
+        records, errors = result
+        for error in errors:
+            self.log.warning("{}: unable to decode a record: {}".format(evtx_path.name, error))
+        yield from records
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import mmap
+import struct
+import zlib
+from pathlib import Path
+
+
+# CONTENT ------------------------------------------------
+# An EVTX file is a 4 KiB file header followed by independent 64 KiB chunks. Each chunk holds its own
+# string and template tables, so any subset of the chunks is a valid EVTX file once the header is fixed.
+# Only the headers are read here, the records are never decoded
+FILE_HEADER_MAGIC = b"ElfFile\x00"
+CHUNK_MAGIC = b"ElfChnk\x00"
+FILE_HEADER_SIZE = 0x1000
+CHUNK_SIZE = 0x10000
+
+# File header: first chunk number, last chunk number, next record id, header size, minor, major,
+# header block size, number of chunks
+FILE_HEADER_STRUCT = struct.Struct("<8sQQQIHHHH")
+FILE_HEADER_FLAGS_OFFSET = 0x78
+FILE_HEADER_CHECKSUM_OFFSET = 0x7C
+FILE_HEADER_DIRTY_FLAG = 0x1
+
+# Chunk header: first record number, last record number, first record id, last record id
+CHUNK_HEADER_STRUCT = struct.Struct("<8sQQQQ")
+CHUNK_HEADER_SIZE = 0x200
+CHUNK_FREE_SPACE_OFFSET = 0x30
+
+# Record header: magic, size, record id, written time as FILETIME
+RECORD_MAGIC = b"\x2a\x2a\x00\x00"
+RECORD_HEADER_STRUCT = struct.Struct("<4sIQQ")
+
+
+class EVTXFormatError(Exception):
+    pass
+
+
+class ChunkInfo(object):
+    """
+    Location and records range of a chunk
+    """
+
+    def __init__(self, index: int, offset: int, first_record_id: int, last_record_id: int,
+                 first_time: int = None, last_time: int = None):
+        self.index = index
+        self.offset = offset
+        self.first_record_id = first_record_id
+        self.last_record_id = last_record_id
+        # Oldest and newest written time of the records, as FILETIME, if read
+        self.first_time = first_time
+        self.last_time = last_time
+
+    def __repr__(self):
+        return "ChunkInfo({}, records {}-{})".format(self.index, self.first_record_id, self.last_record_id)
+
+
+def _read_chunk_times(mapped, offset: int):
+    """
+    Oldest and newest written time of the records of a chunk, from the records headers
+    :param mapped: Mapped EVTX file
+    :param offset: Offset of the chunk
+    :return: (first_time, last_time) as FILETIME, or (None, None) if the chunk has no records
+    """
+    free_space = struct.unpack_from("<I", mapped, offset + CHUNK_FREE_SPACE_OFFSET)[0]
+    end = offset + min(max(free_space, CHUNK_HEADER_SIZE), CHUNK_SIZE)
+
+    first_time = None
+    last_time = None
+    record_offset = offset + CHUNK_HEADER_SIZE
+    while record_offset + RECORD_HEADER_STRUCT.size <= end:
+        magic, size, _, written_time = RECORD_HEADER_STRUCT.unpack_from(mapped, record_offset)
+        if magic != RECORD_MAGIC or size < RECORD_HEADER_STRUCT.size:
+            break
+
+        first_time = written_time if first_time is None else min(first_time, written_time)
+        last_time = written_time if last_time is None else max(last_time, written_time)
+        record_offset += size
+
+    return first_time, last_time
+
+
+def list_chunks(path: Path, with_times: bool = False) -> list:
+    """
+    List the chunks of an EVTX file, from their headers.
+    The chunks count of the file header is not trusted, as it is often stale in collected files
+    :param path: Path of the EVTX file
+    :param with_times: Also read the written time of the records, from their headers
+    :return: List of ChunkInfo
+    """
+    chunks = []
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise EVTXFormatError("{} is empty".format(path.name))
+
+        with mapped:
+            if mapped[:len(FILE_HEADER_MAGIC)] != FILE_HEADER_MAGIC:
+                raise EVTXFormatError("{} is not an EVTX file".format(path.name))
+
+            offset = FILE_HEADER_SIZE
+            while offset + CHUNK_SIZE <= len(mapped):
+                magic, _, _, first_record_id, last_record_id = CHUNK_HEADER_STRUCT.unpack_from(mapped, offset)
+
+                # Unused chunks at the end of pre-allocated files are zeroed
+                if magic == CHUNK_MAGIC:
+                    chunk = ChunkInfo(index=len(chunks), offset=offset,
+                                      first_record_id=first_record_id,
+                                      last_record_id=last_record_id)
+                    if with_times:
+                        chunk.first_time, chunk.last_time = _read_chunk_times(mapped, offset)
+                    chunks.append(chunk)
+                offset += CHUNK_SIZE
+
+    return chunks
+
+
+def get_chunk_times(path: Path, chunk: ChunkInfo):
+    """
+    Read the oldest and newest written time of the records of a chunk
+    :param path: Path of the EVTX file
+    :param chunk: ChunkInfo of the chunk, updated
+    :return: (first_time, last_time) as FILETIME
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            chunk.first_time, chunk.last_time = _read_chunk_times(mapped, chunk.offset)
+
+    return chunk.first_time, chunk.last_time
+
+
+def build_file_header(source_header: bytes, nb_chunks: int) -> bytearray:
+    """
+    File header of an EVTX file holding some chunks of another one
+    :param source_header: File header of the source file
+    :param nb_chunks: Number of chunks copied
+    :return: File header
+    """
+    header = bytearray(source_header[:FILE_HEADER_SIZE])
+
+    magic, _, _, next_record_id, header_size, minor, major, block_size, _ = \
+        FILE_HEADER_STRUCT.unpack_from(header, 0)
+    FILE_HEADER_STRUCT.pack_into(header, 0, magic, 0, max(0, nb_chunks - 1), next_record_id, header_size,
+                                 minor, major, block_size, nb_chunks)
+
+    # The copy is consistent, so it is not flagged as dirty. The checksum covers the first 120 bytes
+    flags = struct.unpack_from("<I", header, FILE_HEADER_FLAGS_OFFSET)[0] & ~FILE_HEADER_DIRTY_FLAG
+    struct.pack_into("<I", header, FILE_HEADER_FLAGS_OFFSET, flags)
+    struct.pack_into("<I", header, FILE_HEADER_CHECKSUM_OFFSET,
+                     zlib.crc32(bytes(header[:FILE_HEADER_FLAGS_OFFSET])) & 0xFFFFFFFF)
+
+    return header
+
+
+def write_chunks(source: Path, chunks: list, target: Path):
+    """
+    Write a valid EVTX file holding only some chunks of another one
+    :param source: Source EVTX file
+    :param chunks: List of ChunkInfo of the source to copy, in order
+    :param target: EVTX file to write, or binary file object
+    """
+    with open(source, "rb") as src:
+        header = build_file_header(src.read(FILE_HEADER_SIZE), len(chunks))
+
+        if hasattr(target, "write"):
+            _copy_chunks(src, header, chunks, target)
+        else:
+            with open(target, "wb") as dst:
+                _copy_chunks(src, header, chunks, dst)
+
+
+def _copy_chunks(src, header, chunks: list, dst):
+    dst.write(header)
+    for chunk in chunks:
+        src.seek(chunk.offset)
+        dst.write(src.read(CHUNK_SIZE))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import logging as logger
+import math
+import os
+from multiprocessing import cpu_count
+from pathlib import Path
+
+
+# CONTENT ------------------------------------------------
+CGROUP_V2_CPU_MAX = Path("/sys/fs/cgroup/cpu.max")
+CGROUP_V1_CPU_QUOTA = Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+CGROUP_V1_CPU_PERIOD = Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+
+# Throughput ratio, compared to the one measured with the current number of ingestors, under which they are
+# scaled down
+SCALE_DOWN_RATIO = 0.5
+# Ingestions after which more ingestors are tried, and the gain of throughput they must bring to be kept
+PROBE_INTERVAL = 4
+MAX_PROBE_INTERVAL = 64
+PROBE_GAIN_RATIO = 1.1
+
+
+def _get_cgroup_cpu_limit():
+    """
+    CPU quota of the cgroup of the process, in number of CPUs
+    :return: float, or None if the cgroup is not limited
+    """
+    try:
+        if CGROUP_V2_CPU_MAX.exists():
+            quota, period = CGROUP_V2_CPU_MAX.read_text().split()[:2]
+            if quota != "max":
+                return int(quota) / int(period)
+
+        elif CGROUP_V1_CPU_QUOTA.exists():
+            quota = int(CGROUP_V1_CPU_QUOTA.read_text())
+            period = int(CGROUP_V1_CPU_PERIOD.read_text())
+            if quota > 0 and period > 0:
+                return quota / period
+
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def get_available_cpus():
+    """
+    Number of CPUs the process can actually use, taking into account the CPU affinity and the cgroup quota,
+    whereas cpu_count() reports the cores of the host
+    :return: int
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = cpu_count()
+
+    cgroup_limit = _get_cgroup_cpu_limit()
+    if cgroup_limit:
+        cpus = min(cpus, math.ceil(cgroup_limit))
+
+    return max(1, cpus)
+
+
+def get_auto_ingestors(concurrent_imports: int = 1):
+    """
+    Share the available CPUs between the imports running on the host
+    :param concurrent_imports: Number of imports running on the host, this one included
+    :return: int
+    """
+    return max(1, get_available_cpus() // max(1, concurrent_imports))
+
+
+class AdaptiveIngestors(object):
+    """
+    Number of ingestors used by an import. In auto mode, it starts from the CPUs share of the import and is
+    scaled down when the ingestion throughput drops compared to the one measured with the same number of
+    ingestors, which happens when the HEC slows down. Once the throughput is steady, more ingestors are tried
+    periodically, and kept only if they speed up the ingestion, so the import scales back up when the HEC
+    recovers. A fixed number of ingestors is never changed
+    """
+
+    def __init__(self, configured="auto", concurrent_imports: int = 1, log=logger):
+        """
+        :param configured: Number of ingestors, or auto
+        :param concurrent_imports: Number of imports running on the host, this one included
+        :param log: Logger
+        """
+        self.log = log
+        self.is_auto = str(configured).strip().lower() in ["auto", "", "0", "none"]
+
+        if self.is_auto:
+            self.maximum = get_auto_ingestors(concurrent_imports)
+        else:
+            try:
+                self.maximum = max(1, int(configured))
+            except (TypeError, ValueError):
+                self.log.warning("Invalid number of ingestors {}, using auto".format(configured))
+                self.is_auto = True
+                self.maximum = get_auto_ingestors(concurrent_imports)
+
+        self.current = self.maximum
+        # Throughput measured with the current number of ingestors
+        self._reference = None
+        self._steady_ingestions = 0
+        self._probe_interval = PROBE_INTERVAL
+        # (number of ingestors, throughput) before trying more ingestors
+        self._probed_from = None
+
+    def _set_current(self, current: int, reference=None):
+        """
+        Change the number of ingestors
+        :param current: Number of ingestors
+        :param reference: Throughput already measured with them, if any
+        """
+        self.current = current
+        self._reference = reference
+        self._steady_ingestions = 0
+
+    def record(self, nbytes: int, duration: float):
+        """
+        Account an ingestion and adapt the number of ingestors
+        :param nbytes: Bytes ingested
+        :param duration: Seconds the ingestion took
+        """
+        if not self.is_auto or duration <= 0 or nbytes <= 0:
+            return
+
+        throughput = nbytes / duration
+
+        if self._probed_from is not None:
+            previous, previous_throughput = self._probed_from
+            self._probed_from = None
+
+            if throughput < previous_throughput * PROBE_GAIN_RATIO:
+                # The ingestion is bound elsewhere, tried again later
+                self.log.info("Ingestion not faster with {} ingestors, using {}".format(self.current, previous))
+                self._set_current(previous, previous_throughput)
+                self._probe_interval = min(MAX_PROBE_INTERVAL, self._probe_interval * 2)
+                return
+
+            self._reference = throughput
+            self._probe_interval = PROBE_INTERVAL
+            self.log.info("Ingestion recovered, using {} ingestors".format(self.current))
+            return
+
+        if self._reference is None:
+            self._reference = throughput
+            return
+
+        if throughput < self._reference * SCALE_DOWN_RATIO and self.current > 1:
+            self._set_current(max(1, self.current // 2))
+            self.log.info("Ingestion slowed down, using {} ingestors".format(self.current))
+            return
+
+        self._reference = max(self._reference, throughput)
+        self._steady_ingestions += 1
+
+        if self.current < self.maximum and self._steady_ingestions >= self._probe_interval:
+            self._probed_from = (self.current, self._reference)
+            self._set_current(min(self.maximum, self.current * 2))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import hashlib
+import json
+import logging as logger
+import threading
+from collections import OrderedDict
+
+from evtx2splunk.Evtx2Splunk import Evtx2Splunk
+
+
+# CONTENT ------------------------------------------------
+# Maximum number of configured engines kept by a worker, one per index and ingestors count
+MAX_CACHED_ENGINES = 8
+
+
+def get_configuration_fingerprint(e2s_config: dict, proxies: dict):
+    """
+    Fingerprint of the part of the module configuration used by Evtx2Splunk.
+    Hashed so the credentials are not kept in the cache keys
+    :param e2s_config: Evtx2Splunk configuration
+    :param proxies: Proxies configuration
+    :return: str
+    """
+    dump = json.dumps({"config": e2s_config, "proxies": proxies}, sort_keys=True, default=str)
+    return hashlib.sha256(dump.encode()).hexdigest()
+
+
+class CachedEngine(object):
+    """
+    A configured Evtx2Splunk engine, with the lock serializing its use between the imports of a worker
+    """
+
+    def __init__(self, engine: Evtx2Splunk):
+        self.engine = engine
+        self.lock = threading.Lock()
+
+    def ingest(self, **kwargs):
+        with self.lock:
+            return self.engine.ingest(**kwargs)
+
+
+class EngineCache(object):
+    """
+    Keeps the configured Evtx2Splunk engines of a worker process, so the HEC token lookup, the management port calls
+    and the evtxdump configuration loading are done once, and the HTTP connections of the engine are reused by the
+    next imports. Engines are keyed on the configuration fingerprint, the index and the number of ingestors.
+    The whole cache is dropped as soon as the module configuration changes
+    """
+
+    def __init__(self, max_engines: int = MAX_CACHED_ENGINES):
+        self.max_engines = max_engines
+        self._engines = OrderedDict()
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def get(self, e2s_config: dict, index: str, nb_ingestors: int, proxies: dict = None, log=logger):
+        """
+        Return a configured engine, creating it if needed
+        :param e2s_config: Evtx2Splunk configuration, as built from the module configuration
+        :param index: Splunk index
+        :param nb_ingestors: Number of ingestors of the engine
+        :param proxies: Proxies configuration
+        :param log: Logger
+        :return: CachedEngine, or None if the engine could not be configured
+        """
+        fingerprint = get_configuration_fingerprint(e2s_config, proxies)
+        key = (index, nb_ingestors)
+
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                if self._engines:
+                    log.info("Module configuration changed, dropping {} cached engines".format(len(self._engines)))
+                self._engines.clear()
+                self._fingerprint = fingerprint
+
+            cached = self._engines.get(key)
+            if cached:
+                self._engines.move_to_end(key)
+                return cached
+
+            e2s = Evtx2Splunk()
+            if not e2s.configure(config=e2s_config,
+                                 index=index,
+                                 nb_ingestors=nb_ingestors,
+                                 testing=False,
+                                 no_resolve=True,
+                                 proxies=proxies
+                                 ):
+                return None
+
+            cached = CachedEngine(e2s)
+            self._engines[key] = cached
+            while len(self._engines) > self.max_engines:
+                self._engines.popitem(last=False)
+
+            return cached
+
+    def clear(self):
+        with self._lock:
+            self._engines.clear()
+            self._fingerprint = None
+
+
+# Engines of the current worker process
+engine_cache = EngineCache()
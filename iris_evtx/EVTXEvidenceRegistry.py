@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+from datetime import datetime
+
+
+# CONTENT ------------------------------------------------
+class EvidenceRegistry(object):
+    """
+    Batches the lookups and insertions of evidences for a case.
+    The bulk methods of the evidence storage are used when available:
+        - get_registered_evidences(sha256_list, case_id) -> iterable of the registered sha256
+        - add_evidences(evidences) with evidences a list of add_evidence keyword arguments
+    Otherwise the registry falls back to one is_evidence_registered / add_evidence call per file
+    """
+
+    def __init__(self, evidence_storage, case_id, user_id, log=None):
+        self.evidence_storage = evidence_storage
+        self.case_id = case_id
+        self.user_id = user_id
+        self.log = log
+
+    def _has_bulk_lookup(self):
+        return callable(getattr(self.evidence_storage, "get_registered_evidences", None))
+
+    def _has_bulk_insert(self):
+        return callable(getattr(self.evidence_storage, "add_evidences", None))
+
+    def get_registered(self, hashes: list) -> set:
+        """
+        Resolve which hashes are already registered as evidences of the case
+        :param hashes: List of SHA256
+        :return: Set of the registered SHA256
+        """
+        hashes = list(dict.fromkeys(hashes))
+        if not hashes:
+            return set()
+
+        if self._has_bulk_lookup():
+            registered = self.evidence_storage.get_registered_evidences(sha256_list=hashes, case_id=self.case_id)
+            return set(registered or [])
+
+        return {fhash for fhash in hashes
+                if self.evidence_storage.is_evidence_registered(sha256=fhash, case_id=self.case_id)}
+
+    def register(self, entries: list, description: str = "[Auto] EVTX file named {}") -> int:
+        """
+        Register as evidences the entries which are not yet known for the case
+        :param entries: List of ManifestEntry
+        :param description: Description of the evidences, formatted with the file name
+        :return: Number of evidences added
+        """
+        registered = self.get_registered([entry.sha256 for entry in entries])
+
+        evidences = []
+        for entry in entries:
+            if entry.sha256 in registered:
+                continue
+
+            # Same content uploaded twice is only registered once
+            registered.add(entry.sha256)
+            evidences.append({
+                "filename": entry.name,
+                "sha256": entry.sha256,
+                "date_added": datetime.now(),
+                "case_id": self.case_id,
+                "user_id": self.user_id,
+                "size": entry.size,
+                "description": description.format(entry.name)
+            })
+
+        if not evidences:
+            return 0
+
+        if self._has_bulk_insert():
+            self.evidence_storage.add_evidences(evidences=evidences)
+        else:
+            for evidence in evidences:
+                self.evidence_storage.add_evidence(**evidence)
+
+        if self.log:
+            self.log.info("Registered {} new evidences".format(len(evidences)))
+
+        return len(evidences)
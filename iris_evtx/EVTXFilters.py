@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import re
+from datetime import datetime, timezone
+
+
+# CONTENT ------------------------------------------------
+# Seconds between 1601-01-01, origin of the FILETIME, and 1970-01-01
+FILETIME_EPOCH_DELTA = 11644473600
+
+
+def filetime_to_timestamp(filetime: int) -> float:
+    return filetime / 10 ** 7 - FILETIME_EPOCH_DELTA
+
+
+def parse_time(value: str) -> float:
+    """
+    Parse an ISO 8601 date, UTC unless a timezone is given
+    :param value: Date, such as 2023-01-31T08:00:00Z or 2023-01-31 08:00
+    :return: POSIX timestamp
+    """
+    value = value.strip()
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+
+    # Python before 3.11 only accepts 3 or 6 digits of fractions
+    value = re.sub(r"\.(\d{6})\d+", r".\1", value)
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return date.timestamp()
+
+
+def _split_list(value) -> list:
+    if not value:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in re.split(r"[,;\n]", str(value)) if item.strip()]
+
+
+def parse_event_ids(value) -> list:
+    """
+    Parse a list of EventIDs and ranges, such as 4624,4625,4688-4690
+    :return: List of (first, last) ranges
+    """
+    ranges = []
+    for item in _split_list(value):
+        first, _, last = item.partition("-")
+        first = int(first)
+        last = int(last) if last else first
+        if last < first:
+            raise ValueError("Invalid EventID range {}".format(item))
+        ranges.append((first, last))
+
+    return ranges
+
+
+def _get_text(value):
+    # Values with attributes are parsed as {"#attributes": ..., "#text": value}
+    if isinstance(value, dict):
+        return value.get("#text")
+    return value
+
+
+class EventFilter(object):
+    """
+    Selection of the events to ingest, from the optional pipeline arguments:
+        channels_evtx: channels to ingest, the others are dropped
+        exclude_channels_evtx: channels dropped
+        eventids_evtx: EventIDs to ingest, as a list of ids and ranges
+        start_time_evtx, end_time_evtx: time range of the events to ingest, ISO 8601, UTC by default
+    Channels and EventIDs are only known once the records are decoded. The time range is also checked against
+    the timestamps of the records headers, so the chunks and files outside of it are skipped without decoding
+    """
+
+    def __init__(self, channels=None, exclude_channels=None, event_ids=None, start_time: float = None,
+                 end_time: float = None):
+        self.channels = {channel.lower() for channel in channels or []}
+        self.exclude_channels = {channel.lower() for channel in exclude_channels or []}
+        self.event_ids = event_ids or []
+        self.start_time = start_time
+        self.end_time = end_time
+
+        if start_time is not None and end_time is not None and end_time < start_time:
+            raise ValueError("The end of the time range is before its start")
+
+    @classmethod
+    def from_pipeline_args(cls, pipeline_args: dict):
+        """
+        Build the filter from the pipeline arguments of the task
+        :param pipeline_args: Pipeline arguments
+        :return: EventFilter
+        :raise ValueError: If an argument is malformed
+        """
+        start_time = pipeline_args.get("start_time_evtx")
+        end_time = pipeline_args.get("end_time_evtx")
+
+        return cls(channels=_split_list(pipeline_args.get("channels_evtx")),
+                   exclude_channels=_split_list(pipeline_args.get("exclude_channels_evtx")),
+                   event_ids=parse_event_ids(pipeline_args.get("eventids_evtx")),
+                   start_time=parse_time(start_time) if start_time else None,
+                   end_time=parse_time(end_time) if end_time else None)
+
+    @property
+    def has_time_range(self):
+        return self.start_time is not None or self.end_time is not None
+
+    @property
+    def has_record_criteria(self):
+        """
+        Tell if the filter selects events from their records, rather than from the chunks headers
+        """
+        return bool(self.channels or self.exclude_channels or self.event_ids)
+
+    @property
+    def is_active(self):
+        return bool(self.channels or self.exclude_channels or self.event_ids or self.has_time_range)
+
+    @property
+    def scope(self):
+        """
+        Key of the events selected by the filter, empty when every event is. Imports with the same scope send the
+        same events of a log
+        """
+        return repr(self) if self.is_active else ""
+
+    def __repr__(self):
+        return "EventFilter(channels={}, exclude_channels={}, event_ids={}, start={}, end={})".format(
+            sorted(self.channels) or "all", sorted(self.exclude_channels) or "none", self.event_ids or "all",
+            self.start_time, self.end_time)
+
+    def matches_time_range(self, first_time: float, last_time: float) -> bool:
+        """
+        Check if a span of records may hold events in the time range
+        :param first_time: Timestamp of the oldest record
+        :param last_time: Timestamp of the newest record
+        :return: bool
+        """
+        if self.start_time is not None and last_time < self.start_time:
+            return False
+        if self.end_time is not None and first_time > self.end_time:
+            return False
+        return True
+
+    def is_within_time_range(self, first_time: float, last_time: float) -> bool:
+        """
+        Check if every record of a span is in the time range, so it needs no record level filtering
+        """
+        return ((self.start_time is None or first_time >= self.start_time) and
+                (self.end_time is None or last_time <= self.end_time))
+
+    def matches_channel(self, channel: str) -> bool:
+        channel = (channel or "").lower()
+        if channel in self.exclude_channels:
+            return False
+        return not self.channels or channel in self.channels
+
+    def matches_event_id(self, event_id) -> bool:
+        if not self.event_ids:
+            return True
+        try:
+            event_id = int(event_id)
+        except (TypeError, ValueError):
+            return False
+        return any(first <= event_id <= last for first, last in self.event_ids)
+
+    def matches(self, event: dict, timestamp: float = None) -> bool:
+        """
+        Check a decoded event
+        :param event: Event, as decoded by evtxdump: {"Event": {"System": {...}, "EventData": {...}}}
+        :param timestamp: Timestamp of the event, if already known
+        :return: bool
+        """
+        system = event.get("Event", {}).get("System", {})
+        if not self.matches_channel(_get_text(system.get("Channel"))):
+            return False
+        if not self.matches_event_id(_get_text(system.get("EventID"))):
+            return False
+        if self.has_time_range:
+            if timestamp is None:
+                timestamp = get_event_timestamp(event)
+            if timestamp is None or not self.matches_time_range(timestamp, timestamp):
+                return False
+        return True
+
+
+def get_event_timestamp(event: dict):
+    """
+    Creation time of a decoded event
+    :return: POSIX timestamp, or None if the event has none
+    """
+    time_created = event.get("Event", {}).get("System", {}).get("TimeCreated", {})
+    if isinstance(time_created, dict):
+        system_time = time_created.get("#attributes", {}).get("SystemTime")
+        if system_time:
+            try:
+                return parse_time(str(system_time).replace(" ", "T"))
+            except ValueError:
+                return None
+    return None
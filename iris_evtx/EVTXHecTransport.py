@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import gzip
+import json
+import logging as logger
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# CONTENT ------------------------------------------------
+DEFAULT_BATCH_SIZE = 1024 * 1024
+DEFAULT_CONNECTIONS = 4
+DEFAULT_ACK_TIMEOUT = 300
+REQUEST_TIMEOUT = 120
+
+# Busy HEC answers are retried, with an exponential backoff
+RETRY_STATUSES = (429, 503)
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0
+ACK_POLL_INTERVAL = 2.0
+
+
+class SplunkError(Exception):
+
+    def __init__(self, message: str, status: int = None):
+        """
+        :param message: Error message
+        :param status: HTTP status returned by Splunk, None if it could not be reached
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class HecTransport(object):
+    """
+    Sends events to the HTTP Event Collector in batches bounded in size, optionally gzip compressed, over a pool
+    of persistent connections. Batches are posted in the background while the next ones are filled, up to one per
+    connection. With indexer acknowledgements, flush only returns once every batch is indexed.
+
+    EVTX events serialized as JSON are very repetitive, so compression divides the volume sent by 10 to 20
+    """
+
+    def __init__(self, url: str, token: str, verify: bool = False, proxies: dict = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, compress: bool = True, connections: int = DEFAULT_CONNECTIONS,
+                 use_ack: bool = False, ack_timeout: float = DEFAULT_ACK_TIMEOUT, log=logger):
+        """
+        :param url: Base URL of the HEC
+        :param token: Token of the HEC input
+        :param verify: Verify the certificate of the HEC
+        :param proxies: HTTP and HTTPS proxies
+        :param batch_size: Maximum uncompressed size of a batch, in bytes. A single bigger event is sent alone
+        :param compress: Compress the batches with gzip
+        :param connections: Number of batches sent concurrently, each over its own persistent connection
+        :param use_ack: Wait for the indexer acknowledgements of the batches. Needs ack enabled on the HEC input
+        :param ack_timeout: Seconds to wait for the acknowledgements
+        :param log: Logger
+        """
+        self.url = url.rstrip("/")
+        self.batch_size = max(1, batch_size)
+        self.compress = compress
+        self.connections = max(1, connections)
+        self.use_ack = use_ack
+        self.ack_timeout = ack_timeout
+        self.log = log
+
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.proxies = {protocol: proxy for protocol, proxy in (proxies or {}).items() if proxy}
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Authorization"] = "Splunk {}".format(token)
+        if use_ack:
+            # Acknowledgements are tracked per channel
+            self.session.headers["X-Splunk-Request-Channel"] = str(uuid.uuid4())
+
+        self._buffer = bytearray()
+        self._executor = ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="evtx_hec")
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._ack_ids = set()
+
+        self.batches = 0
+        self.events = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def send(self, events: list):
+        """
+        Queue events, sending the batches as they fill up
+        :param events: HEC event objects
+        :raise SplunkError: If a previous batch was refused
+        """
+        self.send_serialized(json.dumps(event, separators=(",", ":")).encode() for event in events)
+
+    def send_serialized(self, lines):
+        """
+        Queue events already serialized as JSON, sending the batches as they fill up
+        :param lines: Iterable of bytes, one event each
+        :raise SplunkError: If a previous batch was refused
+        """
+        for data in lines:
+            data = data.rstrip(b"\n")
+            if not data:
+                continue
+            if self._buffer and len(self._buffer) + len(data) + 1 > self.batch_size:
+                self._submit()
+
+            self._buffer += data + b"\n"
+            self.events += 1
+
+        if len(self._buffer) >= self.batch_size:
+            self._submit()
+
+    def flush(self):
+        """
+        Send the pending events and wait for every batch to be accepted, and indexed when acknowledgements are used
+        :raise SplunkError: If a batch was refused or not acknowledged in time
+        """
+        if self._buffer:
+            self._submit()
+
+        while self._pending:
+            self._pending.popleft().result()
+
+        if self.use_ack:
+            self._wait_acks()
+
+    def discard(self):
+        """
+        Drop the events not sent yet and wait for the batches in flight, after a failure
+        """
+        self._buffer = bytearray()
+        while self._pending:
+            try:
+                self._pending.popleft().result()
+            except SplunkError:
+                pass
+
+        with self._lock:
+            self._ack_ids.clear()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def _submit(self):
+        payload = bytes(self._buffer)
+        self._buffer = bytearray()
+
+        # A full pool holds back the parsing, so the events waiting to be sent are bounded
+        while len(self._pending) >= self.connections:
+            self._pending.popleft().result()
+
+        self._pending.append(self._executor.submit(self._post, payload))
+
+    def _post(self, payload: bytes):
+        headers = {}
+        body = payload
+        if self.compress:
+            body = gzip.compress(payload, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+
+        response = self._request("/services/collector/event", data=body, headers=headers)
+        if self.use_ack:
+            try:
+                ack_id = response.json().get("ackId")
+            except ValueError:
+                ack_id = None
+            if ack_id is None:
+                raise SplunkError("The HEC did not return an acknowledgement id, is ack enabled on the input?")
+            with self._lock:
+                self._ack_ids.add(ack_id)
+
+        with self._lock:
+            self.batches += 1
+            self.raw_bytes += len(payload)
+            self.sent_bytes += len(body)
+
+    def _request(self, path: str, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = self.session.post(self.url + path, timeout=REQUEST_TIMEOUT, **kwargs)
+            except requests.RequestException as e:
+                if attempt == MAX_RETRIES:
+                    raise SplunkError("Unable to reach the HEC at {}: {}".format(self.url, e))
+            else:
+                if response.status_code == 200:
+                    return response
+                if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    raise SplunkError("HEC refused the events with {}: {}".format(response.status_code,
+                                                                                response.text[:200]),
+                                      status=response.status_code)
+
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    def _wait_acks(self):
+        deadline = time.time() + self.ack_timeout
+        while True:
+            with self._lock:
+                ack_ids = sorted(self._ack_ids)
+            if not ack_ids:
+                return
+
+            response = self._request("/services/collector/ack", json={"acks": ack_ids})
+            try:
+                acks = response.json().get("acks", {})
+            except ValueError:
+                acks = {}
+
+            with self._lock:
+                self._ack_ids -= {ack_id for ack_id in ack_ids if acks.get(str(ack_id))}
+                remaining = len(self._ack_ids)
+
+            if not remaining:
+                return
+            if time.time() > deadline:
+                raise SplunkError("{} batches not acknowledged by the indexers after {}s".format(
+                    remaining, self.ack_timeout))
+
+            time.sleep(ACK_POLL_INTERVAL)
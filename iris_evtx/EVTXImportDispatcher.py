@@ -19,38 +19,44 @@
 #  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 # IMPORTS ------------------------------------------------
-import hashlib
 import os
 import shutil
-import tempfile
 from pathlib import Path
 import time
-from multiprocessing import cpu_count
-from datetime import datetime
-from pyunpack import Archive
-
-from evtx2splunk.Evtx2Splunk import Evtx2Splunk
+from concurrent.futures import ThreadPoolExecutor
 
 import iris_interface.IrisInterfaceStatus as InterfaceStatus
 
+from iris_evtx.EVTXArchives import ARCHIVE_SUFFIXES, EVTX_SUFFIXES, estimate_extracted_size, extract_archive, \
+    get_tree_size
+from iris_evtx.EVTXChunks import CHUNK_SIZE, EVTXFormatError, get_chunk_times, list_chunks, write_chunks
+from iris_evtx.EVTXChunkParser import ChunkParser, is_daemon_process
+from iris_evtx.EVTXConcurrency import AdaptiveIngestors, get_auto_ingestors, get_available_cpus
+from iris_evtx.EVTXEngineCache import engine_cache
+from iris_evtx.EVTXEvidenceRegistry import EvidenceRegistry
+from iris_evtx.EVTXFilters import EventFilter, filetime_to_timestamp
+from iris_evtx.EVTXImportPipeline import STOP, EVTXSlice, FileOutcome, ImportUnit, Pipeline, imap_bounded
+from iris_evtx.EVTXManifest import ManifestEntry, hash_file
+from iris_evtx.EVTXMetrics import ImportMetrics, export_metrics
+from iris_evtx.EVTXProgress import ImportCancellation, ImportProgress
+from iris_evtx.EVTXRecordCache import RECORD_CACHE_DIR_NAME, RecordCache
+from iris_evtx.EVTXRecordEngine import RecordEngine, is_record_engine_available, read_log_identity
+from iris_evtx.EVTXScratchSpace import ScratchSpace
+from iris_evtx.EVTXSplunk import SplunkClient, SplunkError
+from iris_evtx.EVTXSpool import DEFAULT_SEGMENT_SIZE, SPOOL_DIR_NAME, SpoolWriter, spool_forwarder
+from iris_evtx.EVTXStateStore import StateStore, get_state_path
 
-# CONTENT ------------------------------------------------
-def decompress_7z(filename, output_dir):
-    """
-    Decompress a 7z file in specified output directory
-    :param filename: Filename to decompress
-    :param output_dir: Target output dir
-    :return: True if uncompress
-    """
-    try:
-        a = Archive(filename=filename)
-        a.extractall(directory=output_dir, auto_create_dir=True)
 
-    except Exception as e:
-        print(e)
-        return False
+# CONTENT ------------------------------------------------
+# Seconds an extraction waits for scratch space to be released by other archives or imports
+SCRATCH_WAIT_TIMEOUT = 30 * 60
 
-    return True
+# Maximum items processed at once by the stages working on batches
+CLASSIFY_BATCH_SIZE = 256
+INGEST_BATCH_MAX_UNITS = 64
+REGISTER_BATCH_MAX_UNITS = 256
+# Least number of bytes sent in one engine call, whatever the number of ingestors
+ROUND_MIN_BYTES = 256 * 1024 * 1024
 
 
 class ImportDispatcher(object):
@@ -72,20 +78,108 @@ class ImportDispatcher(object):
         self.case_id = task_args['case_id']
         self.is_update = task_args['is_update']
         self._hostname = task_args['pipeline_args']['hostname_evtx']
+        self._pipeline_args = task_args['pipeline_args']
+        self.event_filter = None
+        self._use_record_engine = False
+        self._use_spool = False
+        self._record_engine = None
+        self.scratch = None
+        self._pipeline = None
+        self._accepted_files = 0
+        self._has_failures = False
+        self._ingestors = None
+        self._rounds_count = 0
+        self._outcomes = {}
+        self.state_store = None
+        # (host, channel) of the EVTX files, by SHA256
+        self._log_identities = {}
+        # Uploaded files, EVTX files and logs of the case whose spooled events were rejected by Splunk
+        self._rejected_sources = {}
+        self._rejected_members = set()
+        self._rejected_logs = set()
+        self.metrics = None
+        self.progress = None
+        self.cancellation = None
+        self._is_cancelled = False
+        # A shard is also cancelled with the task which split the upload
+        self._task_ids = [getattr(getattr(task_self, 'request', None), 'id', None),
+                          task_args.get('evtx_parent_task_id')]
+
+        self.evidence_registry = EvidenceRegistry(evidence_storage=evidence_storage,
+                                                  case_id=self.case_id,
+                                                  user_id=self.user_id,
+                                                  log=log)
 
     def _ret_task_success(self):
         """
-        Return a task compatible success object to be passed to the next task
+        Return a task compatible success object to be passed to the next task.
+        The status is built for this import, the module level ones are shared by every task of the worker
         :return:
         """
-        return InterfaceStatus.I2Success
+        return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success",
+                                        data=self._get_outcomes_summary())
 
     def _ret_task_failure(self):
         """
         Return a task compatible failure object to be passed to the next task
         :return:
         """
-        return InterfaceStatus.I2Error
+        return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError, message="Unspecified error",
+                                        data=self._get_outcomes_summary())
+
+    def _get_outcomes_summary(self):
+        """
+        Outcome of every accepted file of the import
+        :return: dict
+        """
+        outcomes = list(self._outcomes.values())
+        summary = {
+            "files": [outcome.to_dict() for outcome in outcomes],
+            "succeeded": sum(1 for outcome in outcomes if outcome.success),
+            "failed": sum(1 for outcome in outcomes if not outcome.success),
+            "rejected": sorted(self._rejected_sources.values())
+        }
+        if self.metrics:
+            summary["metrics"] = self.metrics.summary()
+
+        return summary
+
+    def _log_outcomes(self):
+        """
+        Log the outcome of every accepted file
+        """
+        for outcome in self._outcomes.values():
+            if outcome.success:
+                self.log.info("{}: {} events sent, {} bytes ingested".format(outcome.name, outcome.records,
+                                                                            outcome.bytes))
+            else:
+                self.log.error("{}: {}. Not registered, it will be imported again next time".format(
+                    outcome.name, "; ".join(outcome.errors)))
+
+    def _get_int_configuration(self, param_name, default):
+        """
+        Read an integer parameter from the module configuration
+        :param param_name: Name of the parameter
+        :param default: Value returned if the parameter is not set or malformed
+        :return: int
+        """
+        value = self.configuration.get(param_name)
+        try:
+            return int(value) if value is not None else default
+        except (TypeError, ValueError):
+            self.log.warning("Invalid value {} for {}, using {}".format(value, param_name, default))
+            return default
+
+    def _get_hashing_workers(self):
+        """
+        Number of files hashed concurrently while listing the upload. 0 means one per core
+        :return: int
+        """
+        workers = self._get_int_configuration("evtx_hashing_workers", 0)
+        if workers <= 0:
+            workers = get_available_cpus()
+
+        return workers
 
     def import_files(self):
         """
@@ -95,198 +189,1013 @@ class ImportDispatcher(object):
 
         self.log.info("Received new evtx import signal for {}".format(self.case_name))
 
-        temp_zippath = tempfile.TemporaryDirectory()
-        shutil.move(str(self.path), temp_zippath.name)
-        module_name = self.path.name
-        self.path = Path(temp_zippath.name, module_name)
+        try:
+            self.event_filter = EventFilter.from_pipeline_args(self._pipeline_args)
+        except ValueError as e:
+            self.log.error("Invalid events filter: {}".format(e))
+            return self._ret_task_failure()
+
+        if self.event_filter.is_active:
+            self.log.info("Filtering events: {}".format(self.event_filter))
+
+        # Sending every event when only some were requested is worse than failing
+        if self.event_filter.has_record_criteria and not is_record_engine_available():
+            self.log.error("Channels and EventIDs filters need the evtx package, which is not installed")
+            return self._ret_task_failure()
+        self._use_record_engine = self._needs_record_engine()
 
-        import_list = self._create_import_list(path=self.path)
+        # Every import works in its own scratch directory, removed whatever the outcome of the import
+        with self._create_scratch_space() as scratch:
+            self.scratch = scratch
 
-        ret = None
-        if import_list:
+            shutil.move(str(self.path), str(scratch.path))
+            module_name = self.path.name
+            self.path = Path(scratch.path, module_name)
 
-            for data_type in import_list:
+            self.log.info("Checking input files")
+            self.log.info("Path is {}".format(self.path))
 
-                ret_t = self.inner_import_files(import_list[data_type], data_type)
+            if not self.path.is_dir():
+                self.log.error("Internal error. Provided path is not a path")
+                return self._ret_task_failure()
 
-                # Merge the result with the current caller
-                ret = InterfaceStatus.merge_status(ret, ret_t)
+            # The state is shared by the imports of the case only in a directory shared by the workers, the scratch
+            # directory is usually local to a worker
+            state_path = get_state_path(self.configuration)
+            if not self.configuration.get("evtx_state_dir"):
+                self.log.warning("evtx_state_dir is not set. The EVTX files ingested from archives, the watermarks, "
+                                 "the checkpoints and the cancellations are kept in {}, only seen by the imports "
+                                 "run by the workers of this host".format(state_path.parent))
 
-        else:
+            self.cancellation = ImportCancellation(state_path.parent, task_ids=self._task_ids,
+                                                   case_id=self.case_id, log=self.log)
+            self.progress = ImportProgress(interval=self._get_int_configuration("evtx_progress_interval", 30),
+                                           log=self.log)
+            self.progress.start()
+
+            with StateStore(state_path) as state_store:
+                self.state_store = state_store
+                self._load_rejected()
+                try:
+                    is_success = self._run_pipeline()
+                finally:
+                    self.progress.stop()
+                    self.cancellation.clear()
+                    if self._record_engine:
+                        self._close_record_engine()
+
+            self.progress.report()
+            if self._is_cancelled:
+                self.log.error("Import cancelled, {} files registered before stopping".format(
+                    sum(1 for outcome in self._outcomes.values() if outcome.registered)))
+
+            self._log_outcomes()
+            self._export_metrics()
 
-            self.log.error("Import list was empty. Please check previous errors.")
-            self.log.error("Either internal error, either the files could not be uploaded successfully.")
-            self.log.error("Nothing to import")
-            ret = self._ret_task_failure()
+            if not self._accepted_files:
+                self.log.error("Import list was empty. Please check previous errors.")
+                self.log.error("Either internal error, either the files could not be uploaded successfully.")
+                self.log.error("Nothing to import")
+                return self._ret_task_failure()
 
-        return ret
+        if not is_success:
+            return self._ret_task_failure()
+
+        return self._ret_task_success()
 
-    def _create_import_list(self, path=None):
+    def _export_metrics(self):
         """
-        Create the list for every files
-        :param path: Path containing the files to check
-        :return: A json with types and files
+        Emit the metrics of the import to the logs, and to the outputs set in the module configuration
         """
-        import_list = {
-        }
+        if not self.metrics:
+            return
+
+        export_metrics(self.metrics.summary(), self.configuration,
+                       labels={"case_id": self.case_id, "index": self.index},
+                       log=self.log)
+
+    def _create_scratch_space(self):
+        """
+        Scratch space of the import, as set in the module configuration
+        :return: ScratchSpace
+        """
+        return ScratchSpace(base_dir=self.configuration.get("evtx_scratch_dir"),
+                            budget=self._get_int_configuration("evtx_scratch_budget", 0) * 1024 * 1024,
+                            min_free=max(0, self._get_int_configuration("evtx_scratch_min_free", 1024)) * 1024 * 1024,
+                            log=self.log)
+
+    def _run_pipeline(self):
+        """
+        Process the upload as a pipeline, each file flowing to the next stage as soon as it is ready:
+            hash -> classify (dedup) -> extract (archives only) -> ingest -> register
+        The stages are connected with bounded queues, so a slow stage holds back the ones before it
+        :return: True if every accepted file was ingested and registered
+        """
+        self.log.info("New imports for {} on behalf of {}".format(self.case_name, self.user))
+        self.log.info("Starting processing of files")
+
+        self._pipeline = Pipeline(queue_size=self._get_int_configuration("evtx_pipeline_queue_size", 16),
+                                  log=self.log)
+        self._accepted_files = 0
+        self._has_failures = False
+        self._outcomes = {}
+        self.metrics = ImportMetrics()
+
+        # The CPUs are shared with the other imports running on the host
+        self._ingestors = AdaptiveIngestors(configured=self.configuration.get("evtx_nb_ingestors", "auto"),
+                                            concurrent_imports=self.scratch.count_live_imports(),
+                                            log=self.log)
+        self.log.info("Using up to {} ingestors".format(self._ingestors.maximum))
+
+        hashed_queue = self._pipeline.create_queue()
+        archive_queue = self._pipeline.create_queue()
+        # Ingestion receives the EVTX files from the classification and the archives from the extraction
+        ingest_queue = self._pipeline.create_queue(producers=2)
+        register_queue = self._pipeline.create_queue()
+
+        # A queue staying full points to a slow stage after it, an empty one to a slow stage before it
+        self.metrics.watch_queues({"hashed": hashed_queue, "archive": archive_queue, "ingest": ingest_queue,
+                                   "register": register_queue})
+
+        self._add_stage("hash", lambda: self._stage_hash(hashed_queue),
+                        out_queues=[hashed_queue])
+        self._add_stage("classify", lambda: self._stage_classify(hashed_queue, ingest_queue, archive_queue),
+                        in_queue=hashed_queue, out_queues=[ingest_queue, archive_queue])
+        self._add_stage("extract", lambda: self._stage_extract(archive_queue, ingest_queue),
+                        in_queue=archive_queue, out_queues=[ingest_queue])
+        self._add_stage("ingest", lambda: self._stage_ingest(ingest_queue, register_queue),
+                        in_queue=ingest_queue, out_queues=[register_queue])
+        self._add_stage("register", lambda: self._stage_register(register_queue),
+                        in_queue=register_queue)
+
+        is_success = self._pipeline.join() and not self._has_failures
+        self.metrics.stop()
+
+        # A file is only imported once registered. Those left behind by a crashed stage fail
+        for outcome in self._outcomes.values():
+            if outcome.success and not outcome.registered:
+                outcome.errors.append("Import interrupted before the file was registered")
+                is_success = False
+
+        return is_success
+
+    def _add_stage(self, name, target, in_queue=None, out_queues=None):
+        """
+        Start a stage of the pipeline, recording when it starts and ends
+        :param name: Name of the stage
+        :param target: Function running the stage
+        :param in_queue: Queue consumed by the stage, if any
+        :param out_queues: Queues fed by the stage
+        """
+        def run():
+            self.metrics.stage_started(name)
+            try:
+                target()
+            finally:
+                self.metrics.stage_ended(name)
+
+        self._pipeline.add_stage(name, run, in_queue=in_queue, out_queues=out_queues)
+
+    def _hash_file(self, file_path):
+        """
+        Hash an uploaded file, accounting the time it took
+        :param file_path: Path of the file
+        :return: ManifestEntry
+        """
+        start_time = time.time()
+        entry = ManifestEntry.from_path(file_path)
+        duration = time.time() - start_time
 
-        self.log.info("Checking input files")
-        self.log.info("Path is {}".format(path))
+        self.metrics.add("hash", duration=duration, nbytes=entry.size)
+        self.metrics.add_file_time(entry.name, "hash", duration)
 
-        if path.is_dir():
-            for entry in path.iterdir():
+        return entry
 
-                if not entry.is_dir():
-                    # Compute file hash
-                    # Compute SHA256 of file
-                    sha256_hash = hashlib.sha256()
+    def _stage_hash(self, out_queue):
+        """
+        List the uploaded files and hash them on a pool of workers
+        :param out_queue: Receives the ManifestEntry of the files
+        """
+        files_paths = [file_path for file_path in self.path.iterdir() if not file_path.is_dir()]
+        workers = self._get_hashing_workers()
+        self.progress.set_totals(len(files_paths), sum(file_path.stat().st_size for file_path in files_paths))
 
-                    with open(entry, "rb") as f:
-                        # Read and update hash string value in blocks of 4K
-                        for byte_block in iter(lambda: f.read(4096), b""):
-                            sha256_hash.update(byte_block)
-                        fhash = sha256_hash.hexdigest()
+        # The hash is computed once, and reused when registering the evidence
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="evtx_hash") as executor:
+            for entry in imap_bounded(executor, self._hash_file, files_paths, max_in_flight=2 * workers):
+                if self._check_cancelled():
+                    break
+                out_queue.put(entry)
+
+    def _stage_classify(self, in_queue, ingest_queue, archive_queue):
+        """
+        Drop the files already registered or unsupported, and route the others to the ingestion or
+        to the extraction
+        :param in_queue: ManifestEntry of the uploaded files
+        :param ingest_queue: Receives the EVTX files, as ImportUnit
+        :param archive_queue: Receives the archives, as ManifestEntry
+        """
+        while True:
+            first = self._pipeline.get(in_queue)
+            if first is STOP:
+                return
 
-                        file_registered = self.evidence_storage.is_evidence_registered(sha256=fhash,
-                                                                                       case_id=self.case_id)
+            manifest = self._pipeline.drain(in_queue, first, CLASSIFY_BATCH_SIZE)
 
-                        if not file_registered:
+            # Resolve the hashes by batches rather than one storage round-trip per file
+            with self.metrics.timed("classify"):
+                registered = self.evidence_registry.get_registered([entry.sha256 for entry in manifest])
+            # The files whose events were rejected by Splunk are registered, but not ingested
+            registered -= set(self._rejected_sources)
 
-                            is_valid = True
-                            # EVTX are Windows event files. EVTX_DATA is found in ORC results
-                            if entry.suffix == ".evtx" or entry.suffix == ".evtx_data":
+            for entry in manifest:
 
-                                if "evtx" not in import_list:
-                                    import_list["evtx"] = [entry]
-                                else:
-                                    import_list["evtx"].append(entry)
+                if self._check_cancelled():
+                    self._cancel_entry(entry)
 
-                            elif entry.suffix == ".zip" or entry.suffix == ".7z":
+                elif entry.sha256 not in registered:
 
-                                if "archive" not in import_list:
-                                    import_list["archive"] = [entry]
-                                else:
-                                    import_list["archive"].append(entry)
+                    # EVTX are Windows event files. EVTX_DATA is found in ORC results
+                    if entry.suffix in EVTX_SUFFIXES:
+                        files_type = "evtx"
+                    elif entry.suffix in ARCHIVE_SUFFIXES:
+                        files_type = "archive"
+                    else:
+                        files_type = None
 
-                            else:
-                                is_valid = False
+                    if files_type is None:
+                        try:
+                            entry.path.unlink()
+                            self.log.debug(entry.path)
+                        except Exception:
+                            pass
+                        self.log.info("File has been deleted from the server")
+                        self.progress.file_done(entry)
 
-                            if not is_valid:
-                                try:
-                                    entry.unlink()
-                                    self.log.debug(entry)
-                                except Exception:
-                                    pass
-                                self.log.info("File has been deleted from the server")
+                    else:
+                        # Set before the file is handed over, the next stages account their work in it
+                        self._accepted_files += 1
+                        self._outcomes[entry] = FileOutcome(entry, files_type)
 
+                        if files_type == "evtx":
+                            ingest_queue.put(ImportUnit("evtx", [entry], input_path=entry.path))
                         else:
-                            entry.unlink()
-                            self.log.warning("{} was already imported".format(entry))
+                            archive_queue.put(entry)
 
-            # log.info("Detected {} valid files".format(len(import_list)))
-            return import_list
+                else:
+                    entry.path.unlink()
+                    self.log.warning("{} was already imported".format(entry.path))
+                    self.progress.file_done(entry)
 
-        else:
-            self.log.error("Internal error. Provided path is not a path")
+    def _stage_extract(self, in_queue, out_queue):
+        """
+        Extract the archives concurrently. Each archive is handed to the ingestion as soon as it is extracted,
+        while the others are still being extracted
+        :param in_queue: ManifestEntry of the archives
+        :param out_queue: Receives the extracted archives, as ImportUnit
+        """
+        workers = self._get_int_configuration("evtx_extraction_workers", 0)
+        if workers <= 0:
+            workers = get_available_cpus()
+
+        futures = {}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="evtx_extract") as executor:
+            for archive in self._pipeline.iter_queue(in_queue):
+                futures[executor.submit(self._extract_archive, archive, out_queue)] = archive
+
+        # An archive whose extraction crashed is neither ingested nor registered, it fails
+        for future, archive in futures.items():
+            error = future.exception()
+            if error is None:
+                continue
+
+            self.log.error("Extraction of {} failed: {}".format(archive.name, error))
+            self._outcomes[archive].errors.append("Unable to extract {}".format(archive.name))
+            self._has_failures = True
+            self.progress.file_done(archive)
+
+    def _extract_archive(self, archive, out_queue):
+        """
+        Extract an archive in the scratch space and queue it for ingestion
+        :param archive: ManifestEntry of the archive
+        :param out_queue: Receives the extracted archive as ImportUnit
+        """
+        if self._check_cancelled():
+            self._cancel_entry(archive)
+            return
+
+        max_depth = self._get_int_configuration("evtx_archive_max_depth", 3)
+        max_size = self._get_int_configuration("evtx_archive_max_size", 0) * 1024 * 1024
+
+        zippath = self.scratch.path / "out" / archive.name.replace(archive.suffix, '')
+        reserved = 0
+        members_hashes = {}
+
+        try:
+            zippath.mkdir(parents=True, exist_ok=True)
+
+            # Space is reserved before extracting, and waits for the ingested archives to free theirs if needed
+            needed = estimate_extracted_size(archive.path)
+            if max_size:
+                needed = min(needed, max_size)
+
+            if not self.scratch.reserve(needed, timeout=SCRATCH_WAIT_TIMEOUT):
+                is_extracted = False
+            else:
+                reserved = needed
+                # The wait for scratch space is not accounted as extraction time
+                start_time = time.time()
+                try:
+                    is_extracted = extract_archive(archive.path, zippath, max_depth=max_depth, max_size=max_size,
+                                                   log=self.log)
+                finally:
+                    # What the archive extracts is on disk now, whether it succeeded or not
+                    self.scratch.mark_written(reserved)
+
+                # The members are hashed by the extraction threads, rather than one after the other by the ingestion
+                if is_extracted:
+                    members_hashes = {evtx_path: hash_file(evtx_path) for evtx_path in zippath.rglob("*")
+                                      if evtx_path.is_file() and evtx_path.suffix in EVTX_SUFFIXES}
+                duration = time.time() - start_time
+                self.metrics.add("extract", duration=duration, nbytes=get_tree_size(zippath))
+                self.metrics.add_file_time(archive.name, "extract", duration)
+        except Exception as e:
+            self.log.error("Unable to extract {}: {}".format(archive.name, e))
+            is_extracted = False
+
+        unit = ImportUnit("archive", [archive], input_path=zippath, reserved=reserved, work_dir=zippath)
+        unit.members_hashes = members_hashes
+        if not is_extracted:
+            self.log.error("Unable to extract {}".format(archive.name))
+            self._outcomes[archive].errors.append("Unable to extract {}".format(archive.name))
+            self._has_failures = True
+            self._release_unit(unit)
+            self.progress.file_done(archive)
+            return
+
+        out_queue.put(unit)
+
+    def _stage_ingest(self, in_queue, out_queue):
+        """
+        Ingest the units as they arrive. EVTX files waiting together are ingested in a single unit
+        :param in_queue: ImportUnit to ingest
+        :param out_queue: Receives the ImportUnit holding the files successfully ingested
+        """
+        batch_index = 0
+
+        while True:
+            first = self._pipeline.get(in_queue)
+            if first is STOP:
+                return
+
+            units = self._pipeline.drain(in_queue, first, INGEST_BATCH_MAX_UNITS)
+
+            evtx_units = [unit for unit in units if unit.files_type == "evtx"]
+            units = [unit for unit in units if unit.files_type != "evtx"]
+            if evtx_units:
+                batch_index += 1
+                units.append(self._merge_evtx_units(evtx_units, batch_index))
+
+            for unit in units:
+                if self._check_cancelled():
+                    for entry in unit.entries:
+                        self._cancel_entry(entry)
+                    self._release_unit(unit)
+                    continue
+
+                self.log.info("{} files of type {} to import into {}".format(len(unit.entries), unit.files_type,
+                                                                             self.index))
+                # The number of ingestors may have been adapted after the previous unit
+                with self.metrics.timed("engine_setup"):
+                    e2s = self._configure_engine(nb_ingestors=self._ingestors.current)
+                ingested_bytes = get_tree_size(unit.input_path)
+                start_time = time.time()
+
+                if e2s:
+                    succeeded = self._ingest_unit(e2s, unit)
+                else:
+                    self.log.error("Unable to configure Evtx2Splunk")
+                    for entry in unit.entries:
+                        self._outcomes[entry].errors.append("Unable to configure Evtx2Splunk")
+                    succeeded = []
+
+                end_time = time.time()
+                self.log.info("Finished in {time}".format(time=end_time - start_time))
+
+                # Free the space as soon as the unit is ingested
+                self._release_unit(unit)
+                for entry in unit.entries:
+                    self.progress.file_done(entry)
+
+                failed = [entry for entry in unit.entries if entry not in succeeded]
+                if failed:
+                    self.log.error("Ingestion of {} failed".format(", ".join(entry.name for entry in failed)))
+                    self._has_failures = True
+
+                if succeeded:
+                    self._ingestors.record(ingested_bytes, end_time - start_time)
+
+                    # Only the files fully ingested are registered, the failed ones are imported again next time
+                    unit.entries = succeeded
+                    out_queue.put(unit)
+
+    def _ingest_unit(self, e2s, unit):
+        """
+        Ingest the EVTX files of a unit by rounds of slices of a few chunks. The last chunk of each slice is
+        checkpointed once the slice is acknowledged, so a retried import resumes each file where it stopped
+        instead of sending its events again. The record engine acknowledges the slices one by one, Evtx2Splunk
+        the whole round.
+        A round failed by Evtx2Splunk is sent again slice by slice, to find out which files are failing. The
+        failing files are given up, the others go on.
+        The highest record id ingested of each log is kept per host and channel. Updates of the case only send
+        the records past it, the chunks before it are skipped from their headers
+        :param e2s: Configured engine
+        :param unit: ImportUnit
+        :return: List of the ManifestEntry of the unit fully ingested
+        """
+        slice_chunks = max(1, self._get_int_configuration("evtx_checkpoint_chunks", 256))
+        owners = {entry.path: entry for entry in unit.entries}
+
+        evtx_files = []
+        for evtx_path in sorted(unit.input_path.rglob("*")):
+            if evtx_path.is_file() and evtx_path.suffix in EVTX_SUFFIXES:
+                # Files extracted from an archive belong to it
+                owner = owners.get(evtx_path, unit.entries[0])
+                sha256 = owner.sha256 if evtx_path in owners else unit.members_hashes.get(evtx_path) or \
+                    hash_file(evtx_path)
+                evtx_files.append((sha256, owner, evtx_path))
+
+        # The same EVTX file is often found in several collections of a host, it is only ingested once per case
+        ingested_members = self.state_store.get_ingested_members(self.case_id, self.index,
+                                                                 [sha256 for sha256, _, _ in evtx_files])
+        for sha256 in self._rejected_members:
+            ingested_members.pop(sha256, None)
+
+        slices = []
+        small_slices = []
+        new_members = []
+        watermarks = {}
+        for sha256, owner, evtx_path in evtx_files:
+            if sha256 in ingested_members:
+                self.log.info("{} was already ingested from {}".format(evtx_path.name, ingested_members[sha256]))
+                continue
+
+            ingested_members[sha256] = owner.name
+            new_members.append((sha256, owner, evtx_path))
+
+            try:
+                chunks = list_chunks(evtx_path, with_times=self.event_filter.has_time_range)
+            except EVTXFormatError as e:
+                # Left to the engine to deal with, without checkpoints
+                self.log.warning("{}, ingested without checkpoints".format(e))
+                small_slices.append(EVTXSlice(evtx_path, sha256, owner, whole=True))
+                continue
+
+            # Marks are raised by every import, within the scope of its filter, and applied to the updates of the case
+            is_trimmed = False
+            min_record_id = None
+            identity = None
+            if chunks:
+                identity = self._get_log_identity(evtx_path, chunks[0])
+            if identity:
+                self._log_identities[sha256] = identity
+                new_chunks, is_reset = chunks, False
+                if self.is_update:
+                    new_chunks, min_record_id, is_reset = self._skip_ingested_chunks(evtx_path, identity, chunks)
+                watermarks[sha256] = (identity, max(chunks, key=lambda chunk: chunk.last_record_id), is_reset)
+
+                if not new_chunks:
+                    continue
+                is_trimmed = len(new_chunks) < len(chunks)
+                chunks = new_chunks
+
+            # The chunks out of the time range are skipped without being decoded
+            if self.event_filter.has_time_range:
+                in_range = [chunk for chunk in chunks if chunk.first_time is not None and
+                            self.event_filter.matches_time_range(filetime_to_timestamp(chunk.first_time),
+                                                                 filetime_to_timestamp(chunk.last_time))]
+                if not in_range:
+                    self.log.info("{} has no events in the time range".format(evtx_path.name))
+                    continue
+
+                is_trimmed = is_trimmed or len(in_range) < len(chunks)
+                chunks = in_range
+
+            checkpoint = None
+            if sha256 not in self._rejected_members:
+                checkpoint = self.state_store.get_checkpoint(sha256, self.index)
+            if checkpoint:
+                chunks = [chunk for chunk in chunks if chunk.index > checkpoint[0]]
+                if not chunks:
+                    self.log.info("{} was already ingested into {}".format(evtx_path.name, self.index))
+                    continue
+                self.log.info("Resuming {} after record {}".format(evtx_path.name, checkpoint[1]))
+
+            if not checkpoint and len(chunks) <= slice_chunks:
+                # Small files are sent in a single slice, without checkpoints. They are ingested as is, without
+                # copying their chunks, unless some of them are skipped
+                small_slices.append(EVTXSlice(evtx_path, sha256, owner, chunks=chunks, whole=not is_trimmed,
+                                              min_record_id=min_record_id))
+                continue
+
+            for start in range(0, len(chunks), slice_chunks):
+                slices.append(EVTXSlice(evtx_path, sha256, owner, chunks=chunks[start:start + slice_chunks],
+                                        min_record_id=min_record_id, checkpoint=True))
+
+        # The small files go first, so they are sent together
+        slices = small_slices + slices
+
+        failed_files = set()
+        owners_bytes = {}
+        for evtx_slice in slices:
+            owners_bytes[evtx_slice.owner] = owners_bytes.get(evtx_slice.owner, 0) + evtx_slice.size
+        done_bytes = dict.fromkeys(owners_bytes, 0)
+
+        rounds = self._split_rounds(slices, slice_chunks)
+        for round_index, round_slices in enumerate(rounds):
+
+            # The acknowledged chunks stay checkpointed, a new import resumes after them
+            if self._check_cancelled():
+                for owner in {evtx_slice.owner for pending in rounds[round_index:] for evtx_slice in pending}:
+                    self._cancel_entry(owner, is_accepted=True)
+                break
+
+            # The chunks of a file are sent in order, nothing is sent after a failed chunk
+            round_slices = [evtx_slice for evtx_slice in round_slices if evtx_slice.sha256 not in failed_files]
+            if not round_slices:
+                continue
+
+            start_time = time.time()
+            acknowledged = self._ingest_round(e2s, round_slices)
+            # The record engine only fails a round when Splunk does, and a retry would send again the events of
+            # the round already accepted
+            if len(acknowledged) < len(round_slices) and len(round_slices) > 1 and not self._use_record_engine:
+                acknowledged = [evtx_slice for evtx_slice in round_slices if self._ingest_round(e2s, [evtx_slice])]
+            duration = time.time() - start_time
+
+            self.metrics.add("ingest", duration=duration,
+                             nbytes=sum(evtx_slice.size for evtx_slice in acknowledged),
+                             records=sum(evtx_slice.records for evtx_slice in acknowledged))
+            self.progress.add_records(sum(evtx_slice.records for evtx_slice in acknowledged))
+            for evtx_slice in acknowledged:
+                done_bytes[evtx_slice.owner] += evtx_slice.size
+                self.progress.set_partial(evtx_slice.owner, evtx_slice.owner.size * done_bytes[evtx_slice.owner]
+                                          // owners_bytes[evtx_slice.owner])
+
+            # The slices of a round are ingested together, the round time is shared by their size
+            round_bytes = sum(evtx_slice.size for evtx_slice in round_slices) or 1
+            for evtx_slice in round_slices:
+                self.metrics.add_file_time(evtx_slice.owner.name, "ingest", duration * evtx_slice.size / round_bytes)
+
+            for evtx_slice in round_slices:
+                outcome = self._outcomes[evtx_slice.owner]
+
+                # A checkpoint after a failed slice of the file would skip it
+                if evtx_slice not in acknowledged or evtx_slice.sha256 in failed_files:
+                    if evtx_slice.sha256 not in failed_files:
+                        failed_files.add(evtx_slice.sha256)
+                        outcome.errors.append("Ingestion of {} failed".format(evtx_slice.path.name))
+                    continue
+
+                outcome.records += evtx_slice.forwarded
+                outcome.bytes += evtx_slice.size
+                if evtx_slice.checkpoint:
+                    self.state_store.set_checkpoint(evtx_slice.sha256, self.index, evtx_slice.chunks[-1].index,
+                                                    evtx_slice.chunks[-1].last_record_id)
+
+        succeeded = [entry for entry in unit.entries if self._outcomes[entry].success]
+        unit.ingested_hashes = [sha256 for sha256, owner, _ in new_members if owner in succeeded]
+
+        # Filtered files are not fully ingested, they can't be skipped by the next imports
+        if not self.event_filter.is_active:
+            self.state_store.add_ingested_members(self.case_id, self.index,
+                                                  [(sha256, evtx_path.name, owner.sha256, owner.name)
+                                                   for sha256, owner, evtx_path in new_members
+                                                   if owner in succeeded])
+
+        # Spooled files are no longer rejected once flushed again, the others once sent
+        if self._rejected_members and not self._use_spool:
+            self.state_store.clear_rejected_spooled(self.case_id, self.index,
+                                                    [sha256 for sha256, owner, _ in new_members
+                                                     if owner in succeeded and sha256 in self._rejected_members])
+
+        # Every record up to the mark went through the filter, the next updates with the same one skip them
+        for sha256, owner, evtx_path in new_members:
+            if owner in succeeded and sha256 in watermarks:
+                (host, channel), newest, is_reset = watermarks[sha256]
+                self.state_store.set_watermark(self.case_id, self.index, host, channel, newest.last_record_id,
+                                               get_chunk_times(evtx_path, newest)[1], replace=is_reset,
+                                               scope=self.event_filter.scope)
+
+        return succeeded
+
+    def _split_rounds(self, slices: list, slice_chunks: int):
+        """
+        Group the slices sent in the same engine call. A round holds enough bytes to keep every ingestor busy
+        with the slices of large files, and as many small files as fit in it
+        :param slices: List of EVTXSlice, in the order they are sent
+        :param slice_chunks: Number of chunks of the slices of large files
+        :return: List of lists of EVTXSlice
+        """
+        round_budget = max(ROUND_MIN_BYTES, self._ingestors.current * slice_chunks * CHUNK_SIZE)
+
+        rounds = []
+        round_bytes = 0
+        for evtx_slice in slices:
+            if not rounds or round_bytes + evtx_slice.size > round_budget:
+                rounds.append([])
+                round_bytes = 0
+
+            rounds[-1].append(evtx_slice)
+            round_bytes += evtx_slice.size
+
+        return rounds
+
+    def _ingest_round(self, e2s, round_slices: list):
+        """
+        Send slices of EVTX files in one engine call
+        :param e2s: Configured engine
+        :param round_slices: List of EVTXSlice
+        :return: List of the EVTXSlice acknowledged by the engine
+        """
+        self._rounds_count += 1
+        round_dir = self.scratch.path / "rounds" / str(self._rounds_count)
+        round_files = {}
+
+        try:
+            for slice_index, evtx_slice in enumerate(round_slices):
+                # Slices keep the name of their file, as it is the source of the events. The engines send them in
+                # the order of their directories
+                slice_path = round_dir / "{:06d}".format(slice_index) / evtx_slice.path.name
+                slice_path.parent.mkdir(parents=True, exist_ok=True)
+
+                if evtx_slice.whole:
+                    # Linked rather than moved, the file may be needed again if the round fails
+                    try:
+                        os.link(evtx_slice.path, slice_path)
+                    except OSError:
+                        shutil.copyfile(evtx_slice.path, slice_path)
+                else:
+                    write_chunks(evtx_slice.path, evtx_slice.chunks, slice_path)
+
+                round_files[slice_path] = evtx_slice
+
+            if self._use_record_engine:
+                e2s.slices = round_files
+
+            is_ingested = e2s.ingest(input_files=round_dir, keep_cache=False, use_cache=False) is not False
+            if not self._use_record_engine:
+                return round_slices if is_ingested else []
+
+            # Only the record engine knows the events left after the filter
+            for slice_path, events in e2s.sent.items():
+                round_files[slice_path].events = events
+            if is_ingested:
+                return round_slices
+            return [round_files[slice_path] for slice_path in e2s.acknowledged]
+
+        finally:
+            shutil.rmtree(round_dir, ignore_errors=True)
+
+    def _get_log_identity(self, evtx_path: Path, first_chunk):
+        """
+        Host and channel of a log, the keys of its watermark. They are read from its first record, the host set
+        in the pipeline arguments prevails. The channel is guessed from the file name when the records can't be
+        decoded
+        :param evtx_path: Path of the EVTX file
+        :param first_chunk: ChunkInfo of the first chunk of the file
+        :return: (host, channel), or None if the host is unknown
+        """
+        computer, channel = read_log_identity(evtx_path, first_chunk) or (None, None)
+        host = self._hostname or computer
+        if not host:
             return None
 
-    def inner_import_files(self, import_list: list, files_type):
+        # ORC and the event log service escape the / of the channels as %4
+        return host, channel or evtx_path.stem.replace("%4", "/")
+
+    def _skip_ingested_chunks(self, evtx_path: Path, identity: tuple, chunks: list):
         """
-        Method to be called as an entry point to create imports KBHs
-        :param files_type:
-        :param import_list:
-        :return: True if imported, false if not + list of errors
+        Drop the chunks of a log ingested by a previous import of the case, from the record ids of their headers
+        :param evtx_path: Path of the EVTX file
+        :param identity: (host, channel) of the log
+        :param chunks: ChunkInfo of the file
+        :return: (chunks left, id of the last record already ingested or None, True if the record ids were reset)
         """
+        host, channel = identity
+        if identity in self._rejected_logs:
+            self.log.warning("Events of {} on {} were rejected by Splunk, {} is ingested whole".format(
+                channel, host, evtx_path.name))
+            return chunks, None, False
 
-        self.log.info("New imports for {} on behalf of {}".format(self.case_name, self.user))
-        self.log.info("{} files of type {} to import into {}".format(len(import_list), files_type, self.index))
+        # The records sent by an import of the whole log were sent whatever the filter
+        watermark = self.state_store.get_watermark(self.case_id, self.index, host, channel,
+                                                   scopes=("", self.event_filter.scope))
+        if not watermark:
+            return chunks, None, False
 
-        self.log.info("Starting processing of files")
+        record_id, written_time = watermark
 
-        in_path = import_list[0].parent
-        # Temporary files are placed in the same directory, not in tmp as there is a
-        # a risk over overloading tmp dir depending on the partitioning
-        out_path = in_path.parent / "out"
+        # The record ids start again from 1 when a log is cleared. The records around the mark are then newer
+        # than it, and are not covered by it
+        if written_time is not None:
+            is_reset = False
+            spanning = [chunk for chunk in chunks if chunk.first_record_id <= record_id <= chunk.last_record_id]
+            newest = max(chunks, key=lambda chunk: chunk.last_record_id)
+            if spanning:
+                first_time, _ = get_chunk_times(evtx_path, spanning[0])
+                is_reset = first_time is not None and first_time > written_time
+            elif newest.last_record_id < record_id:
+                _, last_time = get_chunk_times(evtx_path, newest)
+                is_reset = last_time is not None and last_time > written_time
 
-        if files_type == "archive":
-            for archive in import_list:
-                zippath = Path(out_path) / archive.name.replace(archive.suffix, '')
-                zippath.mkdir(parents=True)
-                decompress_7z(archive, zippath)
+            if is_reset:
+                self.log.warning("The record ids of {} ({} on {}) were reset since the previous import, it is "
+                                 "ingested whole".format(evtx_path.name, channel, host))
+                return chunks, None, True
 
-            in_path_evtx = out_path
-        elif files_type == "evtx":
-            in_path_evtx = in_path
-        else:
-            self.log.error("Unexpected file type, aborting...")
-            return self._ret_task_failure()
+        new_chunks = [chunk for chunk in chunks if chunk.last_record_id > record_id]
+        if not new_chunks:
+            self.log.info("{} has no records after record {} of {} on {}, ingested by a previous import".format(
+                evtx_path.name, record_id, channel, host))
+            return [], record_id, False
 
-        start_time = time.time()
+        self.log.info("{}: {} chunks ingested by a previous import skipped, sending the records after {}".format(
+            evtx_path.name, len(chunks) - len(new_chunks), record_id))
+        if not self._use_record_engine and any(chunk.first_record_id <= record_id for chunk in new_chunks):
+            self.log.info("{}: the records of the first chunk up to {} are sent again by Evtx2Splunk".format(
+                evtx_path.name, record_id))
 
-        e2s = Evtx2Splunk()
+        return new_chunks, record_id, False
 
-        # We could just pass on self.configuration, but we prefer to format the dict in such way that
-        # field names in evtx2splunk will not depend on IrisEVTXModule
-        proxies = {
+    def _load_rejected(self):
+        """
+        Report the files of the case whose spooled events were rejected by Splunk after their import ended. They
+        are not skipped as already ingested anymore, until they are imported again
+        """
+        for sha256, source_sha256, source_name, host, channel, error in self.state_store.get_rejected_spooled(
+                self.case_id, self.index):
+            if source_sha256 not in self._rejected_sources:
+                self.log.error("{}: events of a previous import were rejected by Splunk ({}). Upload it again to "
+                               "send them".format(source_name, error))
+            self._rejected_sources[source_sha256] = source_name
+            self._rejected_members.add(sha256)
+            if host and channel:
+                self._rejected_logs.add((host, channel))
+
+    def _record_spooled(self, segments: list):
+        """
+        Record the files of the round being ingested as the content of spool segments, before they are forwarded
+        :param segments: Names of the segments flushed by the round
+        """
+        files = {}
+        for evtx_slice in self._record_engine.slices.values():
+            host, channel = self._log_identities.get(evtx_slice.sha256, (None, None))
+            files[evtx_slice.sha256] = (evtx_slice.sha256, evtx_slice.owner.sha256, evtx_slice.owner.name, host,
+                                        channel)
+
+        self.state_store.add_spooled_files(segments, self.case_id, self.index, list(files.values()))
+
+    def _check_cancelled(self):
+        """
+        Check if the import was asked to stop. Once it is, the stages drop the files they receive
+        :return: bool
+        """
+        if not self._is_cancelled and self.cancellation.is_requested():
+            self.log.warning("Stopping the import, the files fully ingested are registered")
+            self._is_cancelled = True
+            self._has_failures = True
+
+        return self._is_cancelled
+
+    def _cancel_entry(self, entry, is_accepted: bool = False):
+        """
+        Account an uploaded file dropped by the cancellation of the import
+        :param entry: ManifestEntry of the file
+        :param is_accepted: The file was accepted for ingestion, and is done once its unit ends
+        """
+        outcome = self._outcomes.get(entry)
+        if outcome is None:
+            outcome = FileOutcome(entry, "evtx" if entry.suffix in EVTX_SUFFIXES else "archive")
+            self._outcomes[entry] = outcome
+        if "Import cancelled" not in outcome.errors:
+            outcome.errors.append("Import cancelled")
+
+        if not is_accepted:
+            self.progress.file_done(entry)
+
+    def _merge_evtx_units(self, units: list, batch_index: int):
+        """
+        Gather EVTX files in a directory of their own, so they can be ingested in one call
+        :param units: EVTX ImportUnit
+        :param batch_index: Index of the batch, used to name the directory
+        :return: ImportUnit
+        """
+        batch_dir = self.scratch.path / "batches" / str(batch_index)
+        batch_dir.mkdir(parents=True, exist_ok=True)
+
+        entries = []
+        for unit in units:
+            for entry in unit.entries:
+                target = batch_dir / entry.name
+                shutil.move(str(entry.path), str(target))
+                entry.path = target
+                entries.append(entry)
+
+        return ImportUnit("evtx", entries, input_path=batch_dir, work_dir=batch_dir)
+
+    def _release_unit(self, unit):
+        """
+        Remove the scratch data of a unit and release its reserved space
+        :param unit: ImportUnit
+        """
+        if unit.work_dir:
+            shutil.rmtree(unit.work_dir, ignore_errors=True)
+        if unit.reserved:
+            self.scratch.release(unit.reserved)
+            unit.reserved = 0
+
+    def _stage_register(self, in_queue):
+        """
+        Register the ingested files as evidences, by batches
+        :param in_queue: Successfully ingested ImportUnit
+        """
+        while True:
+            first = self._pipeline.get(in_queue)
+            if first is STOP:
+                return
+
+            units = self._pipeline.drain(in_queue, first, REGISTER_BATCH_MAX_UNITS)
+
+            # The hashes were computed while listing the files, no need to read them again
+            entries = [entry for unit in units for entry in unit.entries]
+            with self.metrics.timed("register"):
+                self.evidence_registry.register(entries)
+            for entry in entries:
+                self._outcomes[entry].registered = True
+
+            # Registered files are deduplicated from now on, their checkpoints are not needed anymore
+            self.state_store.clear_checkpoints([sha256 for unit in units for sha256 in unit.ingested_hashes],
+                                               self.index)
+
+    def _get_proxies(self):
+        return {
             "http": self.configuration.get('splunk_http_proxy'),
             "https": self.configuration.get('splunk_https_proxy')
         }
-        e2s_config = {
-            "evtxdump_config_file": self.configuration.get("evtxdump_config_file"),
-            "splunk_url": self.configuration.get("evtx_splunk_url"),
-            "splunk_user": self.configuration.get("evtx_splunk_user"),
-            "splunk_pass": self.configuration.get("evtx_splunk_pass"),
-            "splunk_hec_name": self.configuration.get("evtx_splunk_hecname"),
-            "splunk_mport": self.configuration.get("evtx_splunk_mport"),
-            "splunk_ssl": self.configuration.get("evtx_splunk_use_ssl"),
-            "splunk_ssl_verify": self.configuration.get("evtx_splunk_verify_ssl"),
-        }
-        if e2s.configure(config=e2s_config,
-                         index=self.index,
-                         nb_ingestors=cpu_count(),
-                         testing=False,
-                         no_resolve=True,
-                         proxies=proxies
-                         ):
-            ret_t = e2s.ingest(input_files=in_path_evtx, keep_cache=False, use_cache=False)
-        else:
-            ret_t = False
 
-        end_time = time.time()
+    def _needs_record_engine(self):
+        """
+        The records are decoded and sent by the module when its engine is selected in the configuration, as its
+        HEC transport can be tuned, or when the events are spooled. Channels and EventIDs filters, and the records
+        of the chunks at the bounds of the time range, also need it. Without the evtx package, only the time range
+        is applied, to chunks. The other filters are refused beforehand
+        :return: bool
+        """
+        engine = str(self.configuration.get("evtx_ingest_engine") or "evtx2splunk").strip().lower()
+        sink = str(self.configuration.get("evtx_hec_sink") or "direct").strip().lower()
+        if engine != "module" and sink != "spool" and not self.event_filter.is_active:
+            return False
 
-        self.log.info("Finished in {time}".format(time=end_time - start_time))
+        if not is_record_engine_available():
+            if sink == "spool":
+                self.log.warning("The evtx package is not installed, the events are sent by Evtx2Splunk rather "
+                                 "than spooled")
+            elif not self.event_filter.is_active:
+                self.log.warning("The evtx package is not installed, using Evtx2Splunk")
+            else:
+                self.log.warning("The evtx package is not installed, the time range is applied to whole chunks")
+            return False
 
-        if ret_t is False:
-            return self._ret_task_failure()
+        self._use_spool = sink == "spool"
+        return True
+
+    def _get_record_engine(self):
+        """
+        Get the engine decoding and filtering the records, connected once for the import. When the events are
+        spooled, Splunk is only reached by the forwarder
+        :return: RecordEngine, or None if Splunk can't be reached
+        """
+        if self._record_engine is None:
+            client = SplunkClient(self.configuration, self.index, proxies=self._get_proxies(), log=self.log)
+            try:
+                if self._use_spool:
+                    client.transport = self._get_spool_writer()
+                else:
+                    client.connect()
+            except (SplunkError, OSError) as e:
+                self.log.error(str(e))
+                client.close()
+                return None
 
-        # Clean the temporary folder
-        if files_type == "archive":
-            shutil.rmtree(out_path, ignore_errors=True)
+            self._record_engine = RecordEngine(client, event_filter=self.event_filter, hostname=self._hostname,
+                                               record_cache=self._get_record_cache(),
+                                               chunk_parser=self._get_chunk_parser(), log=self.log)
 
-        for file in import_list:
-            # Compute SHA256 of file
-            sha256_hash = hashlib.sha256()
+        return self._record_engine
 
-            # Get file size
-            fsize = os.path.getsize(file)
+    def _get_spool_dir(self):
+        return Path(self.configuration.get("evtx_spool_dir") or self.scratch.base_dir / SPOOL_DIR_NAME)
 
-            with open(file, "rb") as f:
-                # Read and update hash string value in blocks of 4K
-                for byte_block in iter(lambda: f.read(4096), b""):
-                    sha256_hash.update(byte_block)
-                fhash = sha256_hash.hexdigest()
+    def _get_spool_writer(self):
+        """
+        Spool the events are written to, forwarded to the HEC in the background of the worker
+        :return: SpoolWriter
+        """
+        segment_size = self._get_int_configuration("evtx_spool_segment_size", DEFAULT_SEGMENT_SIZE // 1024 // 1024)
+        max_size = self._get_int_configuration("evtx_spool_max_size", 0)
+        spool_dir = self._get_spool_dir()
+        self.log.info("Spooling the events to {}".format(spool_dir))
 
-                file_registered = self.evidence_storage.is_evidence_registered(sha256=fhash, case_id=self.case_id)
+        # Segments left by previous imports are forwarded meanwhile. The files of the segments are recorded, to
+        # report those rejected by Splunk once the import ended
+        spool_writer = SpoolWriter(spool_dir, self.index,
+                                   segment_size=max(1, segment_size) * 1024 * 1024,
+                                   max_size=max(0, max_size) * 1024 * 1024,
+                                   on_flush=self._record_spooled,
+                                   log=self.log)
+        spool_forwarder.start(spool_dir, self.configuration, proxies=self._get_proxies(), log=self.log)
 
-                if not file_registered:
-                    self.evidence_storage.add_evidence(
-                        filename=file.name,
-                        sha256=fhash,
-                        date_added=datetime.now(),
-                        case_id=self.case_id,
-                        user_id=self.user_id,
-                        size=fsize,
-                        description="[Auto] EVTX file named {}".format(file.name)
-                    )
+        return spool_writer
 
-        return self._ret_task_success()
+    def _get_chunk_parser(self):
+        """
+        Parser decoding the chunks of the files on a pool of processes, sized from the configuration. 0 shares
+        the available cores between the imports running on the host. Daemonic workers, such as the Celery prefork
+        ones, can't start the pool, the evtx package decodes the files on its threads instead
+        :return: ChunkParser, or None to decode the records in the worker itself
+        """
+        if is_daemon_process():
+            return None
+
+        workers = self._get_int_configuration("evtx_parse_workers", 0)
+        if workers <= 0:
+            workers = get_auto_ingestors(concurrent_imports=self.scratch.count_live_imports())
+        if workers == 1:
+            return None
+
+        self.log.info("Decoding the chunks on {} processes".format(workers))
+        return ChunkParser(workers, log=self.log)
+
+    def _get_record_cache(self):
+        """
+        Cache of the decoded records, shared by the imports of the worker. The re-imports of a file, to another
+        index or after a failure, read its records from it rather than decoding them again
+        :return: RecordCache, or None if disabled in the configuration
+        """
+        max_size = self._get_int_configuration("evtx_record_cache_size", 4096)
+        if max_size <= 0:
+            return None
+
+        cache_dir = self.configuration.get("evtx_record_cache_dir") or self.scratch.base_dir / RECORD_CACHE_DIR_NAME
+        try:
+            return RecordCache(cache_dir, max_size * 1024 * 1024, log=self.log)
+        except OSError as e:
+            self.log.warning("Unable to use the record cache in {}: {}".format(cache_dir, e))
+            return None
+
+    def _close_record_engine(self):
+        transport = self._record_engine.client.transport
+        if self._use_spool:
+            self.log.info("{} events spooled in {} segments, {} bytes written for {} bytes of events. They are "
+                          "forwarded to the HEC in the background".format(transport.events, transport.batches,
+                                                                          transport.sent_bytes, transport.raw_bytes))
+            spool_forwarder.start(self._get_spool_dir(), self.configuration, proxies=self._get_proxies(),
+                                  log=self.log)
+        else:
+            self.log.info("{} events sent to the HEC in {} batches, {} bytes sent for {} bytes of events".format(
+                transport.events, transport.batches, transport.sent_bytes, transport.raw_bytes))
+        record_cache = self._record_engine.record_cache
+        if record_cache:
+            self.log.info("{} files read from the record cache, {} decoded".format(record_cache.hits,
+                                                                                 record_cache.misses))
+        self._record_engine.close()
+
+    def _configure_engine(self, nb_ingestors: int):
+        """
+        Get a configured ingestion engine. Evtx2Splunk engines are cached by the worker and reused between
+        the imports as long as the module configuration does not change. Filtered imports use the record engine
+        :param nb_ingestors: Number of ingestors of the engine
+        :return: CachedEngine or RecordEngine, or None if the configuration failed
+        """
+        if self._use_record_engine:
+            return self._get_record_engine()
+
+        # We could just pass on self.configuration, but we prefer to format the dict in such way that
+        # field names in evtx2splunk will not depend on IrisEVTXModule
+        proxies = self._get_proxies()
+        e2s_config = {
+            "evtxdump_config_file": self.configuration.get("evtxdump_config_file"),
+            "splunk_url": self.configuration.get("evtx_splunk_url"),
+            "splunk_user": self.configuration.get("evtx_splunk_user"),
+            "splunk_pass": self.configuration.get("evtx_splunk_pass"),
+            "splunk_hec_name": self.configuration.get("evtx_splunk_hecname"),
+            "splunk_mport": self.configuration.get("evtx_splunk_mport"),
+            "splunk_ssl": self.configuration.get("evtx_splunk_use_ssl"),
+            "splunk_ssl_verify": self.configuration.get("evtx_splunk_verify_ssl"),
+        }
+        return engine_cache.get(e2s_config=e2s_config,
+                                index=self.index,
+                                nb_ingestors=nb_ingestors,
+                                proxies=proxies,
+                                log=self.log)
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import logging as logger
+import queue
+import threading
+import traceback
+from collections import deque
+from pathlib import Path
+
+from iris_evtx.EVTXChunks import CHUNK_SIZE
+
+
+# CONTENT ------------------------------------------------
+# Sent by a stage to the next one once it has no more items to produce
+STOP = object()
+
+
+class ImportUnit(object):
+    """
+    Set of uploaded files ingested together. An EVTX unit holds one or several uploaded EVTX files,
+    an archive unit holds one uploaded archive and the directory it was extracted to
+    """
+
+    def __init__(self, files_type: str, entries: list, input_path: Path = None, reserved: int = 0,
+                 work_dir: Path = None):
+        """
+        :param files_type: evtx or archive
+        :param entries: ManifestEntry of the uploaded files covered by the unit
+        :param input_path: Path given to the ingestion engine
+        :param reserved: Scratch space reserved for the unit, released once ingested
+        :param work_dir: Directory of the unit in the scratch space, removed once ingested
+        """
+        self.files_type = files_type
+        self.entries = entries
+        self.input_path = input_path
+        self.reserved = reserved
+        self.work_dir = work_dir
+        # SHA256 of the EVTX files actually ingested, the uploaded ones or the ones extracted from archives
+        self.ingested_hashes = []
+        # SHA256 of the EVTX files extracted from an archive, by path, computed by the extraction
+        self.members_hashes = {}
+
+    @property
+    def size(self):
+        return sum(entry.size for entry in self.entries)
+
+    def __repr__(self):
+        return "ImportUnit({}, {} files)".format(self.files_type, len(self.entries))
+
+
+class EVTXSlice(object):
+    """
+    Part of an EVTX file sent to the engine in one call: a few of its chunks, or the whole file
+    """
+
+    def __init__(self, path: Path, sha256: str, owner, chunks: list = None, whole: bool = False,
+                 min_record_id: int = None, checkpoint: bool = False):
+        """
+        :param path: Path of the EVTX file
+        :param sha256: SHA256 of the EVTX file
+        :param owner: ManifestEntry of the uploaded file the EVTX file comes from
+        :param chunks: ChunkInfo of the slice, None if the file could not be parsed
+        :param whole: True if the slice is the whole file
+        :param min_record_id: Records up to this id were ingested by a previous import and are not sent again,
+                              when the engine decodes the records
+        :param checkpoint: True if the last chunk of the slice is checkpointed once acknowledged
+        """
+        self.path = path
+        self.sha256 = sha256
+        self.owner = owner
+        self.chunks = chunks
+        self.whole = whole
+        self.min_record_id = min_record_id
+        self.checkpoint = checkpoint
+        # Number of events sent by the engine, when it counts them
+        self.events = None
+
+    @property
+    def records(self):
+        """
+        Number of records of the slice, from the chunk headers
+        """
+        if not self.chunks:
+            return 0
+        return sum(chunk.last_record_id - chunk.first_record_id + 1 for chunk in self.chunks)
+
+    @property
+    def forwarded(self):
+        """
+        Number of events of the slice forwarded to Splunk. Without the count of the engine, every record is
+        """
+        return self.records if self.events is None else self.events
+
+    @property
+    def size(self):
+        if self.whole:
+            return self.path.stat().st_size
+        return len(self.chunks) * CHUNK_SIZE
+
+
+class FileOutcome(object):
+    """
+    Outcome of the import of an uploaded file
+    """
+
+    def __init__(self, entry, files_type: str):
+        self.name = entry.name
+        self.sha256 = entry.sha256
+        self.size = entry.size
+        self.files_type = files_type
+        self.records = 0
+        self.bytes = 0
+        self.errors = []
+        self.registered = False
+
+    @property
+    def success(self):
+        return not self.errors
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "sha256": self.sha256,
+            "size": self.size,
+            "type": self.files_type,
+            "records": self.records,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "registered": self.registered
+        }
+
+
+def merge_outcomes_summaries(summaries: list):
+    """
+    Merge the outcomes summaries of several imports, such as the shards of an upload
+    :param summaries: List of summaries, as returned in the data of the imports status
+    :return: dict
+    """
+    merged = {"files": [], "succeeded": 0, "failed": 0, "rejected": [], "shards_metrics": []}
+    for summary in summaries:
+        if not isinstance(summary, dict):
+            continue
+        merged["files"].extend(summary.get("files", []))
+        merged["succeeded"] += summary.get("succeeded", 0)
+        merged["failed"] += summary.get("failed", 0)
+        merged["rejected"] = sorted(set(merged["rejected"]) | set(summary.get("rejected", [])))
+        # The shards run concurrently on different workers, their metrics are kept apart
+        if summary.get("metrics"):
+            merged["shards_metrics"].append(summary["metrics"])
+
+    return merged
+
+
+def imap_bounded(executor, fn, iterable, max_in_flight: int):
+    """
+    Like executor.map, but only submits a new item once less than max_in_flight are pending,
+    so a slow consumer holds back the producer. Results are yielded in order
+    :param executor: concurrent.futures executor
+    :param fn: Function applied to every item
+    :param iterable: Items
+    :param max_in_flight: Maximum items submitted and not yet consumed
+    :return: Generator of results
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+class Pipeline(object):
+    """
+    Runs stages in threads, connected by bounded queues. A full queue blocks the stage feeding it,
+    which bounds the memory and scratch space used by the items in flight.
+
+    A stage is a function consuming its input queue with get / iter_queue until every producer has stopped.
+    STOP is forwarded to its output queues when it returns. If a stage raises, the pipeline is marked as
+    failed and the rest of its input is consumed and dropped, so the stages upstream are never blocked.
+    """
+
+    def __init__(self, queue_size: int = 8, log=logger):
+        self.queue_size = max(1, queue_size)
+        self.log = log
+        self.failed = False
+        self._threads = []
+        # Number of producers which have not sent STOP yet, per queue
+        self._producers = {}
+
+    def create_queue(self, producers: int = 1):
+        """
+        Create a bounded queue
+        :param producers: Number of stages feeding the queue
+        :return: Queue
+        """
+        in_queue = queue.Queue(maxsize=self.queue_size)
+        self._producers[in_queue] = producers
+        return in_queue
+
+    def get(self, in_queue: queue.Queue, block: bool = True):
+        """
+        Get the next item of a queue
+        :param in_queue: Queue
+        :param block: Wait for an item if the queue is empty
+        :return: The item, STOP once every producer has stopped, or None if not blocking and the queue is empty
+        """
+        while self._producers[in_queue]:
+            try:
+                item = in_queue.get(block=block)
+            except queue.Empty:
+                return None
+
+            if item is not STOP:
+                return item
+
+            self._producers[in_queue] -= 1
+
+        return STOP
+
+    def iter_queue(self, in_queue: queue.Queue):
+        """
+        Iterate over the items of a queue until every producer has stopped
+        :param in_queue: Queue
+        :return: Generator of items
+        """
+        while True:
+            item = self.get(in_queue)
+            if item is STOP:
+                return
+
+            yield item
+
+    def drain(self, in_queue: queue.Queue, first, max_items: int):
+        """
+        Collect the item already received and whatever else is waiting in the queue, up to max_items,
+        without blocking. Used by stages working on batches
+        :param in_queue: Queue to drain
+        :param first: Item already received
+        :param max_items: Maximum size of the batch
+        :return: List of items
+        """
+        items = [first]
+        while len(items) < max_items:
+            item = self.get(in_queue, block=False)
+            if item is None or item is STOP:
+                break
+
+            items.append(item)
+
+        return items
+
+    def add_stage(self, name: str, target, in_queue: queue.Queue = None, out_queues=None):
+        """
+        Start a stage
+        :param name: Name of the stage, used for the thread and logs
+        :param target: Function running the stage
+        :param in_queue: Queue consumed by the stage, if any
+        :param out_queues: Queues fed by the stage
+        """
+        out_queues = out_queues or []
+
+        def run():
+            try:
+                target()
+
+            except Exception as e:
+                self.failed = True
+                self.log.error("Stage {} failed: {}".format(name, e))
+                self.log.debug(traceback.format_exc())
+
+                if in_queue is not None:
+                    for _ in self.iter_queue(in_queue):
+                        pass
+
+            finally:
+                for out_queue in out_queues:
+                    out_queue.put(STOP)
+
+        thread = threading.Thread(target=run, name="evtx_{}".format(name), daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def join(self):
+        """
+        Wait for every stage to end
+        :return: True if no stage failed
+        """
+        for thread in self._threads:
+            thread.join()
+
+        return not self.failed
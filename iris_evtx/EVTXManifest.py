@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import hashlib
+import mmap
+from pathlib import Path
+
+
+# CONTENT ------------------------------------------------
+# Files are hashed through a memory map, fed to hashlib by slices of this size.
+# Large slices let hashlib release the GIL for most of the work
+HASH_SLICE_SIZE = 8 * 1024 * 1024
+
+
+def hash_file(path: Path) -> str:
+    """
+    Compute the SHA256 of a file in a single pass
+    :param path: Path of the file to hash
+    :return: Hex digest of the file
+    """
+    sha256_hash = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            return sha256_hash.hexdigest()
+
+        with mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(view), HASH_SLICE_SIZE):
+                    sha256_hash.update(view[offset:offset + HASH_SLICE_SIZE])
+            finally:
+                view.release()
+
+    return sha256_hash.hexdigest()
+
+
+class ManifestEntry(object):
+    """
+    Describes an uploaded file. The entry is built once when the upload is listed
+    and carried through every stage of the import, so the file is only read once for hashing
+    """
+
+    def __init__(self, path: Path, size: int, sha256: str, mtime: float):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.mtime = mtime
+
+    @property
+    def name(self):
+        return self.path.name
+
+    @property
+    def suffix(self):
+        return self.path.suffix
+
+    @classmethod
+    def from_path(cls, path: Path):
+        """
+        Build the manifest entry of a file, hashing it
+        :param path: Path of the file
+        :return: ManifestEntry
+        """
+        stat = path.stat()
+        return cls(path=path, size=stat.st_size, sha256=hash_file(path), mtime=stat.st_mtime)
+
+    def __repr__(self):
+        return "ManifestEntry({}, size={}, sha256={})".format(self.path, self.size, self.sha256)
+
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import json
+import logging as logger
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# CONTENT ------------------------------------------------
+METRICS_PREFIX = "iris_evtx"
+QUEUE_SAMPLING_INTERVAL = 0.5
+
+
+class StageMetrics(object):
+    """
+    Counters of a stage of the import
+    """
+
+    def __init__(self):
+        self.started = None
+        self.ended = None
+        self.busy = 0.0
+        self.calls = 0
+        self.bytes = 0
+        self.records = 0
+
+    @property
+    def wall_time(self):
+        if self.started is None:
+            return 0.0
+        return (self.ended or time.time()) - self.started
+
+    def to_dict(self):
+        # Throughputs are computed on the time the stage was actually working
+        busy = self.busy or self.wall_time
+        return {
+            "wall_time": round(self.wall_time, 3),
+            "busy_time": round(self.busy, 3),
+            "calls": self.calls,
+            "bytes": self.bytes,
+            "records": self.records,
+            "bytes_per_second": round(self.bytes / busy, 1) if busy else 0,
+            "records_per_second": round(self.records / busy, 1) if busy else 0
+        }
+
+
+class ImportMetrics(object):
+    """
+    Collects the timings and throughputs of an import: per stage wall and busy times, bytes and records,
+    depth of the queues between the stages and duration per file.
+    Thread safe, the stages of the pipeline report concurrently
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.ended = None
+        self.stages = {}
+        self.files = {}
+        self.queues = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+
+    def _get_stage(self, name: str):
+        if name not in self.stages:
+            self.stages[name] = StageMetrics()
+        return self.stages[name]
+
+    def stage_started(self, name: str):
+        with self._lock:
+            stage = self._get_stage(name)
+            if stage.started is None:
+                stage.started = time.time()
+
+    def stage_ended(self, name: str):
+        with self._lock:
+            self._get_stage(name).ended = time.time()
+
+    @contextmanager
+    def timed(self, name: str):
+        """
+        Account the time spent in a block as busy time of a stage
+        :param name: Name of the stage
+        """
+        self.stage_started(name)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, duration=time.time() - start)
+
+    def add(self, name: str, duration: float = 0, nbytes: int = 0, records: int = 0):
+        """
+        Account work done by a stage
+        :param name: Name of the stage
+        :param duration: Busy seconds
+        :param nbytes: Bytes processed
+        :param records: Records processed
+        """
+        with self._lock:
+            stage = self._get_stage(name)
+            if stage.started is None:
+                stage.started = time.time() - duration
+            stage.busy += duration
+            stage.calls += 1 if duration else 0
+            stage.bytes += nbytes
+            stage.records += records
+
+    def add_file_time(self, name: str, stage: str, duration: float):
+        """
+        Account time spent on a file by a stage
+        :param name: Name of the file
+        :param stage: Name of the stage
+        :param duration: Seconds
+        """
+        with self._lock:
+            file_times = self.files.setdefault(name, {})
+            file_times[stage] = file_times.get(stage, 0.0) + duration
+
+    def watch_queues(self, queues: dict):
+        """
+        Sample the depth of queues in the background until stop is called
+        :param queues: Queues by name
+        """
+        def sample():
+            while not self._stop_sampling.wait(QUEUE_SAMPLING_INTERVAL):
+                with self._lock:
+                    for name, watched in queues.items():
+                        depth = watched.qsize()
+                        stats = self.queues.setdefault(name, {"max": 0, "total": 0, "samples": 0})
+                        stats["max"] = max(stats["max"], depth)
+                        stats["total"] += depth
+                        stats["samples"] += 1
+
+        self._sampler = threading.Thread(target=sample, name="evtx_metrics", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self.ended = time.time()
+        self._stop_sampling.set()
+        if self._sampler:
+            self._sampler.join()
+
+    def summary(self):
+        """
+        Machine readable summary of the import
+        :return: dict
+        """
+        with self._lock:
+            return {
+                "wall_time": round((self.ended or time.time()) - self.started, 3),
+                "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+                "queues": {name: {"max": stats["max"],
+                                  "mean": round(stats["total"] / stats["samples"], 2) if stats["samples"] else 0}
+                           for name, stats in self.queues.items()},
+                "files": {name: {stage: round(duration, 3) for stage, duration in times.items()}
+                          for name, times in self.files.items()}
+            }
+
+
+def _iter_gauges(summary: dict):
+    """
+    Flatten a summary as (name, labels, value) gauges
+    """
+    yield "import_wall_seconds", {}, summary["wall_time"]
+    for stage, metrics in summary["stages"].items():
+        for key in ["wall_time", "busy_time", "bytes", "records", "bytes_per_second", "records_per_second"]:
+            yield "stage_{}".format(key), {"stage": stage}, metrics[key]
+    for queue_name, stats in summary["queues"].items():
+        yield "queue_depth_max", {"queue": queue_name}, stats["max"]
+        yield "queue_depth_mean", {"queue": queue_name}, stats["mean"]
+
+
+def write_prometheus_textfile(summary: dict, path: Path, labels: dict = None):
+    """
+    Write the summary in the Prometheus textfile collector format. The file is replaced atomically
+    :param summary: Summary of ImportMetrics
+    :param path: Path of the .prom file
+    :param labels: Labels added to every metric
+    """
+    labels = labels or {}
+    lines = []
+    for name, gauge_labels, value in _iter_gauges(summary):
+        all_labels = dict(labels, **gauge_labels)
+        labels_str = ",".join('{}="{}"'.format(key, str(label).replace('"', '\\"'))
+                              for key, label in sorted(all_labels.items()))
+        lines.append("{}_{}{{{}}} {}".format(METRICS_PREFIX, name, labels_str, value))
+
+    path = Path(path)
+    tmp_path = path.with_name(".{}.tmp".format(path.name))
+    tmp_path.write_text("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+def send_statsd(summary: dict, address: str, log=logger):
+    """
+    Send the summary as StatsD gauges over UDP
+    :param summary: Summary of ImportMetrics
+    :param address: host:port of the StatsD server
+    :param log: Logger
+    """
+    try:
+        host, port = address.rsplit(":", 1)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for name, gauge_labels, value in _iter_gauges(summary):
+                metric = ".".join([METRICS_PREFIX, name] + [str(label) for label in gauge_labels.values()])
+                sock.sendto("{}:{}|g".format(metric, value).encode(), (host, int(port)))
+        finally:
+            sock.close()
+
+    except (OSError, ValueError) as e:
+        log.warning("Unable to send metrics to StatsD {}: {}".format(address, e))
+
+
+def export_metrics(summary: dict, configuration: dict, labels: dict = None, log=logger):
+    """
+    Emit the summary to the outputs enabled in the module configuration
+    :param summary: Summary of ImportMetrics
+    :param configuration: Module configuration
+    :param labels: Labels identifying the import
+    :param log: Logger
+    """
+    log.info("EVTX import metrics: {}".format(json.dumps(summary, sort_keys=True)))
+
+    textfile = configuration.get("evtx_metrics_textfile")
+    if textfile:
+        try:
+            write_prometheus_textfile(summary, Path(textfile), labels=labels)
+        except OSError as e:
+            log.warning("Unable to write metrics to {}: {}".format(textfile, e))
+
+    statsd = configuration.get("evtx_metrics_statsd")
+    if statsd:
+        send_statsd(summary, statsd, log=log)
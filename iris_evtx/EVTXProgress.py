@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import logging as logger
+import threading
+import time
+from pathlib import Path
+
+# The revoked tasks are known to the worker running the task with the solo and threads pools only
+try:
+    from celery.worker import state as worker_state
+except ImportError:
+    worker_state = None
+
+
+# CONTENT ------------------------------------------------
+CANCEL_DIR_NAME = "cancel"
+CASE_MARKER_PREFIX = "case_"
+# The progress reports are attached to their log record under this attribute. The log handler of the module
+# publishes the last one along with the logs, in the PROGRESS state of the task
+PROGRESS_RECORD_ATTRIBUTE = "evtx_progress"
+
+# Seconds between two checks of the cancellation markers
+CANCEL_CHECK_INTERVAL = 2.0
+
+
+class ImportProgress(object):
+    """
+    Progress of an import: uploaded files and bytes done, records ingested, and the ETA derived from the bytes
+    rate. Reported periodically to the logs, whose handler in the module publishes it to the Celery task state,
+    so IRIS shows it while the import runs
+    """
+
+    def __init__(self, interval: float = 30, log=logger):
+        """
+        :param interval: Seconds between two reports, 0 to disable them
+        :param log: Logger
+        """
+        self.interval = interval
+        self.log = log
+
+        self.files_total = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.records = 0
+        self._bytes_done = 0
+        # Bytes done of the files being ingested, by uploaded file
+        self._partial = {}
+        self._start_time = time.time()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set_totals(self, files_total: int, bytes_total: int):
+        with self._lock:
+            self.files_total = files_total
+            self.bytes_total = bytes_total
+
+    def file_done(self, entry):
+        """
+        Account an uploaded file as done, whatever its outcome
+        :param entry: ManifestEntry of the file
+        """
+        with self._lock:
+            self._partial.pop(entry, None)
+            self.files_done += 1
+            self._bytes_done += entry.size
+
+    def set_partial(self, entry, nbytes: int):
+        """
+        Account the part of an uploaded file already ingested
+        :param entry: ManifestEntry of the file
+        :param nbytes: Bytes of the file done
+        """
+        with self._lock:
+            self._partial[entry] = min(nbytes, entry.size)
+
+    def add_records(self, records: int):
+        with self._lock:
+            self.records += records
+
+    def snapshot(self) -> dict:
+        """
+        :return: Progress, as reported in the task state
+        """
+        with self._lock:
+            elapsed = max(time.time() - self._start_time, 1e-6)
+            bytes_done = self._bytes_done + sum(self._partial.values())
+            eta = None
+            if bytes_done and self.bytes_total:
+                eta = max(0.0, (self.bytes_total - bytes_done) * elapsed / bytes_done)
+
+            return {
+                "files_done": self.files_done,
+                "files_total": self.files_total,
+                "bytes_done": bytes_done,
+                "bytes_total": self.bytes_total,
+                "percent": round(100.0 * bytes_done / self.bytes_total, 1) if self.bytes_total else None,
+                "records": self.records,
+                "records_per_second": round(self.records / elapsed, 1),
+                "elapsed": round(elapsed, 1),
+                "eta": round(eta) if eta is not None else None
+            }
+
+    def report(self):
+        """
+        Publish the progress to the logs
+        """
+        progress = self.snapshot()
+        eta = progress["eta"]
+        self.log.info("Import progress: {}/{} files, {:.1f}/{:.1f} MB{}, {} records/s, ETA {}".format(
+            progress["files_done"], progress["files_total"], progress["bytes_done"] / 1024 / 1024,
+            progress["bytes_total"] / 1024 / 1024,
+            " ({}%)".format(progress["percent"]) if progress["percent"] is not None else "",
+            progress["records_per_second"],
+            time.strftime("%H:%M:%S", time.gmtime(eta)) if eta is not None else "unknown"),
+            extra={PROGRESS_RECORD_ATTRIBUTE: progress})
+
+    def start(self):
+        """
+        Report the progress periodically until stopped
+        """
+        if self.interval <= 0:
+            return
+
+        self._thread = threading.Thread(target=self._run, name="evtx_progress", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class ImportCancellation(object):
+    """
+    Cooperative cancellation of an import. It is requested by creating a marker file in the cancel directory of
+    the state directory, which the workers share, named after the id of the task, or after the case as
+    case_<case_id> to stop every import of a case. The manual hook of the module creates the case markers.
+    A case marker older than the import is ignored. Tasks revoked through Celery are cancelled too, where the
+    worker knows about it.
+    The import checks it between files, archives and rounds of chunks, stops feeding its stages, registers
+    the files fully ingested and frees its scratch space
+    """
+
+    def __init__(self, state_dir: Path, task_ids: list = None, case_id=None, log=logger):
+        """
+        :param state_dir: Directory of the state of the imports
+        :param task_ids: Ids of the task running the import, and of its parent task if it is a shard
+        :param case_id: Case of the import
+        :param log: Logger
+        """
+        self.cancel_dir = Path(state_dir) / CANCEL_DIR_NAME
+        self.task_ids = [task_id for task_id in task_ids or [] if task_id]
+        self.case_id = case_id
+        self.log = log
+
+        self._start_time = time.time()
+        self._last_check = 0
+        self._is_requested = False
+        self._lock = threading.Lock()
+
+    def _get_markers(self):
+        markers = [self.cancel_dir / str(task_id) for task_id in self.task_ids]
+        if self.case_id is not None:
+            markers.append(self.cancel_dir / "{}{}".format(CASE_MARKER_PREFIX, self.case_id))
+        return markers
+
+    def is_requested(self) -> bool:
+        """
+        Check if the import has to stop. The markers are only looked up every few seconds
+        :return: bool
+        """
+        with self._lock:
+            if self._is_requested or time.time() - self._last_check < CANCEL_CHECK_INTERVAL:
+                return self._is_requested
+            self._last_check = time.time()
+
+            for marker in self._get_markers():
+                try:
+                    marker_time = marker.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+
+                # A case marker left by a previous cancellation does not stop the next imports of the case
+                if marker.name.startswith(CASE_MARKER_PREFIX) and marker_time < self._start_time:
+                    continue
+
+                self._is_requested = True
+                self.log.warning("Cancellation requested by {}".format(marker))
+                break
+
+            if not self._is_requested and worker_state is not None:
+                if any(task_id in worker_state.revoked for task_id in self.task_ids):
+                    self._is_requested = True
+                    self.log.warning("Cancellation requested by the revocation of the task")
+
+            return self._is_requested
+
+    def clear(self):
+        """
+        Remove the markers of the task, once the import ended
+        """
+        for task_id in self.task_ids[:1]:
+            try:
+                (self.cancel_dir / str(task_id)).unlink()
+            except FileNotFoundError:
+                pass
+
+
+def request_cancellation(state_dir: Path, task_id: str = None, case_id=None) -> Path:
+    """
+    Request the cancellation of an import, or of the imports of a case
+    :param state_dir: Directory of the state of the imports
+    :param task_id: Id of the task running the import
+    :param case_id: Case whose imports are cancelled, if task_id is not set
+    :return: Path of the marker
+    """
+    cancel_dir = Path(state_dir) / CANCEL_DIR_NAME
+    cancel_dir.mkdir(parents=True, exist_ok=True)
+    marker = cancel_dir / (str(task_id) if task_id else "{}{}".format(CASE_MARKER_PREFIX, case_id))
+    marker.touch()
+    return marker
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import gzip
+import json
+import logging as logger
+import os
+import re
+import threading
+import uuid
+from pathlib import Path
+
+try:
+    from importlib.metadata import PackageNotFoundError, version
+except ImportError:
+    version = None
+
+
+# CONTENT ------------------------------------------------
+RECORD_CACHE_DIR_NAME = "record_cache"
+CACHE_SUFFIX = ".jsonl.gz"
+# Bumped when the layout of the entries changes, so the old ones are never read
+CACHE_FORMAT_VERSION = 1
+COMPRESS_LEVEL = 3
+
+
+def get_parser_version() -> str:
+    """
+    Version of the evtx package decoding the records, part of the cache keys
+    """
+    if version is None:
+        return "unknown"
+    try:
+        return version("evtx")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+class RecordCache(object):
+    """
+    Content-addressed cache of decoded records, on disk. An entry holds the records of a range of chunks of an
+    EVTX file, keyed by the SHA256 of the file, the range and the version of the parser, so an entry never goes
+    stale. Entries are gzip compressed JSON lines, written atomically. The cache is bounded in size, the least
+    recently used entries are evicted
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int, parser_version: str = None, log=logger):
+        """
+        :param cache_dir: Directory of the cache, shared by the imports
+        :param max_size: Maximum size of the cache, in bytes
+        :param parser_version: Version of the parser, read from the evtx package if not set
+        :param log: Logger
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.parser_version = re.sub(r"[^\w.-]", "_", parser_version or get_parser_version())
+        self.log = log
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def get_key(self, sha256: str, chunks: list = None) -> str:
+        """
+        Key of the records of an EVTX file
+        :param sha256: SHA256 of the EVTX file
+        :param chunks: ChunkInfo of the range of chunks, None for the whole file
+        :return: str
+        """
+        chunks_range = "{}-{}".format(chunks[0].index, chunks[-1].index) if chunks else "all"
+        return "{}.{}.evtx-{}.v{}".format(sha256, chunks_range, self.parser_version, CACHE_FORMAT_VERSION)
+
+    def _get_entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / (key + CACHE_SUFFIX)
+
+    def read(self, key: str):
+        """
+        Read the records of an entry
+        :param key: Key of the entry
+        :return: Generator of (record_id, event), or None if the entry is not cached
+        """
+        entry_path = self._get_entry_path(key)
+        try:
+            # The modification time orders the entries for the eviction
+            os.utime(entry_path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self._iter_entry(entry_path)
+
+    def _iter_entry(self, entry_path: Path):
+        try:
+            with gzip.open(entry_path, "rt", encoding="utf-8") as entry:
+                for line in entry:
+                    record_id, _, data = line.partition("\t")
+                    yield int(record_id), json.loads(data)
+
+        except (OSError, EOFError, ValueError) as e:
+            # The records already yielded were used, the caller has to start over
+            self.log.warning("Corrupted record cache entry {} removed".format(entry_path.name))
+            self._remove(entry_path)
+            raise OSError("Unable to read the record cache entry {}: {}".format(entry_path.name, e))
+
+    def store(self, key: str, records):
+        """
+        Write the records to an entry while they are consumed. The entry is only added once every record is
+        consumed, it is dropped if the consumer stops early
+        :param key: Key of the entry
+        :param records: Iterable of (record_id, event)
+        :return: Generator of (record_id, event)
+        """
+        entry_path = self._get_entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = entry_path.with_name(".{}.tmp".format(uuid.uuid4().hex))
+
+        is_complete = False
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=COMPRESS_LEVEL) as entry:
+                for record_id, event in records:
+                    entry.write("{}\t{}\n".format(record_id, json.dumps(event, separators=(",", ":"))))
+                    yield record_id, event
+            is_complete = True
+
+        finally:
+            if is_complete:
+                os.replace(tmp_path, entry_path)
+            else:
+                self._remove(tmp_path)
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in its maximum size
+        """
+        with self._lock:
+            entries = []
+            for entry_path in self.cache_dir.glob("*/*" + CACHE_SUFFIX):
+                try:
+                    stat = entry_path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, entry_path in sorted(entries, key=lambda entry: entry[0]):
+                if total_size <= self.max_size:
+                    break
+                self._remove(entry_path)
+                total_size -= size
+
+    @staticmethod
+    def _remove(path: Path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
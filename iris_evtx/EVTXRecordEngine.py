@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import io
+import json
+import logging as logger
+from pathlib import Path
+
+from iris_evtx.EVTXArchives import EVTX_SUFFIXES
+from iris_evtx.EVTXChunks import ChunkInfo, EVTXFormatError, write_chunks
+from iris_evtx.EVTXFilters import EventFilter, get_event_timestamp
+from iris_evtx.EVTXSplunk import SplunkError
+
+# The records are decoded by the evtx package, the bindings of the parser evtxdump is built on. Without it,
+# Evtx2Splunk sends the events and the imports filtering channels or EventIDs fail
+try:
+    import evtx as pyevtx
+except ImportError:
+    pyevtx = None
+
+
+# CONTENT ------------------------------------------------
+def is_record_engine_available():
+    return pyevtx is not None
+
+
+def read_log_identity(evtx_path: Path, chunk: ChunkInfo):
+    """
+    Read the host and channel of a log from its first record. Only the given chunk is decoded
+    :param evtx_path: Path of the EVTX file
+    :param chunk: First chunk of the file
+    :return: (computer, channel), or None if the evtx package is missing or the record can't be decoded
+    """
+    if pyevtx is None:
+        return None
+
+    data = io.BytesIO()
+    write_chunks(evtx_path, [chunk], data)
+    data.seek(0)
+
+    try:
+        for record in pyevtx.PyEvtxParser(data).records_json():
+            system = json.loads(record["data"]).get("Event", {}).get("System", {})
+            return system.get("Computer"), system.get("Channel")
+    except (RuntimeError, KeyError, ValueError):
+        return None
+
+    return None
+
+
+class RecordEngine(object):
+    """
+    Ingestion engine decoding the records in the module, so the events are filtered before being serialized and
+    sent to Splunk. Has the ingest interface of Evtx2Splunk, and sends the events the way evtxdump decodes them
+    """
+
+    def __init__(self, client, event_filter: EventFilter = None, hostname: str = None, record_cache=None,
+                 chunk_parser=None, log=logger):
+        """
+        :param client: Connected SplunkClient
+        :param event_filter: Events to send, all if None
+        :param hostname: Host of the events. The Computer of each event if not set
+        :param record_cache: RecordCache of the decoded records, None to always decode them
+        :param chunk_parser: ChunkParser decoding the chunks of the files in parallel, None to decode the files
+                             with the threads of the evtx package
+        :param log: Logger
+        """
+        self.client = client
+        self.event_filter = event_filter or EventFilter()
+        self.hostname = hostname
+        self.record_cache = record_cache
+        self.chunk_parser = chunk_parser
+        self.log = log
+        # EVTXSlice of the files to ingest, by path. They locate the records in the cache, and tell the records
+        # ingested by a previous import
+        self.slices = {}
+        # Paths of the files of the last ingest call whose events were all accepted
+        self.acknowledged = []
+        # Number of events sent of each file of the last ingest call, by path
+        self.sent = {}
+
+    def ingest(self, input_files, keep_cache: bool = False, use_cache: bool = False):
+        """
+        Decode, filter and send the events of the EVTX files of a directory
+        :param input_files: Directory of EVTX files
+        :param keep_cache: Unused, for compatibility with Evtx2Splunk
+        :param use_cache: Unused, for compatibility with Evtx2Splunk
+        :return: True if every event was accepted by Splunk
+        """
+        transport = self.client.transport
+        self.acknowledged = []
+        self.sent = {}
+        ingested = []
+        try:
+            for evtx_path in sorted(Path(input_files).rglob("*")):
+                if evtx_path.is_file() and evtx_path.suffix in EVTX_SUFFIXES:
+                    self._ingest_file(evtx_path)
+                    ingested.append(evtx_path)
+
+                    # The files are only acknowledged once all their events are accepted. The slices checkpointed
+                    # are acknowledged on their own, so a failure does not lose the previous ones
+                    evtx_slice = self.slices.get(evtx_path)
+                    if evtx_slice is not None and evtx_slice.checkpoint:
+                        transport.flush()
+                        self.acknowledged.extend(ingested)
+                        ingested = []
+
+            transport.flush()
+            self.acknowledged.extend(ingested)
+
+        except (SplunkError, OSError, RuntimeError) as e:
+            self.log.error(str(e))
+            transport.discard()
+            return False
+
+        return True
+
+    def close(self):
+        if self.chunk_parser is not None:
+            self.chunk_parser.close()
+        self.client.close()
+
+    def _ingest_file(self, evtx_path: Path):
+        sent = 0
+        filtered = 0
+        evtx_slice = self.slices.get(evtx_path)
+        min_record_id = evtx_slice.min_record_id if evtx_slice else None
+
+        # The transport batches the events
+        for event in self.iter_events(evtx_path, self._get_records(evtx_path, evtx_slice), min_record_id):
+            if event is None:
+                filtered += 1
+                continue
+
+            self.client.transport.send([event])
+            sent += 1
+
+        self.sent[evtx_path] = sent
+        self.log.info("{}: {} events sent, {} filtered out".format(evtx_path.name, sent, filtered))
+
+    def _get_records(self, evtx_path: Path, evtx_slice):
+        """
+        Records of a file, read from the cache when it holds them. Otherwise they are decoded, and cached
+        :param evtx_path: Path of the EVTX file
+        :param evtx_slice: EVTXSlice of the file, None if unknown
+        :return: Generator of (record_id, event)
+        """
+        if self.record_cache is None or evtx_slice is None:
+            return self.iter_records(evtx_path)
+
+        key = self.record_cache.get_key(evtx_slice.sha256, None if evtx_slice.whole else evtx_slice.chunks)
+        records = self.record_cache.read(key)
+        if records is not None:
+            self.log.info("{}: records read from the cache".format(evtx_path.name))
+            return records
+
+        return self.record_cache.store(key, self.iter_records(evtx_path))
+
+    def iter_records(self, evtx_path: Path):
+        """
+        Decode the records of a file
+        :param evtx_path: Path of the EVTX file
+        :return: Generator of (record_id, event)
+        """
+        if self.chunk_parser is not None:
+            try:
+                yield from self.chunk_parser.iter_records(evtx_path)
+                return
+            except EVTXFormatError as e:
+                # Left to the parser, which may recover the records of malformed files
+                self.log.warning(str(e))
+
+        records = pyevtx.PyEvtxParser(str(evtx_path)).records_json()
+
+        while True:
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            except RuntimeError as e:
+                self.log.warning("{}: unable to decode a record: {}".format(evtx_path.name, e))
+                continue
+
+            try:
+                yield record["event_record_id"], json.loads(record["data"])
+            except (KeyError, ValueError):
+                continue
+
+    def iter_events(self, evtx_path: Path, records=None, min_record_id: int = None):
+        """
+        Build the HEC events of a file
+        :param evtx_path: Path of the EVTX file
+        :param records: Iterable of the (record_id, event) of the file, decoded from it if not set
+        :param min_record_id: Records up to this id are filtered out
+        :return: Generator of HEC events, None for each event filtered out
+        """
+        is_first = True
+
+        for record_id, event in records if records is not None else self.iter_records(evtx_path):
+            if min_record_id is not None and record_id <= min_record_id:
+                yield None
+                continue
+
+            system = event.get("Event", {}).get("System", {})
+            if is_first:
+                is_first = False
+                # A log holds the events of a single channel, it is dropped as a whole
+                if not self.event_filter.matches_channel(system.get("Channel")):
+                    self.log.info("{}: channel {} filtered out".format(evtx_path.name, system.get("Channel")))
+                    return
+
+            timestamp = get_event_timestamp(event)
+            if not self.event_filter.matches(event, timestamp):
+                yield None
+                continue
+
+            hec_event = {
+                "host": self.hostname or system.get("Computer"),
+                "source": evtx_path.name,
+                "sourcetype": self.client.sourcetype,
+                "index": self.client.index,
+                "event": event
+            }
+            if timestamp is not None:
+                hec_event["time"] = timestamp
+
+            yield hec_event
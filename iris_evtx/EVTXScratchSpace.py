@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import fcntl
+import json
+import logging as logger
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# CONTENT ------------------------------------------------
+RESERVATION_FILE = ".reservation"
+LOCK_FILE = ".lock"
+SCRATCH_PREFIX = "evtx_import_"
+
+
+def _is_process_alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+def get_base_dir(base_dir=None) -> Path:
+    """
+    Directory holding the scratch directories of the imports
+    :param base_dir: Directory set in the module configuration, None for the default one
+    :return: Path
+    """
+    return Path(base_dir) if base_dir else Path(tempfile.gettempdir(), "iris_evtx")
+
+
+class ScratchSpace(object):
+    """
+    Scratch directory of one import.
+    Every import gets its own directory below a shared base directory. The space an import intends to use is
+    reserved beforehand against a budget shared by every import running on the host, and against the free space
+    of the partition. The directory is removed when the import ends, whatever its outcome.
+
+    Usage:
+        with ScratchSpace(base_dir) as scratch:
+            if scratch.reserve(nbytes):
+                ...
+                scratch.mark_written(nbytes)
+                ...
+                scratch.release(nbytes)
+    """
+
+    def __init__(self, base_dir: Path = None, budget: int = 0, min_free: int = 0, log=logger):
+        """
+        :param base_dir: Directory holding the scratch directories of every import
+        :param budget: Maximum number of bytes reserved by all the imports of the host. 0 for no limit
+        :param min_free: Number of bytes to always leave free on the partition
+        :param log: Logger
+        """
+        self.base_dir = get_base_dir(base_dir)
+        self.budget = budget
+        self.min_free = min_free
+        self.log = log
+        self.path = None
+        self.reserved = 0
+        # Part of the reserved bytes already on disk, and so already deducted from the free space of the partition
+        self.written = 0
+
+        # Reservations are made by concurrent extraction threads of the same import
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.purge_stale()
+
+        self.path = Path(tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=self.base_dir))
+        self._write_reservation()
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+        return False
+
+    @contextmanager
+    def _host_lock(self):
+        """
+        Lock shared by every import of the host while the reservations are read and written
+        """
+        with self._thread_lock:
+            with open(self.base_dir / LOCK_FILE, "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_reservation(self):
+        with open(self.path / RESERVATION_FILE, "w") as f:
+            json.dump({"pid": os.getpid(), "host": socket.gethostname(), "reserved": self.reserved,
+                       "written": self.written}, f)
+
+    def _iter_scratch_dirs(self):
+        for scratch_dir in self.base_dir.glob("{}*".format(SCRATCH_PREFIX)):
+            reservation_file = scratch_dir / RESERVATION_FILE
+            try:
+                with open(reservation_file) as f:
+                    yield scratch_dir, json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def _is_stale(self, reservation: dict):
+        return reservation.get("host") == socket.gethostname() and not _is_process_alive(reservation.get("pid", 0))
+
+    def purge_stale(self):
+        """
+        Remove the scratch directories left by imports whose worker died
+        """
+        for scratch_dir, reservation in self._iter_scratch_dirs():
+            if self._is_stale(reservation):
+                self.log.warning("Removing scratch space {} left by a dead import".format(scratch_dir.name))
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    def get_host_reserved(self):
+        """
+        Bytes reserved by every live import sharing the base directory
+        :return: int
+        """
+        return sum(reservation.get("reserved", 0) for _, reservation in self._iter_scratch_dirs()
+                   if not self._is_stale(reservation))
+
+    def get_host_pending(self):
+        """
+        Bytes reserved by every live import sharing the base directory and not written yet
+        :return: int
+        """
+        return sum(max(0, reservation.get("reserved", 0) - reservation.get("written", 0))
+                   for _, reservation in self._iter_scratch_dirs() if not self._is_stale(reservation))
+
+    def count_live_imports(self):
+        """
+        Number of imports currently running on the host with the same base directory, this one included
+        :return: int
+        """
+        return sum(1 for _, reservation in self._iter_scratch_dirs()
+                   if reservation.get("host") == socket.gethostname() and not self._is_stale(reservation))
+
+    def reserve(self, nbytes: int, timeout: float = 0, poll_interval: float = 5):
+        """
+        Reserve space for data about to be written in the scratch directory
+        :param nbytes: Number of bytes to reserve
+        :param timeout: Seconds to wait for other reservations to be released if the space is not available
+        :param poll_interval: Seconds between two attempts while waiting
+        :return: True if the space is reserved
+        """
+        if self.budget and nbytes > self.budget:
+            self.log.error("{} bytes of scratch space requested, over the budget of {}".format(nbytes, self.budget))
+            return False
+
+        deadline = time.time() + timeout
+        while True:
+            with self._host_lock():
+                host_reserved = self.get_host_reserved()
+                within_budget = not self.budget or host_reserved + nbytes <= self.budget
+
+                # Reserved space not written yet is deducted from the free space of the partition. The written
+                # part already is
+                free = shutil.disk_usage(self.base_dir).free - self.get_host_pending()
+                if within_budget and free - nbytes >= self.min_free:
+                    self.reserved += nbytes
+                    self._write_reservation()
+                    return True
+
+            if time.time() >= deadline:
+                self.log.error("Unable to reserve {} bytes of scratch space. {} reserved on the host, "
+                               "{} free".format(nbytes, host_reserved, free))
+                return False
+
+            time.sleep(poll_interval)
+
+    def mark_written(self, nbytes: int):
+        """
+        Tell that the data of a reservation is on disk, whatever its actual size. The space it takes is then
+        only accounted by the partition, and not deducted a second time from its free space
+        :param nbytes: Number of reserved bytes written
+        """
+        with self._host_lock():
+            self.written = min(self.reserved, self.written + nbytes)
+            self._write_reservation()
+
+    def release(self, nbytes: int):
+        """
+        Release space reserved with reserve, once the data is removed. The released bytes are expected to be
+        marked as written beforehand
+        :param nbytes: Number of bytes to release
+        """
+        with self._host_lock():
+            self.reserved = max(0, self.reserved - nbytes)
+            self.written = min(max(0, self.written - nbytes), self.reserved)
+            self._write_reservation()
+
+    def cleanup(self):
+        """
+        Remove the scratch directory and everything it holds
+        """
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+            self.reserved = 0
+            self.written = 0
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import heapq
+import shutil
+from pathlib import Path
+
+
+# CONTENT ------------------------------------------------
+def partition_by_size(files: list, nb_shards: int) -> list:
+    """
+    Split files in shards of balanced total size, each file going to the lightest shard, biggest files first
+    :param files: List of (path, size)
+    :param nb_shards: Maximum number of shards
+    :return: List of non empty shards, each a list of paths
+    """
+    shards = [[] for _ in range(max(1, nb_shards))]
+    heap = [(0, index) for index in range(len(shards))]
+
+    for path, size in sorted(files, key=lambda file: file[1], reverse=True):
+        shard_size, index = heapq.heappop(heap)
+        shards[index].append(path)
+        heapq.heappush(heap, (shard_size + size, index))
+
+    return [shard for shard in shards if shard]
+
+
+def create_shards(path: Path, nb_shards: int) -> list:
+    """
+    Move the uploaded files in one directory per shard, next to the upload directory,
+    so each shard can be imported by its own task
+    :param path: Upload directory
+    :param nb_shards: Maximum number of shards
+    :return: List of the shards directories
+    """
+    files = [(file_path, file_path.stat().st_size) for file_path in path.iterdir() if file_path.is_file()]
+
+    shards_paths = []
+    for index, shard in enumerate(partition_by_size(files, nb_shards)):
+        shard_path = path.parent / "{}_shard{}".format(path.name, index)
+        shard_path.mkdir(parents=True, exist_ok=True)
+
+        for file_path in shard:
+            shutil.move(str(file_path), str(shard_path / file_path.name))
+
+        shards_paths.append(shard_path)
+
+    return shards_paths
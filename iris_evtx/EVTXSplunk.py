@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import logging as logger
+
+import requests
+
+from iris_evtx.EVTXHecTransport import DEFAULT_ACK_TIMEOUT, DEFAULT_CONNECTIONS, HecTransport, SplunkError
+
+
+# CONTENT ------------------------------------------------
+HEC_DEFAULT_PORT = 8088
+DEFAULT_SOURCETYPE = "evtx2splunk"
+REQUEST_TIMEOUT = 120
+HEC_INPUTS_PATH = "/servicesNS/nobody/splunk_httpinput/data/inputs/http"
+
+
+class SplunkClient(object):
+    """
+    Client of the Splunk management API and HTTP Event Collector, used when the events are sent by the module
+    itself rather than by Evtx2Splunk. Reads the same settings of the module configuration, and the settings of
+    the HEC transport
+    """
+
+    def __init__(self, configuration: dict, index: str, proxies: dict = None, log=logger):
+        """
+        :param configuration: Module configuration
+        :param index: Splunk index the events are sent to
+        :param proxies: HTTP and HTTPS proxies
+        :param log: Logger
+        """
+        self.log = log
+        self.index = index
+        self.hec_name = configuration.get("evtx_splunk_hecname")
+        self.sourcetype = configuration.get("evtx_splunk_sourcetype") or DEFAULT_SOURCETYPE
+
+        scheme = "https" if _get_bool(configuration, "evtx_splunk_use_ssl", False) else "http"
+        host = configuration.get("evtx_splunk_url")
+        self.management_url = "{}://{}:{}".format(scheme, host, configuration.get("evtx_splunk_mport") or 8089)
+        self.hec_url = "{}://{}:{}".format(scheme, host,
+                                           configuration.get("evtx_splunk_hec_port") or HEC_DEFAULT_PORT)
+        self._auth = (configuration.get("evtx_splunk_user"), configuration.get("evtx_splunk_pass"))
+        self._configuration = configuration
+        self._proxies = proxies
+        self.token = None
+        self.transport = None
+
+        self.session = requests.Session()
+        self.session.verify = _get_bool(configuration, "evtx_splunk_verify_ssl", False)
+        self.session.proxies = {protocol: proxy for protocol, proxy in (proxies or {}).items() if proxy}
+
+    def _management(self, method: str, path: str, data: dict = None):
+        response = self.session.request(method, self.management_url + path, auth=self._auth, data=data,
+                                        params={"output_mode": "json", "count": 0}, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 404:
+            return None
+        if response.status_code >= 400:
+            raise SplunkError("{} {} failed with {}: {}".format(method, path, response.status_code,
+                                                               response.text[:200]), status=response.status_code)
+        return response.json().get("entry", [])
+
+    def connect(self):
+        """
+        Resolve the token of the HEC input, creating the index and the input if they do not exist yet
+        :raise SplunkError: If Splunk can't be reached or refuses the calls
+        """
+        try:
+            if self._management("GET", "/services/data/indexes/{}".format(self.index)) is None:
+                self.log.info("Creating Splunk index {}".format(self.index))
+                self._management("POST", "/services/data/indexes", data={"name": self.index})
+
+            inputs = self._management("GET", HEC_INPUTS_PATH) or []
+            names = {self.hec_name, "http://{}".format(self.hec_name)}
+            entries = [entry for entry in inputs if entry.get("name") in names]
+            if not entries:
+                self.log.info("Creating Splunk HEC input {}".format(self.hec_name))
+                entries = self._management("POST", HEC_INPUTS_PATH, data={"name": self.hec_name,
+                                                                          "index": self.index}) or []
+
+        except (requests.RequestException, ValueError) as e:
+            raise SplunkError("Unable to reach Splunk at {}: {}".format(self.management_url, e))
+
+        self.token = entries[0].get("content", {}).get("token") if entries else None
+        if not self.token:
+            raise SplunkError("No token found for HEC input {}".format(self.hec_name))
+
+        configuration = self._configuration
+        self.transport = HecTransport(self.hec_url, self.token,
+                                      verify=self.session.verify,
+                                      proxies=self._proxies,
+                                      batch_size=_get_int(configuration, "evtx_hec_batch_size", 1024) * 1024,
+                                      compress=_get_bool(configuration, "evtx_hec_compress", True),
+                                      connections=_get_int(configuration, "evtx_hec_connections",
+                                                           DEFAULT_CONNECTIONS),
+                                      use_ack=_get_bool(configuration, "evtx_hec_use_ack", False),
+                                      ack_timeout=_get_int(configuration, "evtx_hec_ack_timeout",
+                                                           DEFAULT_ACK_TIMEOUT),
+                                      log=self.log)
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+        self.session.close()
+
+
+def _get_bool(configuration: dict, param_name: str, default: bool) -> bool:
+    """
+    Read a boolean parameter, set as a bool or as a string. Only a missing or empty value gives the default,
+    False is kept as is
+    """
+    value = configuration.get(param_name)
+    if value is None or value == "":
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes", "on")
+    return bool(value)
+
+
+def _get_int(configuration: dict, param_name: str, default: int) -> int:
+    try:
+        value = int(configuration.get(param_name))
+        return value if value > 0 else default
+    except (TypeError, ValueError):
+        return default
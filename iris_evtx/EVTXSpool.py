@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import gzip
+import json
+import logging as logger
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from iris_evtx.EVTXHecTransport import SplunkError
+from iris_evtx.EVTXScratchSpace import _is_process_alive
+from iris_evtx.EVTXSplunk import SplunkClient
+from iris_evtx.EVTXStateStore import StateStore, get_state_path
+
+
+# CONTENT ------------------------------------------------
+# The spool holds a directory per index, of gzip compressed segments of HEC events serialized as JSON lines.
+# Segments are named after their creation time, so they are forwarded in order. A segment is:
+#   .<name>.tmp while being written
+#   <name>.jsonl.gz.pending once written, until the import acknowledges its file
+#   <name>.jsonl.gz once ready to be forwarded
+#   <name>.jsonl.gz.<host>.<pid>.sending while forwarded by the worker process pid of host
+SPOOL_DIR_NAME = "spool"
+SEGMENT_SUFFIX = ".jsonl.gz"
+PENDING_SUFFIX = ".pending"
+CLAIM_SUFFIX = ".sending"
+REJECTED_DIR_NAME = "rejected"
+
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+COMPRESS_LEVEL = 3
+
+# Seconds an import waits for the forwarder to make room in a full spool
+SPOOL_WAIT_TIMEOUT = 30 * 60
+POLL_INTERVAL = 2.0
+MIN_BACKOFF = 5
+MAX_BACKOFF = 300
+
+# Statuses of the HEC refusing the events themselves, sending them again would fail the same way
+REJECTED_STATUSES = (400, 413)
+
+
+def get_spool_size(spool_dir: Path) -> int:
+    """
+    Size of the segments of the spool, in bytes
+    """
+    size = 0
+    for segment_path in Path(spool_dir).glob("*/*" + SEGMENT_SUFFIX + "*"):
+        try:
+            size += segment_path.stat().st_size
+        except FileNotFoundError:
+            continue
+    return size
+
+
+class SpoolWriter(object):
+    """
+    Stands in for the HEC transport of an import: the events are written to segments of the spool at the speed
+    they are decoded, whatever the state of Splunk. The segments written since the last flush only become visible
+    to the forwarder once flushed, so the events of a failed round are never forwarded
+    """
+
+    def __init__(self, spool_dir: Path, index: str, segment_size: int = DEFAULT_SEGMENT_SIZE, max_size: int = 0,
+                 on_flush=None, log=logger):
+        """
+        :param spool_dir: Directory of the spool
+        :param index: Splunk index of the events
+        :param segment_size: Uncompressed size of the events of a segment, in bytes
+        :param max_size: Maximum size of the spool, in bytes. The writer waits for the forwarder beyond. 0 for
+                         no limit
+        :param on_flush: Called with the names of the segments of a flush, before they can be forwarded
+        :param log: Logger
+        """
+        self.spool_dir = Path(spool_dir)
+        self.index_dir = self.spool_dir / index
+        self.segment_size = max(1, segment_size)
+        self.max_size = max_size
+        self.on_flush = on_flush
+        self.log = log
+
+        self._segment = None
+        self._segment_path = None
+        self._segment_bytes = 0
+        self._pending = []
+
+        # Same counters as the HEC transport, a batch being a segment
+        self.batches = 0
+        self.events = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+
+    def send(self, events: list):
+        """
+        Write events to the spool
+        :param events: HEC event objects
+        :raise SplunkError: If the spool stays full
+        """
+        for event in events:
+            data = json.dumps(event, separators=(",", ":")).encode() + b"\n"
+            if self._segment is None:
+                self._open_segment()
+
+            self._segment.write(data)
+            self._segment_bytes += len(data)
+            self.raw_bytes += len(data)
+            self.events += 1
+
+            if self._segment_bytes >= self.segment_size:
+                self._seal_segment()
+
+    def flush(self):
+        """
+        Make the events written so far available to the forwarder. They are on disk once this returns
+        """
+        if self._segment is not None:
+            self._seal_segment()
+
+        if self._pending and self.on_flush is not None:
+            self.on_flush([pending_path.name[:-len(PENDING_SUFFIX)] for pending_path in self._pending])
+
+        for pending_path in self._pending:
+            os.replace(pending_path, pending_path.with_name(pending_path.name[:-len(PENDING_SUFFIX)]))
+        self._pending = []
+
+    def discard(self):
+        """
+        Drop the events written since the last flush, after a failure
+        """
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+            self._pending.append(self._segment_path)
+
+        for pending_path in self._pending:
+            try:
+                pending_path.unlink()
+            except FileNotFoundError:
+                pass
+        self._pending = []
+
+    def close(self):
+        self.discard()
+
+    def _open_segment(self):
+        if self.max_size:
+            self._wait_for_space()
+
+        name = "{:020d}-{}-{}".format(time.time_ns(), os.getpid(), uuid.uuid4().hex[:8])
+        self._segment_path = self.index_dir / ".{}.tmp".format(name)
+        self._segment = gzip.open(self._segment_path, "wb", compresslevel=COMPRESS_LEVEL)
+        self._segment_bytes = 0
+
+    def _seal_segment(self):
+        self._segment.close()
+        with open(self._segment_path, "rb") as segment:
+            os.fsync(segment.fileno())
+
+        name = self._segment_path.name[1:-len(".tmp")]
+        pending_path = self.index_dir / (name + SEGMENT_SUFFIX + PENDING_SUFFIX)
+        os.replace(self._segment_path, pending_path)
+        self._pending.append(pending_path)
+
+        self.batches += 1
+        self.sent_bytes += pending_path.stat().st_size
+        self._segment = None
+        self._segment_path = None
+
+    def _wait_for_space(self):
+        deadline = time.time() + SPOOL_WAIT_TIMEOUT
+        is_waiting = False
+        while get_spool_size(self.spool_dir) >= self.max_size:
+            if time.time() > deadline:
+                raise SplunkError("The spool {} is still full after {}s".format(self.spool_dir, SPOOL_WAIT_TIMEOUT))
+            if not is_waiting:
+                self.log.warning("The spool is full, waiting for its events to be forwarded")
+                is_waiting = True
+            time.sleep(POLL_INTERVAL)
+
+
+class SpoolForwarder(object):
+    """
+    Drains the spool to the HEC, in the background of the worker process, so the imports end as soon as their
+    events are spooled. The segments are claimed by renaming them, so the forwarders of several workers share a
+    spool, and the segments claimed by a dead worker of the host are taken over.
+    The events are forwarded at least once: a segment failing midway is sent again whole. It is retried as long as
+    Splunk can't be reached or is busy, with a growing delay, and set aside in rejected/ if Splunk refuses it.
+    The segments forwarded and rejected are recorded in the state store of the imports, so the files of a
+    rejected segment are reported and imported again
+    """
+
+    def __init__(self):
+        self.spool_dir = None
+        self.log = logger
+        self._configuration = None
+        self._proxies = None
+        self._clients = {}
+        self._state_store = None
+        self._is_reconfigured = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+
+        self.segments = 0
+        self.events = 0
+
+    def start(self, spool_dir: Path, configuration: dict, proxies: dict = None, log=logger):
+        """
+        Start forwarding the spool, with the latest module configuration
+        :param spool_dir: Directory of the spool
+        :param configuration: Module configuration
+        :param proxies: HTTP and HTTPS proxies
+        :param log: Logger
+        """
+        with self._lock:
+            if configuration != self._configuration or proxies != self._proxies:
+                # The clients are used by the forwarder thread, it drops them itself
+                self._configuration = dict(configuration)
+                self._proxies = proxies
+                self._is_reconfigured = True
+            self.spool_dir = Path(spool_dir)
+            self.log = log
+
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="evtx_spool_forwarder", daemon=True)
+                self._thread.start()
+
+        self.notify()
+
+    def notify(self):
+        """
+        Forward the segments without waiting for the next poll
+        """
+        self._wakeup.set()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        backoff = MIN_BACKOFF
+        while not self._stop.is_set():
+            try:
+                self.recover_stale_claims()
+                self.forward_pending()
+                backoff = MIN_BACKOFF
+
+            except SplunkError as e:
+                self.log.warning("Unable to forward the spool, retrying in {}s: {}".format(int(backoff), e))
+                self._close_clients()
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+
+            except Exception as e:
+                # The forwarder outlives the imports, it must not die with an unexpected error
+                self.log.exception("Spool forwarder error: {}".format(e))
+
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def forward_pending(self):
+        """
+        Forward the segments ready in the spool, oldest first
+        :return: Number of segments forwarded
+        :raise SplunkError: If Splunk can't be reached or is busy, the segment is left to be sent again
+        """
+        forwarded = 0
+        while not self._stop.is_set():
+            claimed = self._claim_next()
+            if claimed is None:
+                return forwarded
+
+            segment_path, claim_path = claimed
+            try:
+                transport = self._get_client(segment_path.parent.name).transport
+                events = self._forward_segment(transport, claim_path)
+
+            except SplunkError as e:
+                if e.status in REJECTED_STATUSES:
+                    self._reject(segment_path, claim_path, e)
+                    continue
+                os.replace(claim_path, segment_path)
+                raise
+
+            except (OSError, EOFError) as e:
+                # Unreadable segment
+                self._reject(segment_path, claim_path, e)
+                continue
+
+            except Exception:
+                os.replace(claim_path, segment_path)
+                raise
+
+            claim_path.unlink()
+            self._forget(segment_path)
+            forwarded += 1
+            self.segments += 1
+            self.events += events
+            self.log.info("Spool segment {} forwarded to {}, {} events".format(segment_path.name,
+                                                                             segment_path.parent.name, events))
+
+        return forwarded
+
+    def recover_stale_claims(self):
+        """
+        Release the segments claimed by dead worker processes. The spool may be shared by several hosts, whose
+        processes can't be checked from here: only the claims of this host are released
+        """
+        if self.spool_dir is None:
+            return
+
+        hostname = socket.gethostname()
+        for claim_path in self.spool_dir.glob("*/*" + SEGMENT_SUFFIX + ".*" + CLAIM_SUFFIX):
+            name, owner = claim_path.name[:-len(CLAIM_SUFFIX)].split(SEGMENT_SUFFIX + ".", 1)
+            name += SEGMENT_SUFFIX
+            host, _, pid = owner.rpartition(".")
+            if host == hostname and pid.isdigit() and not _is_process_alive(int(pid)):
+                try:
+                    os.replace(claim_path, claim_path.with_name(name))
+                except FileNotFoundError:
+                    continue
+                self.log.warning("Spool segment {} left by a dead worker released".format(name))
+
+    def _claim_next(self):
+        if self.spool_dir is None:
+            return None
+
+        for segment_path in sorted(self.spool_dir.glob("*/*" + SEGMENT_SUFFIX), key=lambda path: path.name):
+            claim_path = segment_path.with_name("{}.{}.{}{}".format(segment_path.name, socket.gethostname(),
+                                                                    os.getpid(), CLAIM_SUFFIX))
+            try:
+                os.rename(segment_path, claim_path)
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+            return segment_path, claim_path
+
+        return None
+
+    def _forward_segment(self, transport, claim_path: Path) -> int:
+        events = transport.events
+        try:
+            with gzip.open(claim_path, "rb") as segment:
+                transport.send_serialized(segment)
+            transport.flush()
+        except Exception:
+            transport.discard()
+            raise
+
+        return transport.events - events
+
+    def _get_client(self, index: str):
+        with self._lock:
+            if self._is_reconfigured:
+                self._close_clients()
+                self._is_reconfigured = False
+            configuration = self._configuration
+            proxies = self._proxies
+
+        client = self._clients.get(index)
+        if client is None:
+            # Connecting also creates the index and the HEC input if needed
+            client = SplunkClient(configuration, index, proxies=proxies, log=self.log)
+            try:
+                client.connect()
+            except SplunkError:
+                client.close()
+                raise
+            self._clients[index] = client
+
+        return client
+
+    def _get_state_store(self):
+        """
+        State store of the imports, which records the files of each segment
+        :return: StateStore, or None if the forwarder was not started
+        """
+        with self._lock:
+            if self._is_reconfigured:
+                self._close_clients()
+                self._is_reconfigured = False
+            configuration = self._configuration
+
+        if self._state_store is None and configuration is not None:
+            self._state_store = StateStore(get_state_path(configuration))
+
+        return self._state_store
+
+    def _close_clients(self):
+        for client in self._clients.values():
+            client.close()
+        self._clients = {}
+        if self._state_store is not None:
+            self._state_store.close()
+            self._state_store = None
+
+    def _forget(self, segment_path: Path):
+        state_store = self._get_state_store()
+        if state_store is not None:
+            state_store.forget_spooled_segment(segment_path.name)
+
+    def _reject(self, segment_path: Path, claim_path: Path, error: Exception):
+        rejected_dir = self.spool_dir / REJECTED_DIR_NAME / segment_path.parent.name
+        rejected_dir.mkdir(parents=True, exist_ok=True)
+        os.replace(claim_path, rejected_dir / segment_path.name)
+        self.log.error("Spool segment {} set aside in {}: {}".format(segment_path.name, rejected_dir, error))
+
+        # The imports of the case report its files, and no longer skip them as ingested
+        state_store = self._get_state_store()
+        if state_store is not None:
+            state_store.reject_spooled_segment(segment_path.name, str(error))
+
+
+# Forwarder of the current worker process
+spool_forwarder = SpoolForwarder()
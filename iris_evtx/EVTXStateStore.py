@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+#
+#  IRIS Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from iris_evtx.EVTXScratchSpace import get_base_dir
+
+# CONTENT ------------------------------------------------
+STATE_DB_NAME = "evtx_state.sqlite"
+STATE_DIR_NAME = "state"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    sha256 TEXT NOT NULL,
+    idx TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    record_id INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (sha256, idx)
+);
+CREATE TABLE IF NOT EXISTS members (
+    case_id INTEGER NOT NULL,
+    idx TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    name TEXT NOT NULL,
+    source_sha256 TEXT NOT NULL,
+    source_name TEXT NOT NULL,
+    added REAL NOT NULL,
+    PRIMARY KEY (case_id, idx, sha256)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    case_id INTEGER NOT NULL,
+    idx TEXT NOT NULL,
+    host TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    record_id INTEGER NOT NULL,
+    written_time INTEGER,
+    updated REAL NOT NULL,
+    PRIMARY KEY (case_id, idx, host, channel, scope)
+);
+CREATE TABLE IF NOT EXISTS spooled (
+    segment TEXT NOT NULL,
+    case_id INTEGER NOT NULL,
+    idx TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    source_sha256 TEXT NOT NULL,
+    source_name TEXT NOT NULL,
+    host TEXT,
+    channel TEXT,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (segment, sha256)
+);
+"""
+
+
+def get_state_path(configuration: dict) -> Path:
+    """
+    Path of the database of the state of the imports. It is kept in the state directory of the module
+    configuration, or in the scratch directory when not set
+    :param configuration: Module configuration
+    :return: Path
+    """
+    state_dir = configuration.get("evtx_state_dir") or \
+        get_base_dir(configuration.get("evtx_scratch_dir")) / STATE_DIR_NAME
+    return Path(state_dir) / STATE_DB_NAME
+
+
+class StateStore(object):
+    """
+    Persistent state of the imports, kept in a SQLite database in the state directory of the module configuration,
+    so it outlives the imports and the workers. The directory is shared by every worker, SQLite handles the locking.
+    Without a state directory, the state is kept in memory for a single import.
+
+    checkpoints: last chunk of an EVTX file acknowledged by Splunk, per file content and index
+    members: EVTX files fully ingested, per case and index, with the uploaded file they came from
+    watermarks: highest record id fully ingested, per case, index, host, channel and events filter
+    spooled: EVTX files whose events are in a spool segment not forwarded yet, and the segments Splunk rejected
+    """
+
+    def __init__(self, path: Path = None, timeout: float = 60):
+        """
+        :param path: Path of the database, None to keep the state in memory
+        :param timeout: Seconds to wait for the database lock held by another worker
+        """
+        self.path = Path(path) if path else None
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        # The stages of an import use the store from several threads. The default rollback journal is kept, the
+        # write-ahead log does not work on the network filesystems the workers share
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path) if self.path else ":memory:", timeout=timeout,
+                                   check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def get_checkpoint(self, sha256: str, index: str):
+        """
+        Last acknowledged chunk of a file
+        :param sha256: SHA256 of the EVTX file
+        :param index: Splunk index the file is sent to
+        :return: (chunk_index, record_id), or None if nothing was acknowledged
+        """
+        with self._lock:
+            row = self._db.execute("SELECT chunk_index, record_id FROM checkpoints WHERE sha256 = ? AND idx = ?",
+                                   (sha256, index)).fetchone()
+        return tuple(row) if row else None
+
+    def set_checkpoint(self, sha256: str, index: str, chunk_index: int, record_id: int):
+        """
+        Record the last acknowledged chunk of a file
+        :param sha256: SHA256 of the EVTX file
+        :param index: Splunk index the file is sent to
+        :param chunk_index: Index of the last acknowledged chunk
+        :param record_id: Last record id of this chunk
+        """
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO checkpoints (sha256, idx, chunk_index, record_id, updated) "
+                             "VALUES (?, ?, ?, ?, ?)", (sha256, index, chunk_index, record_id, time.time()))
+
+    def clear_checkpoints(self, hashes: list, index: str):
+        """
+        Forget the checkpoints of files fully ingested
+        :param hashes: SHA256 of the files
+        :param index: Splunk index
+        """
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM checkpoints WHERE sha256 = ? AND idx = ?",
+                                 [(sha256, index) for sha256 in hashes])
+
+    def get_ingested_members(self, case_id, index: str, hashes: list) -> dict:
+        """
+        Find which EVTX files were already fully ingested for a case
+        :param case_id: Case
+        :param index: Splunk index
+        :param hashes: SHA256 of the EVTX files
+        :return: Dict of the SHA256 already ingested, to the name of the uploaded file they came from
+        """
+        hashes = list(dict.fromkeys(hashes))
+        ingested = {}
+        with self._lock:
+            # SQLite limits the number of parameters of a query
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                rows = self._db.execute("SELECT sha256, source_name FROM members WHERE case_id = ? AND idx = ? "
+                                        "AND sha256 IN ({})".format(",".join("?" * len(batch))),
+                                        [case_id, index] + batch).fetchall()
+                ingested.update(rows)
+        return ingested
+
+    def add_ingested_members(self, case_id, index: str, members: list):
+        """
+        Record EVTX files fully ingested for a case
+        :param case_id: Case
+        :param index: Splunk index
+        :param members: List of (sha256, name, source_sha256, source_name), the source being the uploaded file,
+                        an archive or the EVTX file itself
+        """
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO members (case_id, idx, sha256, name, source_sha256, "
+                                 "source_name, added) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 [(case_id, index) + tuple(member) + (time.time(),) for member in members])
+
+    def get_watermark(self, case_id, index: str, host: str, channel: str, scopes: tuple = ("",)):
+        """
+        Highest record fully ingested of a log
+        :param case_id: Case
+        :param index: Splunk index
+        :param host: Host of the log
+        :param channel: Channel of the log
+        :param scopes: Events filters whose watermarks apply, the empty one standing for the whole logs
+        :return: (record_id, written_time as FILETIME), or None if nothing was ingested
+        """
+        with self._lock:
+            row = self._db.execute("SELECT record_id, written_time FROM watermarks WHERE case_id = ? AND idx = ? "
+                                   "AND host = ? AND channel = ? AND scope IN ({}) ORDER BY record_id DESC "
+                                   "LIMIT 1".format(", ".join("?" * len(scopes))),
+                                   (case_id, index, host, channel) + tuple(scopes)).fetchone()
+        return tuple(row) if row else None
+
+    def set_watermark(self, case_id, index: str, host: str, channel: str, record_id: int, written_time: int = None,
+                      replace: bool = False, scope: str = ""):
+        """
+        Raise the watermark of a log. A lower record id is ignored, unless replaced
+        :param case_id: Case
+        :param index: Splunk index
+        :param host: Host of the log
+        :param channel: Channel of the log
+        :param record_id: Highest record id ingested
+        :param written_time: Written time of this record, as FILETIME
+        :param replace: Set the watermark even if lower, once the record ids of the log were reset. The watermarks
+                        of the other scopes no longer apply to the log, and are dropped
+        :param scope: Events filter of the import, empty for the whole log
+        """
+        with self._lock, self._db:
+            if replace:
+                self._db.execute("DELETE FROM watermarks WHERE case_id = ? AND idx = ? AND host = ? AND channel = ?",
+                                 (case_id, index, host, channel))
+            self._db.execute("INSERT OR IGNORE INTO watermarks (case_id, idx, host, channel, scope, record_id, "
+                             "written_time, updated) VALUES (?, ?, ?, ?, ?, -1, NULL, ?)",
+                             (case_id, index, host, channel, scope, time.time()))
+            self._db.execute("UPDATE watermarks SET record_id = ?, written_time = ?, updated = ? WHERE case_id = ? "
+                             "AND idx = ? AND host = ? AND channel = ? AND scope = ? AND record_id < ?",
+                             (record_id, written_time, time.time(), case_id, index, host, channel, scope, record_id))
+
+    def add_spooled_files(self, segments: list, case_id, index: str, files: list):
+        """
+        Record the EVTX files whose events were written to spool segments, before the segments are forwarded.
+        The files sent again are not rejected anymore
+        :param segments: Names of the segments
+        :param case_id: Case
+        :param index: Splunk index
+        :param files: List of (sha256, source_sha256, source_name, host, channel), the source being the uploaded
+                      file. The host and channel are None if unknown
+        """
+        self.clear_rejected_spooled(case_id, index, [spooled[0] for spooled in files])
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO spooled (segment, case_id, idx, sha256, source_sha256, "
+                                 "source_name, host, channel, error, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, "
+                                 "NULL, ?)", [(segment, case_id, index) + tuple(spooled) + (time.time(),)
+                                              for segment in segments for spooled in files])
+
+    def clear_rejected_spooled(self, case_id, index: str, hashes: list):
+        """
+        Forget the rejected events of EVTX files sent again
+        :param case_id: Case
+        :param index: Splunk index
+        :param hashes: SHA256 of the EVTX files
+        """
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM spooled WHERE case_id = ? AND idx = ? AND sha256 = ? "
+                                 "AND error IS NOT NULL", [(case_id, index, sha256) for sha256 in hashes])
+
+    def forget_spooled_segment(self, segment: str):
+        """
+        Forget a segment forwarded to Splunk
+        :param segment: Name of the segment
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM spooled WHERE segment = ?", (segment,))
+
+    def reject_spooled_segment(self, segment: str, error: str):
+        """
+        Record that Splunk rejected a segment. Its files are reported and imported again by the next imports
+        of their case
+        :param segment: Name of the segment
+        :param error: Reason of the rejection
+        """
+        with self._lock, self._db:
+            self._db.execute("UPDATE spooled SET error = ?, updated = ? WHERE segment = ?",
+                             (error, time.time(), segment))
+
+    def get_rejected_spooled(self, case_id, index: str) -> list:
+        """
+        EVTX files of a case whose events were rejected by Splunk, and not sent again since
+        :param case_id: Case
+        :param index: Splunk index
+        :return: List of (sha256, source_sha256, source_name, host, channel, error)
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT sha256, source_sha256, source_name, host, channel, error FROM spooled "
+                                    "WHERE case_id = ? AND idx = ? AND error IS NOT NULL ORDER BY updated",
+                                    (case_id, index)).fetchall()
+        return [tuple(row) for row in rows]
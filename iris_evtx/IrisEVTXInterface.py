@@ -18,8 +18,11 @@
 #  along with this program; if not, write to the Free Software Foundation,
 #  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import logging
+import shutil
 import traceback
 from pathlib import Path
+from celery import chord, current_task, shared_task
 from werkzeug.utils import secure_filename
 
 import iris_interface.IrisInterfaceStatus as InterfaceStatus
@@ -27,6 +30,57 @@ from iris_interface.IrisModuleInterface import IrisPipelineTypes, IrisModuleInte
 
 import iris_evtx.IrisEVTXModConfig as interface_conf
 from iris_evtx.EVTXImportDispatcher import ImportDispatcher
+from iris_evtx.EVTXImportPipeline import merge_outcomes_summaries
+from iris_evtx.EVTXProgress import PROGRESS_RECORD_ATTRIBUTE, request_cancellation
+from iris_evtx.EVTXSharding import create_shards
+from iris_evtx.EVTXStateStore import get_state_path
+
+# Tasks importing the shards of an upload and merging their results, registered once the module is imported
+SHARD_TASK_NAME = "iris_evtx.import_shard"
+MERGE_TASK_NAME = "iris_evtx.merge_shards"
+
+# Manual hook of the cases cancelling their running imports
+CANCEL_HOOK_NAME = "on_manual_trigger_case"
+CANCEL_HOOK_UI_NAME = "Cancel the EVTX imports"
+
+
+def get_running_task():
+    """
+    Celery task running the module. IRIS runs the module from a task of its own, the module is not bound to it
+    :return: Task, or None out of a worker
+    """
+    if current_task and not current_task.request.called_directly:
+        return current_task._get_current_object()
+    return None
+
+
+class ProgressQueuingHandler(InterfaceStatus.QueuingHandler):
+    """
+    Queue the logs of the module as the handler of IRIS does, and publish them in the PROGRESS state of the task
+    running the module along with the last progress report of the import, so neither overwrites the other.
+    The module is created by the task running it
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.progress = None
+        # The threads of the import log too, and the request of the task is only seen by the thread running it
+        self.task = get_running_task()
+        self.task_id = self.task.request.id if self.task is not None else None
+
+    def emit(self, record):
+        self.message_queue.append(self.format(record).rstrip('\n'))
+        self.progress = getattr(record, PROGRESS_RECORD_ATTRIBUTE, self.progress)
+
+        if self.task_id is None:
+            return
+
+        try:
+            self.task.update_state(task_id=self.task_id, state='PROGRESS',
+                                   meta={"logs": list(self.message_queue), "progress": self.progress})
+        except Exception:
+            # The result backend is optional, the logs are returned with the result anyway
+            pass
 
 
 class IrisEVTXInterface(IrisModuleInterface):
@@ -43,6 +97,44 @@ class IrisEVTXInterface(IrisModuleInterface):
     _module_configuration = interface_conf.module_configuration
     _module_type = IrisModuleTypes.module_pipeline
 
+    def set_log_handler(self):
+        handler = ProgressQueuingHandler(message_queue=self.message_queue, level=logging.DEBUG, celery_task=self)
+        self.log.addHandler(handler)
+
+    def register_hooks(self, module_id: int):
+        """
+        Register the manual hook cancelling the imports of a case
+        :param module_id: Module ID provided by IRIS
+        """
+        status = self.register_to_hook(module_id, iris_hook_name=CANCEL_HOOK_NAME,
+                                       manual_hook_name=CANCEL_HOOK_UI_NAME)
+        if status.is_failure():
+            self.log.error(status.get_message())
+
+    def hooks_handler(self, hook_name: str, hook_ui_name: str, data):
+        """
+        Cancel the imports running for the cases the hook was triggered on. They stop wherever their worker is,
+        as long as the workers share the state directory
+        :param hook_name: Name of the hook
+        :param hook_ui_name: Name of the manual hook in the UI
+        :param data: Cases the hook was triggered on
+        :return: IIStatus, with the cases as data
+        """
+        if hook_name != CANCEL_HOOK_NAME or hook_ui_name != CANCEL_HOOK_UI_NAME:
+            return InterfaceStatus.I2InterfaceNotImplemented
+
+        configuration = self._get_module_configuration()
+        if configuration.is_failure():
+            self.log.error(configuration.get_message())
+            return self._ret_failure(data=data)
+
+        state_dir = get_state_path(configuration.get_data()).parent
+        for case in data:
+            request_cancellation(state_dir, case_id=case.case_id)
+            self.log.info("Cancellation of the EVTX imports of case {} requested".format(case.case_id))
+
+        return self._ret_success(data=data)
+
     def pipeline_handler(self, pipeline_type, pipeline_data):
         """
         Receive data from the main pipeline and dispatch to EVTX2Splunk handler
@@ -53,11 +145,11 @@ class IrisEVTXInterface(IrisModuleInterface):
 
         if pipeline_type == IrisPipelineTypes.pipeline_type_import:
             #  Call the import chain as task chain
-            return self.task_files_import(task_args=pipeline_data)
+            return self.task_files_import(task_args=pipeline_data, pipeline_type=pipeline_type)
 
         elif pipeline_type == IrisPipelineTypes.pipeline_type_update:
             # Call the update chain as task chain
-            return self.task_files_import(task_args=pipeline_data)
+            return self.task_files_import(task_args=pipeline_data, pipeline_type=pipeline_type)
 
         else:
             return InterfaceStatus.I2Error('Unrecognized pipeline type')
@@ -77,15 +169,25 @@ class IrisEVTXInterface(IrisModuleInterface):
         else:
             return InterfaceStatus.I2Error("Directory {} not found. Can't save file".format(base_path))
 
-    def task_files_import(self, task_args):
-
+    def task_files_import(self, task_args, pipeline_type=IrisPipelineTypes.pipeline_type_import, task=None):
+        """
+        Import the uploaded files, or split them in shards imported by tasks of their own
+        :param task_args: Arguments of the pipeline
+        :param pipeline_type: Type of the pipeline
+        :param task: Celery task running the import, the task running the module if not set
+        :return: IIStatus
+        """
         try:
-            configuration = self.get_configuration_dict()
+            configuration = self._get_module_configuration()
             if self._evidence_storage:
 
                 if configuration.is_success():
 
-                    importer = ImportDispatcher(task_self=self,
+                    shards_paths = self._create_shards(task_args, configuration.get_data())
+                    if shards_paths:
+                        return self._task_shards_import(task_args, pipeline_type, shards_paths)
+
+                    importer = ImportDispatcher(task_self=task or get_running_task() or self,
                                                 task_args=task_args,
                                                 evidence_storage=self._evidence_storage,
                                                 configuration=configuration.get_data(),
@@ -93,10 +195,10 @@ class IrisEVTXInterface(IrisModuleInterface):
                                                 )
 
                     ret = importer.import_files()
-                    if not ret:
-                        return InterfaceStatus.I2Error(logs=list(self.message_queue))
+                    if ret is None or ret.is_failure():
+                        return self._ret_failure(data=ret.get_data() if ret is not None else None)
 
-                    return InterfaceStatus.I2Success(logs=list(self.message_queue))
+                    return self._ret_success(data=ret.get_data())
 
                 else:
                     self.log.error(logs=[configuration.get_message()])
@@ -105,8 +207,175 @@ class IrisEVTXInterface(IrisModuleInterface):
                 self.log.error('Evidence storage not available')
                 logs = ['Evidence storage not available']
 
-            return InterfaceStatus.I2Error(logs=logs)
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError, message="Unspecified error", logs=logs)
 
-        except Exception as e:
+        except Exception:
             traceback.print_exc()
-            return InterfaceStatus.I2Error(logs=[traceback.print_exc()])
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError, message="Unspecified error",
+                                            logs=[traceback.format_exc()])
+
+    def _get_module_configuration(self):
+        """
+        Build the configuration dictionary from the values set on the GUI. Unlike get_configuration_dict, a value
+        is only replaced by its default when it is not set at all, so False and 0 keep their meaning
+        :return: IIStatus with the configuration as data
+        """
+        standard_configuration = self.get_configuration()
+        if not standard_configuration.is_success():
+            return standard_configuration
+
+        configuration = {}
+        try:
+            for param in standard_configuration.get_data() or []:
+                value = param.get('value')
+                if value is None or value == "":
+                    value = param.get('default')
+                configuration[param.get('param_name')] = self._cast_configuration_value(value, param.get('type'))
+
+        except Exception as e:
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError,
+                                            message="Configuration malformed: {}".format(e))
+
+        return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success", data=configuration)
+
+    def _ret_success(self, data=None):
+        """
+        Build the success status of a task. A new status is built each time, the module level ones are shared
+        by every task of the worker
+        :param data: Data of the status
+        :return: IIStatus
+        """
+        return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success", data=data,
+                                        logs=list(self.message_queue))
+
+    def _ret_failure(self, data=None):
+        """
+        Build the failure status of a task
+        :param data: Data of the status
+        :return: IIStatus
+        """
+        return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeError, message="Unspecified error", data=data,
+                                        logs=list(self.message_queue))
+
+    def _create_shards(self, task_args, configuration):
+        """
+        Split a large upload in shards if the fan-out is enabled. Shards are never split again
+        :param task_args: Arguments of the task
+        :param configuration: Module configuration
+        :return: List of the shards paths, or None if the upload is imported by this task only
+        """
+        try:
+            nb_shards = int(configuration.get("evtx_fanout_shards") or 0)
+            min_size = int(configuration.get("evtx_fanout_min_size") or 0) * 1024 * 1024
+        except (TypeError, ValueError):
+            self.log.warning("Invalid fan-out configuration, importing in a single task")
+            return None
+
+        path = Path(task_args['path'])
+        if nb_shards < 2 or task_args.get('evtx_shard') or not path.is_dir():
+            return None
+
+        upload_size = sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+        if upload_size < min_size:
+            return None
+
+        shards_paths = create_shards(path, nb_shards)
+        if len(shards_paths) < 2:
+            # Not worth it, the files go back to the upload directory
+            for shard_path in shards_paths:
+                for file_path in shard_path.iterdir():
+                    shutil.move(str(file_path), str(path / file_path.name))
+                shard_path.rmdir()
+            return None
+
+        return shards_paths
+
+    def _task_shards_import(self, task_args, pipeline_type, shards_paths):
+        """
+        Import each shard in its own task, so the import is spread over the worker nodes. The shards tasks are
+        dispatched in a chord, whose callback merges and logs their results. The pipeline task ends once they are
+        dispatched, no worker slot is held while they run. Out of a worker, the shards are imported one after
+        the other
+        :param task_args: Arguments of the task
+        :param pipeline_type: Type of the pipeline
+        :param shards_paths: Directories of the shards
+        :return: IIStatus, with the id of the task merging the results of the shards as data
+        """
+        self.log.info("Splitting the import in {} shards".format(len(shards_paths)))
+        running_task = get_running_task()
+        is_worker = running_task is not None
+        parent_task_id = running_task.request.id if is_worker else None
+
+        shards_args = []
+        for index, shard_path in enumerate(shards_paths):
+            shard_args = dict(task_args)
+            shard_args['path'] = str(shard_path)
+            shard_args['evtx_shard'] = "{}/{}".format(index + 1, len(shards_paths))
+            # Cancelling this task cancels the shards
+            shard_args['evtx_parent_task_id'] = parent_task_id
+            shards_args.append(shard_args)
+
+        # The upload directory was emptied into the shards
+        shutil.rmtree(task_args['path'], ignore_errors=True)
+
+        if not is_worker:
+            return self._merge_shards_results([self.task_files_import(task_args=shard_args,
+                                                                      pipeline_type=pipeline_type)
+                                               for shard_args in shards_args])
+
+        result = chord([import_shard.s(pipeline_type, shard_args) for shard_args in shards_args])(merge_shards.s())
+        self.log.info("{} shards dispatched, their results are merged by the task {}".format(len(shards_args),
+                                                                                           result.id))
+        return self._ret_success(data={"shards": len(shards_args), "merge_task_id": result.id})
+
+    def _merge_shards_results(self, results):
+        """
+        Merge the statuses returned by the shards tasks
+        :param results: Results of the shards tasks
+        :return: IIStatus
+        """
+        is_failure = False
+        data = []
+        for ret_t in results:
+            # Task results may be wrapped in a status by run()
+            while isinstance(ret_t, InterfaceStatus.IIStatus) and isinstance(ret_t.get_data(),
+                                                                             InterfaceStatus.IIStatus) \
+                    and ret_t.get_data() is not ret_t:
+                ret_t = ret_t.get_data()
+
+            if not isinstance(ret_t, InterfaceStatus.IIStatus):
+                self.log.error("Shard failed: {}".format(ret_t))
+                is_failure = True
+                continue
+
+            is_failure = is_failure or ret_t.is_failure()
+            data.append(ret_t.get_data())
+
+        data = merge_outcomes_summaries(data)
+        self.log.info("{} shards merged: {} files succeeded, {} failed".format(len(results), data["succeeded"],
+                                                                              data["failed"]))
+        if is_failure:
+            return self._ret_failure(data=data)
+
+        return self._ret_success(data=data)
+
+
+@shared_task(bind=True, name=SHARD_TASK_NAME)
+def import_shard(self, pipeline_type, shard_args):
+    """
+    Import a shard of an upload. The module configures itself from IRIS on the worker running the shard
+    :param pipeline_type: Type of the pipeline
+    :param shard_args: Arguments of the pipeline, with the directory of the shard as path
+    :return: IIStatus
+    """
+    return IrisEVTXInterface().task_files_import(task_args=shard_args, pipeline_type=pipeline_type, task=self)
+
+
+@shared_task(name=MERGE_TASK_NAME)
+def merge_shards(results):
+    """
+    Merge the results of the shards of an upload
+    :param results: IIStatus returned by the shards tasks
+    :return: IIStatus
+    """
+    return IrisEVTXInterface()._merge_shards_results(results)
@@ -28,7 +28,12 @@ pipeline_info = {
     "pipeline_human_name": "EVTX Pipeline",
     "pipeline_args": [
         ['index_evtx', 'required'],
-        ['hostname_evtx', 'optional']
+        ['hostname_evtx', 'optional'],
+        ['channels_evtx', 'optional'],
+        ['exclude_channels_evtx', 'optional'],
+        ['eventids_evtx', 'optional'],
+        ['start_time_evtx', 'optional'],
+        ['end_time_evtx', 'optional']
     ],
     "pipeline_update_support": True,
     "pipeline_import_support": True
@@ -105,5 +110,285 @@ module_configuration = [
         "default": False,
         "mandatory": True,
         "type": "bool"
+    },
+    {
+        "param_name": "evtx_hashing_workers",
+        "param_human_name": "Hashing workers",
+        "param_description": "Number of uploaded files hashed concurrently. 0 uses one worker per core",
+        "default": 0,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_extraction_workers",
+        "param_human_name": "Extraction workers",
+        "param_description": "Number of archives extracted concurrently. 0 uses one worker per core",
+        "default": 0,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_archive_max_depth",
+        "param_human_name": "Nested archives depth",
+        "param_description": "Maximum levels of archives within archives which are extracted. "
+                             "An archive nesting deeper ones fails to import",
+        "default": 3,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_archive_max_size",
+        "param_human_name": "Archive extraction limit (MB)",
+        "param_description": "Maximum size extracted from a single uploaded archive, nested archives included. "
+                             "0 for no limit",
+        "default": 0,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_scratch_dir",
+        "param_human_name": "Scratch directory",
+        "param_description": "Directory where uploads are extracted during imports. Each import uses its own "
+                             "sub-directory. Defaults to the system temporary directory",
+        "default": None,
+        "mandatory": False,
+        "type": "string"
+    },
+    {
+        "param_name": "evtx_scratch_budget",
+        "param_human_name": "Scratch space budget (MB)",
+        "param_description": "Maximum space used by the extractions of all the imports running on a host. "
+                             "0 for no limit",
+        "default": 0,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_scratch_min_free",
+        "param_human_name": "Scratch minimum free space (MB)",
+        "param_description": "Free space always left on the scratch partition by the extractions. -1 for no "
+                             "minimum",
+        "default": 1024,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_pipeline_queue_size",
+        "param_human_name": "Pipeline queues size",
+        "param_description": "Maximum number of items waiting between two stages of an import. Lower values "
+                             "bound the memory and scratch space used by the files in flight",
+        "default": 16,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_nb_ingestors",
+        "param_human_name": "Ingestors",
+        "param_description": "Number of ingestors used by an import. auto shares the CPUs available to the worker "
+                             "(cgroup limits included) between the imports running on the host, and scales down "
+                             "when Splunk slows down",
+        "default": "auto",
+        "mandatory": False,
+        "type": "string"
+    },
+    {
+        "param_name": "evtx_checkpoint_chunks",
+        "param_human_name": "Checkpoint interval (chunks)",
+        "param_description": "Number of 64 KiB EVTX chunks sent between two checkpoints. A failed import resumes "
+                             "each file from its last checkpoint when retried. Smaller files are sent whole, "
+                             "together, without checkpoints",
+        "default": 256,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_fanout_shards",
+        "param_human_name": "Fan-out shards",
+        "param_description": "Split large uploads in up to this number of shards of balanced size, each imported "
+                             "by its own task so the import spreads over the worker nodes. The results of the shards "
+                             "are merged by a last task once they all ended. The upload directory must be reachable "
+                             "by every worker, and every worker must import iris_evtx. 0 or 1 to disable",
+        "default": 0,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_fanout_min_size",
+        "param_human_name": "Fan-out minimum size (MB)",
+        "param_description": "Uploads smaller than this are never split",
+        "default": 1024,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_metrics_textfile",
+        "param_human_name": "Metrics textfile",
+        "param_description": "Path of a file where the metrics of the last import are written in the Prometheus "
+                             "textfile collector format. Empty to disable",
+        "default": None,
+        "mandatory": False,
+        "type": "string"
+    },
+    {
+        "param_name": "evtx_metrics_statsd",
+        "param_human_name": "Metrics StatsD server",
+        "param_description": "host:port of a StatsD server the metrics of each import are sent to, over UDP. "
+                             "Empty to disable",
+        "default": None,
+        "mandatory": False,
+        "type": "string"
+    },
+    {
+        "param_name": "evtx_splunk_hec_port",
+        "param_human_name": "Splunk HEC Port",
+        "param_description": "Port of the Splunk HTTP Event Collector, used when the events are filtered and sent "
+                             "by the module",
+        "default": 8088,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_splunk_sourcetype",
+        "param_human_name": "Splunk sourcetype",
+        "param_description": "Sourcetype of the events sent by the module, when they are filtered",
+        "default": "evtx2splunk",
+        "mandatory": False,
+        "type": "string"
+    },
+    {
+        "param_name": "evtx_ingest_engine",
+        "param_human_name": "Ingestion engine",
+        "param_description": "evtx2splunk to ingest with Evtx2Splunk, or module to decode the records in process, "
+                             "their chunks in parallel, and send them with the HEC transport of the module, which "
+                             "needs the evtx Python package. Filtered imports always use the module",
+        "default": "evtx2splunk",
+        "mandatory": False,
+        "type": "string"
+    },
+    {
+        "param_name": "evtx_hec_batch_size",
+        "param_human_name": "HEC batch size (KB)",
+        "param_description": "Maximum size of the events sent in one HEC request, before compression",
+        "default": 1024,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_hec_compress",
+        "param_human_name": "HEC compression",
+        "param_description": "Compress the HEC requests with gzip",
+        "default": True,
+        "mandatory": False,
+        "type": "bool"
+    },
+    {
+        "param_name": "evtx_hec_connections",
+        "param_human_name": "HEC connections",
+        "param_description": "Number of HEC requests sent concurrently, over persistent connections",
+        "default": 4,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_hec_use_ack",
+        "param_human_name": "HEC acknowledgements",
+        "param_description": "Wait for the indexers to acknowledge the events before considering them ingested. "
+                             "Indexer acknowledgement must be enabled on the HEC input",
+        "default": False,
+        "mandatory": False,
+        "type": "bool"
+    },
+    {
+        "param_name": "evtx_hec_ack_timeout",
+        "param_human_name": "HEC acknowledgements timeout (s)",
+        "param_description": "Maximum time waited for the indexers acknowledgements",
+        "default": 300,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_record_cache_dir",
+        "param_human_name": "Record cache directory",
+        "param_description": "Directory of the cache of the records decoded by the module. Defaults to a "
+                             "directory of the scratch directory",
+        "default": None,
+        "mandatory": False,
+        "type": "string"
+    },
+    {
+        "param_name": "evtx_record_cache_size",
+        "param_human_name": "Record cache size (MB)",
+        "param_description": "Maximum size of the cache of the decoded records, the least recently used are "
+                             "evicted. -1 disables the cache",
+        "default": 4096,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_parse_workers",
+        "param_human_name": "Parsing processes",
+        "param_description": "Number of processes decoding the chunks of the EVTX files when the module decodes the "
+                             "records. 0 shares the available cores between the running imports, 1 decodes them "
+                             "in the worker itself",
+        "default": 0,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_hec_sink",
+        "param_human_name": "HEC sink",
+        "param_description": "direct to send the events to the HEC during the import, or spool to write them to a "
+                             "local spool, forwarded to the HEC in the background by the worker. The import then "
+                             "ends as soon as the events are decoded, whatever the state of Splunk. Spooling needs "
+                             "the evtx Python package",
+        "default": "direct",
+        "mandatory": False,
+        "type": "string"
+    },
+    {
+        "param_name": "evtx_spool_dir",
+        "param_human_name": "Spool directory",
+        "param_description": "Directory of the spool. Defaults to a directory of the scratch directory",
+        "default": None,
+        "mandatory": False,
+        "type": "string"
+    },
+    {
+        "param_name": "evtx_spool_segment_size",
+        "param_human_name": "Spool segment size (MB)",
+        "param_description": "Size of the events of a spool segment, before compression. A segment is forwarded "
+                             "at once, and sent again whole if it fails",
+        "default": 16,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_spool_max_size",
+        "param_human_name": "Spool maximum size (MB)",
+        "param_description": "Maximum size of the spool on disk, the imports wait for the forwarder beyond. "
+                             "0 for no limit",
+        "default": 0,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_progress_interval",
+        "param_human_name": "Progress interval (s)",
+        "param_description": "Seconds between two reports of the progress of an import, to the task state and "
+                             "the logs. -1 disables them",
+        "default": 30,
+        "mandatory": False,
+        "type": "int"
+    },
+    {
+        "param_name": "evtx_state_dir",
+        "param_human_name": "State directory",
+        "param_description": "Persistent directory shared by every worker, such as a volume next to the IRIS data, "
+                             "holding the state of the imports of the cases: the EVTX files ingested from archives, "
+                             "the watermarks of the updates, the checkpoints and the cancellations. Defaults to a "
+                             "directory of the scratch directory, only shared by the workers of a host",
+        "default": None,
+        "mandatory": False,
+        "type": "string"
     }
 ]
\ No newline at end of file
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#
+#  IRIS EVTX Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+# IMPORTS ------------------------------------------------
+import iris_evtx.EVTXConcurrency as concurrency
+from iris_evtx.EVTXConcurrency import AdaptiveIngestors
+
+
+# CONTENT ------------------------------------------------
+MAXIMUM = 8
+# Bytes ingested per second by each ingestor
+INGESTOR_THROUGHPUT = 1000
+
+
+def ingest(ingestors: AdaptiveIngestors, hec_capacity: int, count: int):
+    """
+    Account ingestions against a HEC serving at most hec_capacity ingestors at once
+    :return: Numbers of ingestors used by the ingestions
+    """
+    used = []
+    for _ in range(count):
+        used.append(ingestors.current)
+        throughput = min(ingestors.current, hec_capacity) * INGESTOR_THROUGHPUT
+        ingestors.record(throughput, 1)
+    return used
+
+
+def test_ingestors_follow_the_hec_down_and_up(monkeypatch):
+    monkeypatch.setattr(concurrency, "get_auto_ingestors", lambda concurrent_imports: MAXIMUM)
+    ingestors = AdaptiveIngestors()
+
+    ingest(ingestors, MAXIMUM, 10)
+    assert ingestors.current == MAXIMUM
+
+    # The HEC slows down
+    ingest(ingestors, 2, 40)
+    assert ingestors.current == 4
+    # More ingestors are tried now and then, but not kept while they don't help
+    assert ingestors._probe_interval > concurrency.PROBE_INTERVAL
+
+    # The HEC recovers
+    used = ingest(ingestors, MAXIMUM, concurrency.MAX_PROBE_INTERVAL + 2)
+    assert ingestors.current == MAXIMUM
+    assert used[-1] == MAXIMUM
+
+    # And slows down again
+    ingest(ingestors, 1, 10)
+    assert ingestors.current < MAXIMUM
+
+
+def test_fixed_ingestors_are_not_adapted():
+    ingestors = AdaptiveIngestors(configured=3)
+    ingest(ingestors, 3, 10)
+    ingest(ingestors, 1, 10)
+    assert ingestors.current == 3
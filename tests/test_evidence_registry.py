@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+#  IRIS EVTX Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+from pathlib import Path
+
+from iris_evtx.EVTXEvidenceRegistry import EvidenceRegistry
+from iris_evtx.EVTXManifest import ManifestEntry
+
+
+# CONTENT ------------------------------------------------
+class PerItemStorage(object):
+    """
+    Evidence storage exposing only the per-file methods
+    """
+
+    def __init__(self, registered=()):
+        self.registered = set(registered)
+        self.lookups = []
+        self.added = []
+
+    def is_evidence_registered(self, sha256, case_id):
+        self.lookups.append((sha256, case_id))
+        return sha256 in self.registered
+
+    def add_evidence(self, **evidence):
+        self.added.append(evidence)
+        self.registered.add(evidence["sha256"])
+
+
+class BulkStorage(PerItemStorage):
+    """
+    Evidence storage exposing the bulk methods as well
+    """
+
+    def __init__(self, registered=()):
+        super().__init__(registered)
+        self.bulk_lookups = []
+        self.bulk_inserts = []
+
+    def get_registered_evidences(self, sha256_list, case_id):
+        self.bulk_lookups.append((list(sha256_list), case_id))
+        return [fhash for fhash in sha256_list if fhash in self.registered]
+
+    def add_evidences(self, evidences):
+        self.bulk_inserts.append(list(evidences))
+        self.registered.update(evidence["sha256"] for evidence in evidences)
+
+
+def make_entry(name, sha256, size=1024):
+    return ManifestEntry(path=Path("/uploads") / name, size=size, sha256=sha256, mtime=0.0)
+
+
+def test_bulk_lookup_and_insert():
+    storage = BulkStorage()
+    registry = EvidenceRegistry(storage, case_id=3, user_id=7)
+
+    entries = [make_entry("Security.evtx", "a" * 64), make_entry("System.evtx", "b" * 64)]
+    assert registry.register(entries) == 2
+
+    assert storage.bulk_lookups == [(["a" * 64, "b" * 64], 3)]
+    assert len(storage.bulk_inserts) == 1
+    assert storage.lookups == [] and storage.added == []
+
+    evidences = storage.bulk_inserts[0]
+    assert [evidence["filename"] for evidence in evidences] == ["Security.evtx", "System.evtx"]
+    assert all(evidence["case_id"] == 3 and evidence["user_id"] == 7 for evidence in evidences)
+    assert evidences[0]["size"] == 1024
+    assert evidences[0]["description"] == "[Auto] EVTX file named Security.evtx"
+
+
+def test_per_item_fallback():
+    storage = PerItemStorage()
+    registry = EvidenceRegistry(storage, case_id=3, user_id=7)
+
+    entries = [make_entry("Security.evtx", "a" * 64), make_entry("System.evtx", "b" * 64)]
+    assert registry.register(entries, description="Uploaded {}") == 2
+
+    assert storage.lookups == [("a" * 64, 3), ("b" * 64, 3)]
+    assert [evidence["sha256"] for evidence in storage.added] == ["a" * 64, "b" * 64]
+    assert storage.added[1]["description"] == "Uploaded System.evtx"
+
+
+def test_registered_hashes_are_skipped():
+    for storage in (BulkStorage(registered={"a" * 64}), PerItemStorage(registered={"a" * 64})):
+        registry = EvidenceRegistry(storage, case_id=3, user_id=7)
+
+        entries = [make_entry("Security.evtx", "a" * 64),
+                   make_entry("System.evtx", "b" * 64),
+                   make_entry("System (copy).evtx", "b" * 64)]
+        assert registry.get_registered([entry.sha256 for entry in entries]) == {"a" * 64}
+        assert registry.register(entries) == 1
+
+        added = storage.bulk_inserts[0] if isinstance(storage, BulkStorage) else storage.added
+        assert [evidence["filename"] for evidence in added] == ["System.evtx"]
+
+
+def test_nothing_to_register():
+    storage = BulkStorage(registered={"a" * 64})
+    registry = EvidenceRegistry(storage, case_id=3, user_id=7)
+
+    assert registry.get_registered([]) == set()
+    assert registry.register([make_entry("Security.evtx", "a" * 64)]) == 0
+    assert storage.bulk_inserts == []
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+#
+#  IRIS EVTX Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+# IMPORTS ------------------------------------------------
+import logging
+
+from benchmarks.evtx_generator import write_evtx
+from benchmarks.run_benchmarks import InMemoryEvidenceStorage, get_configuration
+from benchmarks.stub_splunk import StubSplunk
+from iris_evtx.EVTXImportDispatcher import ImportDispatcher
+
+
+# CONTENT ------------------------------------------------
+def test_outcomes_count_the_events_sent(tmp_path):
+    upload_dir = tmp_path / "upload"
+    upload_dir.mkdir()
+    records = write_evtx(upload_dir / "Security.evtx", "Security", 4)
+
+    with StubSplunk() as stub:
+        configuration = get_configuration(stub, tmp_path / "scratch", None,
+                                          {"evtx_splunk_hec_port": stub.hec_port, "evtx_ingest_engine": "module",
+                                           "evtx_parse_workers": 1, "evtx_progress_interval": -1})
+        task_args = {"pipeline_args": {"index_evtx": "evtx", "hostname_evtx": None, "eventids_evtx": "4624"},
+                     "user": "test", "user_id": 1, "case_name": "test", "path": str(upload_dir), "case_id": 1,
+                     "is_update": False}
+        ret = ImportDispatcher(None, task_args, InMemoryEvidenceStorage(), configuration,
+                               logging.getLogger("test_import_outcomes")).import_files()
+
+    assert ret.is_success()
+    # The filtered out records are not counted
+    assert 0 < stub.stats.events < records
+    assert [outcome["records"] for outcome in ret.get_data()["files"]] == [stub.stats.events]
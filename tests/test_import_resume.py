@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+#  IRIS EVTX Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import logging
+
+import pytest
+
+import iris_evtx.EVTXHecTransport as hec_transport
+from benchmarks.evtx_generator import write_evtx
+from benchmarks.run_benchmarks import InMemoryEvidenceStorage, get_configuration
+from benchmarks.stub_splunk import StubSplunk
+from iris_evtx.EVTXChunks import list_chunks
+from iris_evtx.EVTXImportDispatcher import ImportDispatcher
+from iris_evtx.EVTXStateStore import StateStore, get_state_path
+
+
+# CONTENT ------------------------------------------------
+INDEX = "evtx"
+CASE_ID = 1
+NB_CHUNKS = 8
+CHECKPOINT_CHUNKS = 2
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(hec_transport, "RETRY_BACKOFF", 0)
+
+
+def import_upload(tmp_path, stub, name, storage):
+    """
+    Import an upload holding a single EVTX file, with the record engine
+    :return: (IIStatus, number of records of the file, configuration)
+    """
+    upload_dir = tmp_path / name
+    upload_dir.mkdir()
+    records = write_evtx(upload_dir / "Security.evtx", "Security", NB_CHUNKS)
+    assert len(list_chunks(upload_dir / "Security.evtx")) == NB_CHUNKS
+
+    configuration = get_configuration(stub, tmp_path / "scratch", None,
+                                      {"evtx_splunk_hec_port": stub.hec_port, "evtx_ingest_engine": "module",
+                                       "evtx_checkpoint_chunks": CHECKPOINT_CHUNKS, "evtx_hec_batch_size": 16,
+                                       "evtx_hec_connections": 1, "evtx_parse_workers": 1,
+                                       "evtx_record_cache_size": -1, "evtx_progress_interval": -1})
+    task_args = {"pipeline_args": {"index_evtx": INDEX, "hostname_evtx": None}, "user": "test", "user_id": 1,
+                 "case_name": "test", "path": str(upload_dir), "case_id": CASE_ID, "is_update": False}
+    dispatcher = ImportDispatcher(None, task_args, storage, configuration, logging.getLogger("test_import_resume"))
+    return dispatcher.import_files(), records, configuration
+
+
+def test_failed_import_resumes_from_its_checkpoints(tmp_path):
+    storage = InMemoryEvidenceStorage()
+
+    with StubSplunk() as stub:
+        stub.hec_fail_after = 60
+        ret, records, configuration = import_upload(tmp_path, stub, "first", storage)
+        first_events = stub.stats.events
+
+    assert not ret.is_success()
+    assert 0 < first_events < records
+
+    # The state is kept under the scratch directory by default, so the retry finds the checkpoints
+    state_path = get_state_path(configuration)
+    assert state_path.parent == tmp_path / "scratch" / "state"
+    with StateStore(state_path) as state_store:
+        sha256 = ret.get_data()["files"][0]["sha256"]
+        chunk_index, _ = state_store.get_checkpoint(sha256, INDEX)
+    assert 0 <= chunk_index < NB_CHUNKS - 1
+
+    with StubSplunk() as stub:
+        ret, _, _ = import_upload(tmp_path, stub, "second", storage)
+        second_events = stub.stats.events
+
+    assert ret.is_success()
+    # Only the events of the chunks after the checkpoint are sent again, the slice in flight twice
+    assert second_events < records
+    assert first_events + second_events >= records
+    slice_records = records * CHECKPOINT_CHUNKS // NB_CHUNKS
+    assert first_events + second_events - records <= slice_records
+
+    with StateStore(state_path) as state_store:
+        assert state_store.get_checkpoint(sha256, INDEX) is None
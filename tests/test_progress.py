@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+#
+#  IRIS EVTX Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+# IMPORTS ------------------------------------------------
+import logging
+from types import SimpleNamespace
+
+import pytest
+from celery import Celery
+from celery.contrib.testing.worker import start_worker
+
+# The module interface comes with IRIS
+pytest.importorskip("iris_interface.IrisModuleInterface")
+
+import iris_evtx.EVTXProgress as progress
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+from benchmarks.evtx_generator import write_evtx
+from benchmarks.run_benchmarks import InMemoryEvidenceStorage, get_configuration
+from benchmarks.stub_splunk import StubSplunk
+from iris_evtx.EVTXImportDispatcher import ImportDispatcher
+from iris_evtx.IrisEVTXInterface import CANCEL_HOOK_NAME, CANCEL_HOOK_UI_NAME, IrisEVTXInterface
+
+
+# CONTENT ------------------------------------------------
+NB_FILES = 4
+CASE_ID = 1
+
+
+@pytest.fixture
+def module(tmp_path, monkeypatch):
+    """
+    Module instances configured as IRIS does, against a stand-in Splunk
+    :return: (StubSplunk, evidence storage)
+    """
+    storage = InMemoryEvidenceStorage()
+    with StubSplunk() as stub:
+        configuration = get_configuration(stub, tmp_path / "scratch", None,
+                                          {"evtx_splunk_hec_port": stub.hec_port, "evtx_ingest_engine": "module",
+                                           "evtx_parse_workers": 1, "evtx_state_dir": str(tmp_path / "state")})
+
+        def init(self):
+            self.log = logging.getLogger("test_progress_{}".format(id(self)))
+            self.log.setLevel(logging.INFO)
+            self.message_queue = []
+            self.set_log_handler()
+            self._evidence_storage = storage
+
+        def get_configuration_status(self):
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success",
+                                            data=[{"param_name": name, "value": value, "type": None}
+                                                  for name, value in configuration.items()])
+
+        monkeypatch.setattr(IrisEVTXInterface, "__init__", init)
+        monkeypatch.setattr(IrisEVTXInterface, "get_configuration", get_configuration_status)
+        monkeypatch.setattr(progress, "CANCEL_CHECK_INTERVAL", 0)
+        yield stub, storage
+
+
+def make_upload(tmp_path):
+    upload_dir = tmp_path / "upload"
+    upload_dir.mkdir()
+    records = sum(write_evtx(upload_dir / "Host{}.evtx".format(index), "Security", 1,
+                             computer="WKS-{}".format(index), seed=index)
+                  for index in range(NB_FILES))
+    task_args = {"pipeline_args": {"index_evtx": "evtx", "hostname_evtx": None}, "user": "test", "user_id": 1,
+                 "case_name": "test", "path": str(upload_dir), "case_id": CASE_ID, "is_update": False}
+    return task_args, records
+
+
+def test_hook_cancels_the_imports_of_the_case(tmp_path, module, monkeypatch):
+    stub, storage = module
+    ingest_round = ImportDispatcher._ingest_round
+
+    def cancel_from_the_case(self, e2s, round_slices):
+        # The operator triggers the hook of the module from the case while the first file is ingested
+        if not stub.stats.events:
+            ret = IrisEVTXInterface().hooks_handler(CANCEL_HOOK_NAME, CANCEL_HOOK_UI_NAME,
+                                                    [SimpleNamespace(case_id=CASE_ID)])
+            assert ret.is_success()
+        return ingest_round(self, e2s, round_slices)
+
+    monkeypatch.setattr(ImportDispatcher, "_ingest_round", cancel_from_the_case)
+    task_args, records = make_upload(tmp_path)
+
+    ret = IrisEVTXInterface().pipeline_handler("pipeline_import", task_args)
+
+    assert not ret.is_success()
+    outcomes = ret.get_data()["files"]
+    assert any("Import cancelled" in outcome["errors"] for outcome in outcomes)
+    assert 0 < stub.stats.events < records
+    # The files ingested before stopping are registered
+    assert len(storage.evidences) == sum(1 for outcome in outcomes if outcome["registered"])
+
+    # The next imports of the case are not cancelled
+    (tmp_path / "next").mkdir()
+    ret = IrisEVTXInterface().pipeline_handler("pipeline_import", make_upload(tmp_path / "next")[0])
+    assert ret.is_success()
+
+
+def test_progress_is_published_with_the_logs(tmp_path, module):
+    stub, storage = module
+    app = Celery("test_progress", broker="memory://", backend="cache+memory://")
+    app.conf.update(task_serializer="pickle", result_serializer="pickle", accept_content=["pickle", "json"],
+                    result_accept_content=["pickle", "json"])
+
+    # Stands in for the pipeline task of IRIS, which runs the module out of its own task
+    @app.task(bind=True, name="test_progress.pipeline")
+    def pipeline(self, pipeline_type, pipeline_data):
+        iris_module = IrisEVTXInterface()
+        ret = iris_module.pipeline_handler(pipeline_type, pipeline_data)
+        iris_module.log.info("Pipeline done")
+        return ret.is_success(), app.AsyncResult(self.request.id).state, app.AsyncResult(self.request.id).info
+
+    task_args, records = make_upload(tmp_path)
+    with start_worker(app, pool="threads", concurrency=1, perform_ping_check=False):
+        is_success, state, meta = pipeline.delay("pipeline_import", task_args).get(timeout=120)
+
+    assert is_success
+    assert state == "PROGRESS"
+    # The last progress report outlives the logs that follow it
+    assert meta["logs"][-1] == "Pipeline done"
+    assert meta["progress"]["files_done"] == NB_FILES
+    assert meta["progress"]["bytes_done"] == meta["progress"]["bytes_total"]
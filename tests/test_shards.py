@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+#  IRIS EVTX Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import logging
+
+import pytest
+from celery import Celery
+from celery.contrib.testing.worker import start_worker
+
+# The module interface comes with IRIS
+pytest.importorskip("iris_interface.IrisModuleInterface")
+
+import iris_interface.IrisInterfaceStatus as InterfaceStatus
+import iris_evtx.IrisEVTXInterface as evtx_interface
+from benchmarks.evtx_generator import write_evtx
+from benchmarks.run_benchmarks import InMemoryEvidenceStorage, get_configuration
+from benchmarks.stub_splunk import StubSplunk
+from iris_evtx.EVTXImportDispatcher import ImportDispatcher
+from iris_evtx.IrisEVTXInterface import IrisEVTXInterface
+
+
+# CONTENT ------------------------------------------------
+NB_FILES = 6
+NB_SHARDS = 3
+
+
+class RecordingDispatcher(ImportDispatcher):
+    """
+    Records the task running each import
+    """
+    imports = []
+
+    def import_files(self):
+        # The module is not bound to a request out of a worker
+        RecordingDispatcher.imports.append(getattr(getattr(self.task, "request", None), "id", None))
+        return super().import_files()
+
+
+@pytest.fixture
+def module(tmp_path, monkeypatch):
+    """
+    Module instances configured as IRIS does, against a stand-in Splunk
+    :return: (StubSplunk, evidence storage)
+    """
+    storage = InMemoryEvidenceStorage()
+    with StubSplunk() as stub:
+        configuration = get_configuration(stub, tmp_path / "scratch", None,
+                                          {"evtx_splunk_hec_port": stub.hec_port, "evtx_ingest_engine": "module",
+                                           "evtx_parse_workers": 1, "evtx_fanout_shards": NB_SHARDS,
+                                           "evtx_fanout_min_size": 0, "evtx_progress_interval": -1})
+
+        def init(self):
+            self.log = logging.getLogger("test_shards")
+            self.message_queue = []
+            self._evidence_storage = storage
+
+        def get_configuration_status(self):
+            return InterfaceStatus.IIStatus(code=InterfaceStatus.I2CodeSuccess, message="Success",
+                                            data=[{"param_name": name, "value": value, "type": None}
+                                                  for name, value in configuration.items()])
+
+        monkeypatch.setattr(IrisEVTXInterface, "__init__", init)
+        monkeypatch.setattr(IrisEVTXInterface, "get_configuration", get_configuration_status)
+        monkeypatch.setattr(evtx_interface, "ImportDispatcher", RecordingDispatcher)
+        RecordingDispatcher.imports = []
+        yield stub, storage
+
+
+def make_upload(tmp_path):
+    upload_dir = tmp_path / "upload"
+    upload_dir.mkdir()
+    records = sum(write_evtx(upload_dir / "Host{}.evtx".format(index), "Security", 1,
+                             computer="WKS-{}".format(index), seed=index)
+                  for index in range(NB_FILES))
+    task_args = {"pipeline_args": {"index_evtx": "evtx", "hostname_evtx": None}, "user": "test", "user_id": 1,
+                 "case_name": "test", "path": str(upload_dir), "case_id": 1, "is_update": False}
+    return task_args, records
+
+
+def test_shards_are_imported_by_tasks_of_their_own(tmp_path, module):
+    stub, storage = module
+    app = Celery("test_shards", broker="memory://", backend="cache+memory://")
+    app.conf.update(task_serializer="pickle", result_serializer="pickle", accept_content=["pickle", "json"],
+                    result_accept_content=["pickle", "json"])
+
+    # Stands in for the pipeline task of IRIS, which runs the module out of its own task
+    @app.task(name="test_shards.pipeline")
+    def pipeline(pipeline_type, pipeline_data):
+        return IrisEVTXInterface().pipeline_handler(pipeline_type, pipeline_data)
+
+    task_args, records = make_upload(tmp_path)
+    with start_worker(app, pool="threads", concurrency=NB_SHARDS + 1, perform_ping_check=False):
+        ret = pipeline.delay("pipeline_import", task_args).get(timeout=120)
+        assert ret.is_success()
+        assert ret.get_data()["shards"] == NB_SHARDS
+
+        merged = app.AsyncResult(ret.get_data()["merge_task_id"]).get(timeout=120)
+
+    assert merged.is_success()
+    assert merged.get_data()["succeeded"] == NB_FILES
+    assert stub.stats.events == records
+    assert len(storage.evidences) == NB_FILES
+
+    # Each shard ran in a task of its own
+    task_ids = RecordingDispatcher.imports
+    assert len(task_ids) == NB_SHARDS
+    assert None not in task_ids and len(set(task_ids)) == NB_SHARDS
+
+
+def test_shards_are_imported_in_turn_out_of_a_worker(tmp_path, module):
+    stub, storage = module
+    task_args, records = make_upload(tmp_path)
+
+    ret = IrisEVTXInterface().pipeline_handler("pipeline_import", task_args)
+
+    assert ret.is_success()
+    assert ret.get_data()["succeeded"] == NB_FILES
+    assert stub.stats.events == records
+    assert len(RecordingDispatcher.imports) == NB_SHARDS
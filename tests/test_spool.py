@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+#
+#  IRIS EVTX Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# IMPORTS ------------------------------------------------
+import logging
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import iris_evtx.EVTXHecTransport as hec_transport
+import iris_evtx.EVTXSpool as spool
+from benchmarks.evtx_generator import write_evtx
+from benchmarks.run_benchmarks import InMemoryEvidenceStorage, get_configuration
+from benchmarks.stub_splunk import StubSplunk
+from iris_evtx.EVTXImportDispatcher import ImportDispatcher
+from iris_evtx.EVTXSpool import CLAIM_SUFFIX, REJECTED_DIR_NAME, SEGMENT_SUFFIX, SpoolForwarder, SpoolWriter
+from iris_evtx.EVTXStateStore import STATE_DB_NAME, StateStore
+
+
+# CONTENT ------------------------------------------------
+INDEX = "evtx"
+CASE_ID = 1
+SPOOLED_FILE = ("a" * 64, "b" * 64, "collection.zip", "WKS-0001", "Security")
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(hec_transport, "RETRY_BACKOFF", 0)
+    monkeypatch.setattr(spool, "MIN_BACKOFF", 0.1)
+    monkeypatch.setattr(spool, "MAX_BACKOFF", 0.2)
+    monkeypatch.setattr(spool, "POLL_INTERVAL", 0.1)
+
+
+@pytest.fixture
+def forwarder():
+    forwarder = SpoolForwarder()
+    yield forwarder
+    forwarder.stop(timeout=10)
+
+
+def wait_for(predicate, timeout: float = 30):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def make_events(count: int):
+    return [{"host": "WKS-0001", "source": "Security.evtx", "index": INDEX, "event": {"EventID": event_id}}
+            for event_id in range(count)]
+
+
+def get_segments(spool_dir, pattern: str = "*"):
+    return sorted(path.name for path in (spool_dir / INDEX).glob(pattern))
+
+
+def spool_events(spool_dir, state_dir, count: int):
+    """
+    Spool events of a file of the case, as an import does
+    :return: Names of the segments
+    """
+    flushed = []
+
+    def on_flush(segments):
+        with StateStore(state_dir / STATE_DB_NAME) as state_store:
+            state_store.add_spooled_files(segments, CASE_ID, INDEX, [SPOOLED_FILE])
+        flushed.extend(segments)
+
+    writer = SpoolWriter(spool_dir, INDEX, on_flush=on_flush)
+    writer.send(make_events(count))
+    writer.flush()
+    return flushed
+
+
+def get_rejected(state_dir):
+    with StateStore(state_dir / STATE_DB_NAME) as state_store:
+        return state_store.get_rejected_spooled(CASE_ID, INDEX)
+
+
+def test_segments_are_forwarded_once_flushed(tmp_path, forwarder):
+    spool_dir = tmp_path / "spool"
+    with StubSplunk() as stub:
+        configuration = get_configuration(stub, tmp_path / "scratch", None,
+                                          {"evtx_splunk_hec_port": stub.hec_port,
+                                           "evtx_state_dir": str(tmp_path / "state")})
+        forwarder.start(spool_dir, configuration)
+
+        writer = SpoolWriter(spool_dir, INDEX, segment_size=1024)
+        writer.send(make_events(100))
+        assert get_segments(spool_dir, "*" + SEGMENT_SUFFIX) == []
+
+        writer.flush()
+        forwarder.notify()
+        assert wait_for(lambda: stub.stats.events == 100)
+        assert wait_for(lambda: get_segments(spool_dir) == [])
+        assert writer.batches > 1
+
+
+def test_discarded_events_are_not_forwarded(tmp_path):
+    spool_dir = tmp_path / "spool"
+    flushed = []
+    writer = SpoolWriter(spool_dir, INDEX, segment_size=1024, on_flush=flushed.extend)
+    writer.send(make_events(100))
+    writer.discard()
+
+    assert get_segments(spool_dir) == []
+    assert flushed == []
+
+
+def test_segments_are_retried_while_splunk_is_down(tmp_path, forwarder):
+    spool_dir = tmp_path / "spool"
+    state_dir = tmp_path / "state"
+    with StubSplunk() as stub:
+        configuration = get_configuration(stub, tmp_path / "scratch", None,
+                                          {"evtx_splunk_hec_port": stub.hec_port, "evtx_state_dir": str(state_dir)})
+    # Nothing listens on the ports anymore
+    segments = spool_events(spool_dir, state_dir, 50)
+    forwarder.start(spool_dir, configuration)
+    time.sleep(1)
+    assert get_segments(spool_dir, "*" + SEGMENT_SUFFIX) == segments
+
+    with StubSplunk(management_port=configuration["evtx_splunk_mport"],
+                    hec_port=configuration["evtx_splunk_hec_port"]) as stub:
+        forwarder.notify()
+        assert wait_for(lambda: stub.stats.events == 50)
+        assert wait_for(lambda: get_segments(spool_dir) == [])
+
+    assert get_rejected(state_dir) == []
+    assert not (spool_dir / REJECTED_DIR_NAME).exists()
+
+
+def test_segments_are_retried_while_splunk_is_busy(tmp_path, forwarder):
+    spool_dir = tmp_path / "spool"
+    state_dir = tmp_path / "state"
+    with StubSplunk() as stub:
+        stub.hec_status = 503
+        configuration = get_configuration(stub, tmp_path / "scratch", None,
+                                          {"evtx_splunk_hec_port": stub.hec_port, "evtx_state_dir": str(state_dir)})
+        segments = spool_events(spool_dir, state_dir, 50)
+        forwarder.start(spool_dir, configuration)
+        time.sleep(1)
+        assert stub.stats.events == 0
+        assert wait_for(lambda: get_segments(spool_dir, "*" + SEGMENT_SUFFIX) == segments)
+
+        stub.hec_status = 200
+        forwarder.notify()
+        assert wait_for(lambda: stub.stats.events == 50)
+
+    assert get_rejected(state_dir) == []
+
+
+@pytest.mark.parametrize("status", spool.REJECTED_STATUSES)
+def test_rejected_segments_are_recorded(tmp_path, forwarder, status):
+    spool_dir = tmp_path / "spool"
+    state_dir = tmp_path / "state"
+    with StubSplunk() as stub:
+        stub.hec_status = status
+        configuration = get_configuration(stub, tmp_path / "scratch", None,
+                                          {"evtx_splunk_hec_port": stub.hec_port, "evtx_state_dir": str(state_dir)})
+        segments = spool_events(spool_dir, state_dir, 50)
+        forwarder.start(spool_dir, configuration)
+
+        rejected_dir = spool_dir / REJECTED_DIR_NAME / INDEX
+        assert wait_for(lambda: rejected_dir.is_dir() and sorted(path.name for path in rejected_dir.iterdir())
+                        == segments)
+        assert get_segments(spool_dir) == []
+
+    rejected = get_rejected(state_dir)
+    assert [row[:5] for row in rejected] == [SPOOLED_FILE]
+    assert str(status) in rejected[0][5]
+
+    # Spooling the file again clears it
+    with StateStore(state_dir / STATE_DB_NAME) as state_store:
+        state_store.add_spooled_files(["next" + SEGMENT_SUFFIX], CASE_ID, INDEX, [SPOOLED_FILE])
+    assert get_rejected(state_dir) == []
+
+
+def test_only_the_claims_of_dead_local_workers_are_released(tmp_path, forwarder):
+    spool_dir = tmp_path / "spool"
+    segments = spool_events(spool_dir, tmp_path / "state", 10)
+    segments += spool_events(spool_dir, tmp_path / "state", 10)
+
+    dead_worker = subprocess.Popen([sys.executable, "-c", ""])
+    dead_worker.wait()
+    # The workers of the other hosts can't be checked from here, the same pid may be alive there
+    local_claim = "{}.{}.{}{}".format(segments[0], socket.gethostname(), dead_worker.pid, CLAIM_SUFFIX)
+    remote_claim = "{}.{}.{}{}".format(segments[1], "other-host.example.com", dead_worker.pid, CLAIM_SUFFIX)
+    (spool_dir / INDEX / segments[0]).rename(spool_dir / INDEX / local_claim)
+    (spool_dir / INDEX / segments[1]).rename(spool_dir / INDEX / remote_claim)
+
+    forwarder.spool_dir = spool_dir
+    forwarder.recover_stale_claims()
+
+    assert get_segments(spool_dir) == sorted([segments[0], remote_claim])
+
+
+def test_rejected_upload_is_imported_again(tmp_path):
+    state_dir = tmp_path / "state"
+    storage = InMemoryEvidenceStorage()
+    log = logging.getLogger("test_spool")
+
+    def import_upload(stub, name, is_update):
+        upload_dir = tmp_path / name
+        upload_dir.mkdir()
+        records = write_evtx(upload_dir / "Security.evtx", "Security", 2)
+        configuration = get_configuration(stub, tmp_path / "scratch", None,
+                                          {"evtx_splunk_hec_port": stub.hec_port, "evtx_state_dir": str(state_dir),
+                                           "evtx_hec_sink": "spool", "evtx_ingest_engine": "module",
+                                           "evtx_spool_dir": str(tmp_path / "spool"), "evtx_parse_workers": 1})
+        task_args = {"pipeline_args": {"index_evtx": INDEX, "hostname_evtx": None}, "user": "test", "user_id": 1,
+                     "case_name": "test", "path": str(upload_dir), "case_id": CASE_ID, "is_update": is_update}
+        return ImportDispatcher(None, task_args, storage, configuration, log).import_files(), records
+
+    try:
+        with StubSplunk() as stub:
+            stub.hec_status = 413
+            ret, records = import_upload(stub, "first", False)
+            # The events are spooled, the import does not wait for Splunk
+            assert ret.is_success()
+            assert wait_for(lambda: len(get_rejected(state_dir)) == 1)
+
+            stub.hec_status = 200
+            ret, _ = import_upload(stub, "second", True)
+            assert ret.is_success()
+            assert ret.get_data()["rejected"] == ["Security.evtx"]
+            assert ret.get_data()["succeeded"] == 1
+            assert wait_for(lambda: stub.stats.events == records)
+            assert get_rejected(state_dir) == []
+
+            # Imported for good this time
+            ret, _ = import_upload(stub, "third", True)
+            assert ret.get_data()["rejected"] == []
+            assert ret.get_data()["succeeded"] == 0
+
+    finally:
+        spool.spool_forwarder.stop(timeout=10)
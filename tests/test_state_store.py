@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+#  IRIS EVTX Source Code
+#  Copyright (C) 2021 - Airbus CyberSecurity (SAS)
+#  ir@cyberactionlab.net
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 3 of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+# IMPORTS ------------------------------------------------
+import logging
+import zipfile
+
+from benchmarks.evtx_generator import write_evtx
+from benchmarks.run_benchmarks import InMemoryEvidenceStorage, get_configuration
+from benchmarks.stub_splunk import StubSplunk
+from iris_evtx.EVTXImportDispatcher import ImportDispatcher
+
+
+# CONTENT ------------------------------------------------
+INDEX = "evtx"
+CASE_ID = 1
+
+
+def import_upload(tmp_path, upload_dir, is_update: bool = False, pipeline_args: dict = None):
+    """
+    Import an upload, keeping the state of the imports in a persistent directory
+    :return: (IIStatus, number of events received by Splunk)
+    """
+    with StubSplunk() as stub:
+        configuration = get_configuration(stub, tmp_path / "scratch", None,
+                                          {"evtx_splunk_hec_port": stub.hec_port, "evtx_ingest_engine": "module",
+                                           "evtx_parse_workers": 1, "evtx_state_dir": str(tmp_path / "state")})
+        task_args = {"pipeline_args": dict({"index_evtx": INDEX, "hostname_evtx": None}, **(pipeline_args or {})),
+                     "user": "test", "user_id": 1, "case_name": "test", "path": str(upload_dir),
+                     "case_id": CASE_ID, "is_update": is_update}
+        # Every import has its own dispatcher and evidences, only the state directory is kept between them
+        ret = ImportDispatcher(None, task_args, InMemoryEvidenceStorage(), configuration,
+                               logging.getLogger("test_state_store")).import_files()
+        return ret, stub.stats.events
+
+
+def test_logs_found_in_several_archives_are_sent_once(tmp_path):
+    logs_dir = tmp_path / "logs"
+    logs_dir.mkdir()
+    security_records = write_evtx(logs_dir / "Security.evtx", "Security", 2)
+    system_records = write_evtx(logs_dir / "System.evtx", "System", 1)
+
+    def make_upload(name, logs):
+        upload_dir = tmp_path / name
+        upload_dir.mkdir()
+        with zipfile.ZipFile(upload_dir / "ORC_{}.zip".format(name), "w") as archive:
+            for log in logs:
+                archive.write(logs_dir / log, "Event/{}".format(log))
+            # The archives differ, so the second one is not skipped as a whole
+            archive.writestr("collection.txt", name)
+        return upload_dir
+
+    ret, events = import_upload(tmp_path, make_upload("first", ["Security.evtx"]))
+    assert ret.is_success()
+    assert events == security_records
+
+    ret, events = import_upload(tmp_path, make_upload("second", ["Security.evtx", "System.evtx"]))
+    assert ret.is_success()
+    assert ret.get_data()["succeeded"] == 1
+    assert events == system_records
+
+
+def write_log(tmp_path, name: str, nb_chunks: int):
+    """
+    Upload a Security log holding nb_chunks chunks, the same records each time
+    :return: (upload directory, number of records)
+    """
+    upload_dir = tmp_path / name
+    upload_dir.mkdir()
+    return upload_dir, write_evtx(upload_dir / "Security.evtx", "Security", nb_chunks)
+
+
+def test_updates_only_send_the_records_past_the_watermark(tmp_path):
+    upload_dir, records = write_log(tmp_path, "first", 4)
+    ret, events = import_upload(tmp_path, upload_dir)
+    assert ret.is_success()
+    assert events == records
+
+    # The log grew since
+    upload_dir, grown_records = write_log(tmp_path, "grown", 6)
+    ret, events = import_upload(tmp_path, upload_dir, is_update=True)
+    assert ret.is_success()
+    assert events == grown_records - records
+
+    upload_dir, _ = write_log(tmp_path, "same", 6)
+    ret, events = import_upload(tmp_path, upload_dir, is_update=True)
+    assert ret.is_success()
+    assert events == 0
+
+
+def test_watermarks_of_a_filtered_import_only_apply_to_its_filter(tmp_path):
+    logon_filter = {"eventids_evtx": "4624"}
+    upload_dir, _ = write_log(tmp_path, "first", 4)
+    ret, first_events = import_upload(tmp_path, upload_dir, pipeline_args=logon_filter)
+    assert ret.is_success()
+    assert first_events > 0
+
+    # Same filter, only the records past its watermark
+    upload_dir, _ = write_log(tmp_path, "grown", 6)
+    ret, grown_events = import_upload(tmp_path, upload_dir, is_update=True, pipeline_args=logon_filter)
+    assert ret.is_success()
+    assert 0 < grown_events < first_events
+
+    # Another filter did not see the records yet
+    upload_dir, _ = write_log(tmp_path, "failures", 6)
+    ret, events = import_upload(tmp_path, upload_dir, is_update=True, pipeline_args={"eventids_evtx": "4625"})
+    assert ret.is_success()
+    assert events > 0
+
+    # Neither did an unfiltered update, whose watermark then covers every filter
+    upload_dir, records = write_log(tmp_path, "whole", 6)
+    ret, events = import_upload(tmp_path, upload_dir, is_update=True)
+    assert ret.is_success()
+    assert events == records
+
+    upload_dir, _ = write_log(tmp_path, "processes", 6)
+    ret, events = import_upload(tmp_path, upload_dir, is_update=True, pipeline_args={"eventids_evtx": "4688"})
+    assert ret.is_success()
+    assert events == 0